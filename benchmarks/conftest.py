@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+_results: list[dict[str, Any]] = []
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--bench-json",
+        default=None,
+        help="Write benchmark results to this file as JSON.",
+    )
+
+
+@pytest.fixture(scope="session")
+def bench_results() -> list[dict[str, Any]]:
+    """Benchmarks append one dict per measurement to this list."""
+    return _results
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:
+    path = session.config.getoption("--bench-json")
+    if not path or not _results:
+        return
+    Path(path).write_text(
+        json.dumps(
+            {
+                "timestamp": time.time(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": _results,
+            },
+            indent=2,
+        ),
+        encoding="utf-8",
+    )
@@ -0,0 +1,121 @@
+"""
+Filesystem hits and time spent in `get_consts()` during add-on startup, with
+and without the cache.
+
+Run with `just bench`.
+"""
+
+from __future__ import annotations
+
+import builtins
+import json
+import os
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from ankiutils import consts
+from ankiutils.consts import clear_consts_cache, get_consts
+from tests.helpers import install_fake_addon_manager
+
+# Modules of an add-on that call `get_consts()` while it starts up
+ENTRY_POINTS = [
+    "myaddon",
+    "myaddon.config",
+    "myaddon.errors",
+    "myaddon.log",
+    "myaddon.gui.dialog",
+    "myaddon.gui.menu",
+    "myaddon.updates",
+    "myaddon.server",
+]
+STARTUPS = 200
+
+
+@pytest.fixture
+def addons_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    addon_dir = tmp_path / "myaddon"
+    addon_dir.mkdir()
+    (addon_dir / "meta.json").write_text(json.dumps({"name": "My Add-on"}))
+    (addon_dir / "manifest.json").write_text(json.dumps({"ankiweb_id": "123"}))
+    (addon_dir / ".version").write_text("1.0.0")
+    install_fake_addon_manager(monkeypatch, tmp_path)
+    yield tmp_path
+    clear_consts_cache()
+
+
+def _count_hits(monkeypatch: pytest.MonkeyPatch, addons_dir: Path) -> dict[str, int]:
+    hits = {"open": 0, "stat": 0}
+    real_open, real_stat = builtins.open, os.stat
+    prefix = str(addons_dir)
+
+    def counting_open(file: Any, *args: Any, **kwargs: Any) -> Any:
+        if str(file).startswith(prefix):
+            hits["open"] += 1
+        return real_open(file, *args, **kwargs)
+
+    def counting_stat(path: Any, *args: Any, **kwargs: Any) -> Any:
+        if str(path).startswith(prefix):
+            hits["stat"] += 1
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+    monkeypatch.setattr(os, "stat", counting_stat)
+    return hits
+
+
+def _startup(cached: bool, check_files: bool) -> None:
+    for module in ENTRY_POINTS:
+        if cached:
+            get_consts(module, check_files=check_files)
+        else:
+            # What every call did before the cache
+            consts._load_consts(consts.mw.addonManager.addonFromModule(module))
+
+
+@pytest.mark.parametrize(
+    ("mode", "cached", "check_files"),
+    [
+        ("uncached", False, False),
+        ("cached", True, False),
+        ("cached_check_files", True, True),
+    ],
+)
+def test_consts_startup(
+    addons_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    mode: str,
+    cached: bool,
+    check_files: bool,
+    bench_results: list[dict[str, Any]],
+) -> None:
+    hits = _count_hits(monkeypatch, addons_dir)
+    _startup(cached, check_files)
+    startup_hits = dict(hits)
+    started_at = time.perf_counter()
+    for _ in range(STARTUPS):
+        clear_consts_cache()
+        _startup(cached, check_files)
+    per_startup_us = (time.perf_counter() - started_at) / STARTUPS * 1e6
+    monkeypatch.undo()
+
+    bench_results.append(
+        {
+            "benchmark": "consts_startup",
+            "mode": mode,
+            "calls": len(ENTRY_POINTS),
+            "opens": startup_hits["open"],
+            "stats": startup_hits["stat"],
+            "startup_us": per_startup_us,
+        }
+    )
+    print(
+        f"\nget_consts() x{len(ENTRY_POINTS)} ({mode}): "
+        f"{startup_hits['open']} opens, {startup_hits['stat']} stats, "
+        f"{per_startup_us:.1f} us"
+    )
+    # meta.json, manifest.json and .version
+    assert startup_hits["open"] == 3 * (1 if cached else len(ENTRY_POINTS))
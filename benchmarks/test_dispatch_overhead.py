@@ -0,0 +1,81 @@
+"""
+Per-call overhead of Flask routing vs. lean dispatch for API calls.
+
+Run with `just bench`.
+"""
+
+from __future__ import annotations
+
+import io
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+import structlog
+from werkzeug.test import EnvironBuilder
+
+from ankiutils.consts import AddonConsts
+from ankiutils.sveltekit import _APIKEY, SveltekitServer
+
+CALLS = 20000
+
+
+def _start_response(status: str, headers: list[tuple[str, str]], *args: Any) -> Any:
+    return None
+
+
+def _per_call_us(server: SveltekitServer, environ: dict[str, Any]) -> float:
+    app = server.wsgi_app
+    started_at = time.perf_counter()
+    for _ in range(CALLS):
+        env = environ.copy()
+        env["wsgi.input"] = io.BytesIO(b"payload")
+        for _chunk in app(env, _start_response):
+            pass
+    return (time.perf_counter() - started_at) / CALLS * 1e6
+
+
+@pytest.mark.parametrize("dialog", [False, True])
+def test_dispatch_overhead(
+    tmp_path: Path, dialog: bool, bench_results: list[dict[str, Any]]
+) -> None:
+    consts = AddonConsts("addon", "addon", tmp_path, "0.0.1", None, {}, None, None)
+    dialog_obj: Any = object()
+    headers = {"Authorization": f"Bearer {_APIKEY}"}
+    if dialog:
+        headers["qt-widget-id"] = str(id(dialog_obj))
+    environ = EnvironBuilder(
+        path="/api/svc/noop",
+        method="POST",
+        data=b"payload",
+        headers=list(headers.items()),
+    ).get_environ()
+
+    results = {}
+    for lean in (False, True):
+        server = SveltekitServer(
+            consts, structlog.stdlib.get_logger(), lean_dispatch=lean
+        )
+        if dialog:
+            server.add_proto_handler_for_dialog(
+                dialog_obj, "svc", "noop", lambda data: data
+            )
+        else:
+            server.add_proto_handler("svc", "noop", lambda data: data)
+        results["lean" if lean else "flask"] = _per_call_us(server, environ)
+
+    bench_results.append(
+        {
+            "benchmark": "dispatch_overhead",
+            "handler": "dialog" if dialog else "global",
+            "flask_us": results["flask"],
+            "lean_us": results["lean"],
+        }
+    )
+    print(
+        f"\nper-call overhead ({'dialog' if dialog else 'global'} handler): "
+        f"flask {results['flask']:.1f} us, lean {results['lean']:.1f} us "
+        f"({results['flask'] / results['lean']:.1f}x)"
+    )
+    assert results["lean"] < results["flask"]
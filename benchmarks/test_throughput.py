@@ -0,0 +1,165 @@
+"""
+Throughput and latency of a running `SveltekitServer` under concurrent load.
+
+Run with `just bench`. Results are printed and, with `--bench-json`,
+written as JSON so runs can be compared.
+"""
+
+from __future__ import annotations
+
+import http.client
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import pytest
+import structlog
+
+from ankiutils.consts import AddonConsts
+from ankiutils.sveltekit import _APIKEY, SveltekitServer, init_server
+
+CONCURRENCY_LEVELS = (1, 4, 16)
+AUTH = {"Authorization": f"Bearer {_APIKEY}", "Content-Type": "application/proto"}
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    expected_status: int
+    requests: int = 400
+    body: bytes | None = None
+    dialog: bool = False
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+SCENARIOS = [
+    Scenario("static", "GET", "/_app/immutable/app.js", 200),
+    Scenario("static_streamed", "GET", "/media.bin", 200, requests=40),
+    Scenario("api", "POST", "/api/bench/echo", 200, body=b"x" * 64, headers=AUTH),
+    Scenario(
+        "api_dialog",
+        "POST",
+        "/api/bench/dialog_echo",
+        200,
+        body=b"x" * 64,
+        dialog=True,
+        headers=AUTH,
+    ),
+    Scenario("not_found", "GET", "/missing.js", 404),
+]
+
+# Any object works as a dialog for handler registration
+_dialog: Any = object()
+
+
+def _quiet_logger() -> structlog.stdlib.BoundLogger:
+    std_logger = logging.getLogger("ankiutils.benchmarks")
+    std_logger.disabled = True
+    return structlog.stdlib.BoundLogger(
+        std_logger, processors=[structlog.stdlib.render_to_log_kwargs], context={}
+    )
+
+
+@pytest.fixture(scope="module", params=["flask", "lean"])
+def server(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> Iterator[SveltekitServer]:
+    addon_dir = tmp_path_factory.mktemp("addon")
+    web_dir = addon_dir / "web" / "sveltekit" / "_app" / "immutable"
+    web_dir.mkdir(parents=True)
+    (web_dir / "app.js").write_bytes(b"console.log('benchmark');\n" * 800)
+    (addon_dir / "web" / "sveltekit" / "media.bin").write_bytes(bytes(2 * 1024 * 1024))
+    consts = AddonConsts(
+        "addon", "addon", Path(addon_dir), "0.0.1", None, {}, None, None
+    )
+    server = init_server(consts, _quiet_logger(), lean_dispatch=request.param == "lean")
+    server.add_proto_handler("bench", "echo", lambda data: data)
+    server.add_proto_handler_for_dialog(
+        _dialog, "bench", "dialog_echo", lambda data: data
+    )
+    yield server
+    server.shutdown()
+
+
+def _run_load(
+    server: SveltekitServer, scenario: Scenario, concurrency: int
+) -> dict[str, Any]:
+    host, port = server.get_host(), server.get_port()
+    headers = dict(scenario.headers)
+    if scenario.dialog:
+        headers["qt-widget-id"] = str(id(_dialog))
+    per_worker = max(scenario.requests // concurrency, 1)
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker() -> None:
+        nonlocal errors
+        conn = http.client.HTTPConnection(host, port)
+        local_latencies = []
+        local_errors = 0
+        barrier.wait()
+        for _ in range(per_worker):
+            started_at = time.perf_counter()
+            conn.request(scenario.method, scenario.path, scenario.body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            local_latencies.append(time.perf_counter() - started_at)
+            if resp.status != scenario.expected_status:
+                local_errors += 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+    }
+
+
+@pytest.mark.parametrize("concurrency", CONCURRENCY_LEVELS)
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda s: s.name)
+def test_throughput(
+    server: SveltekitServer,
+    scenario: Scenario,
+    concurrency: int,
+    bench_results: list[dict[str, Any]],
+) -> None:
+    dispatch = "lean" if server.lean_dispatch else "flask"
+    result = _run_load(server, scenario, concurrency)
+    bench_results.append(
+        {
+            "benchmark": "throughput",
+            "scenario": scenario.name,
+            "dispatch": dispatch,
+            "concurrency": concurrency,
+            **result,
+        }
+    )
+    print(
+        f"\n{scenario.name:<16} {dispatch:<5} c={concurrency:<3} "
+        f"{result['rps']:8.0f} req/s  p50 {result['p50_ms']:6.2f} ms  "
+        f"p99 {result['p99_ms']:6.2f} ms"
+    )
+    assert result["errors"] == 0
@@ -1,17 +1,63 @@
 from __future__ import annotations
 
-from typing import Any
+import atexit
+import contextlib
+import dataclasses
+import threading
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any, Callable, TypeVar, overload
 
 from aqt import mw
+from typing_extensions import TypeAlias
 
 from ._internal import is_testing
+from .config_schema import MISSING, ConfigSchema, ConfigValueError, view_class
+
+if TYPE_CHECKING:
+    from aqt.qt import QTimer
+
+T = TypeVar("T")
+
+# Called with the key, old value (None if unset) and new value of changed keys
+ChangeCallback: TypeAlias = Callable[[str, Any, Any], None]
 
 
 class Config:
-    def __init__(self, module: str) -> None:
+    """The config of an add-on.
+
+    Changes are written to disk right away, unless `write_delay` is given: then
+    they are written on the main thread once no further changes were made for
+    `write_delay` seconds, and on profile close and shutdown at the latest.
+    Changes made in a `batch()` block are written once at the end of it.
+
+    If a `schema` is given (see `set_schema()`), values are validated when the
+    config is loaded or changed, and `typed()` gives attribute access to them.
+    `on_change()` registers callbacks for changes to keys."""
+
+    def __init__(
+        self,
+        module: str,
+        write_delay: float | None = None,
+        schema: ConfigSchema | type | None = None,
+    ) -> None:
         self._module = module
         self._config: dict[str, Any] = {}
         self._defaults: dict[str, Any] = {}
+        # Incremented whenever the config is changed through this object or by
+        # the user in the config editor
+        self.revision = 0
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._batch_depth = 0
+        # Debounces writes in tests; a QTimer on the main thread is used in Anki
+        self._write_timer: threading.Timer | None = None
+        self._main_timer: QTimer | None = None
+        self._schema: ConfigSchema | None = None
+        # Invalid values found in the last validation of the whole config
+        self.validation_errors: list[ConfigValueError] = []
+        self._change_callbacks: dict[str | None, list[ChangeCallback]] = {}
+        self._views: dict[type | None, Any] = {}
         if not is_testing():
             self._module = mw.addonManager.addonFromModule(module)
             self._config = mw.addonManager.getConfig(self._module)
@@ -19,20 +65,171 @@ class Config:
             mw.addonManager.setConfigUpdatedAction(
                 self._module, self._config_updated_action
             )
+        if write_delay is not None:
+            atexit.register(self.flush)
+            if not is_testing():
+                from aqt import gui_hooks  # noqa: PLC0415
+
+                gui_hooks.profile_will_close.append(self.flush)
+        if schema is not None:
+            self.set_schema(schema)
+
+    def set_schema(self, schema: ConfigSchema | type | None = None) -> None:
+        """Validate the config against `schema`, which can be a `ConfigSchema` or
+        a dataclass; by default, it's derived from the add-on's default config.
+        Invalid and missing values are replaced with their defaults."""
+        if schema is None:
+            schema = ConfigSchema.from_defaults(self._defaults)
+        elif not isinstance(schema, ConfigSchema):
+            schema = ConfigSchema.from_dataclass(schema)
+        with self._lock:
+            self._schema = schema
+            values, self.validation_errors = schema.validate_all(
+                self._config, self._defaults
+            )
+            changes = self._update(values)
+            if changes:
+                self.revision += 1
+        self._notify(changes)
 
     def _config_updated_action(self, new_config: dict) -> None:
-        self._config.update(new_config)
+        with self._lock:
+            values = {**self._config, **new_config}
+            if self._schema is not None:
+                # Keep the current values in place of invalid ones
+                values, self.validation_errors = self._schema.validate_all(
+                    values, self._config
+                )
+            changes = self._update(values)
+            self.revision += 1
+        self._notify(changes)
+
+    def _update(self, values: dict[str, Any]) -> list[tuple[str, Any, Any]]:
+        # Updated in place, as typed views hold on to the dict
+        changes = []
+        for key in [key for key in self._config if key not in values]:
+            changes.append((key, self._config.pop(key), None))
+        for key, value in values.items():
+            old = self._config.get(key, MISSING)
+            if old is MISSING or old != value:
+                self._config[key] = value
+                changes.append((key, None if old is MISSING else old, value))
+        return changes
+
+    def on_change(self, callback: ChangeCallback, key: str | None = None) -> None:
+        """Call `callback` when the value of `key` (or of any key) changes."""
+        with self._lock:
+            self._change_callbacks.setdefault(key, []).append(callback)
 
-    def _write(self) -> None:
+    def _notify(self, changes: list[tuple[str, Any, Any]]) -> None:
+        if not changes or not self._change_callbacks:
+            return
+        for key, old, new in changes:
+            for callback in (
+                *self._change_callbacks.get(key, ()),
+                *self._change_callbacks.get(None, ()),
+            ):
+                callback(key, old, new)
+
+    @overload
+    def typed(self, cls: type[T]) -> T: ...
+
+    @overload
+    def typed(self) -> Any: ...
+
+    def typed(self, cls: type | None = None) -> Any:
+        """Return an object whose attributes are the values of the config.
+
+        With a dataclass `cls`, this is an instance of a subclass of it with the
+        dataclass's fields; otherwise, the keys of the schema are used.
+        Assigning to attributes (unless the dataclass is frozen) sets the values.
+        """
+        view = self._views.get(cls)
+        if view is None:
+            if cls is None:
+                if self._schema is None:
+                    self.set_schema()
+                assert self._schema is not None
+                names = list(self._schema.fields)
+                base: type = type(f"{self._module}_config", (), {})
+            else:
+                names = [field.name for field in dataclasses.fields(cls)]
+                base = cls
+            view = object.__new__(view_class(base, names, self._config, self))
+            self._views[cls] = view
+        return view
+
+    def _write(self, config: dict[str, Any]) -> None:
         if not is_testing():
-            mw.addonManager.writeConfig(self._module, self._config)
+            mw.addonManager.writeConfig(self._module, config)
+
+    def _schedule_write(self) -> None:
+        if self.write_delay is None:
+            self.flush()
+            return
+        if not is_testing():
+            # writeConfig() rewrites meta.json without locking, so it must not run
+            # on another thread while the main thread may read it
+            mw.taskman.run_on_main(self._restart_main_timer)
+            return
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+            self._write_timer = threading.Timer(self.write_delay, self.flush)
+            self._write_timer.daemon = True
+            self._write_timer.start()
+
+    def _restart_main_timer(self) -> None:
+        from aqt.qt import QTimer  # noqa: PLC0415
+
+        assert self.write_delay is not None
+        if self._main_timer is None:
+            self._main_timer = QTimer()
+            self._main_timer.setSingleShot(True)
+            self._main_timer.timeout.connect(self.flush)
+        self._main_timer.start(int(self.write_delay * 1000))
+
+    def flush(self) -> None:
+        """Write pending changes to disk."""
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+                self._write_timer = None
+            if self._dirty:
+                self._dirty = False
+                self._write(self._config.copy())
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[Config]:
+        """Write the changes made in the block once at the end of it, instead of
+        after each change."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                pending = not self._batch_depth and self._dirty
+            if pending:
+                self._schedule_write()
 
     def __getitem__(self, key: str) -> Any:
         return self._config[key]
 
     def __setitem__(self, key: str, value: Any) -> None:
-        self._config[key] = value
-        self._write()
+        if self._schema is not None:
+            value = self._schema.validate(key, value)
+        with self._lock:
+            old = self._config.get(key, MISSING)
+            self._config[key] = value
+            self.revision += 1
+            self._dirty = True
+            in_batch = self._batch_depth > 0
+        if not in_batch:
+            self._schedule_write()
+        if old is MISSING or old != value:
+            self._notify([(key, None if old is MISSING else old, value)])
 
     def get(self, key: str, default: Any = None) -> Any:
         return self._config.get(key, default)
@@ -0,0 +1,152 @@
+"""
+Schemas that add-on configs are validated against.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import sys
+import typing
+from collections.abc import Iterable, Mapping
+from typing import Any, Callable, Literal, Union
+
+if sys.version_info >= (3, 10):
+    from types import UnionType
+else:
+    UnionType = Union
+
+MISSING: Any = dataclasses.MISSING
+
+
+class ConfigValueError(ValueError):
+    def __init__(self, key: str, value: Any) -> None:
+        super().__init__(f"Invalid value for config key {key!r}: {value!r}")
+        self.key = key
+        self.value = value
+
+
+@dataclasses.dataclass
+class SchemaField:
+    name: str
+    # Types that values must be instances of, or None to allow any value
+    types: tuple[type, ...] | None
+    default: Any = MISSING
+    default_factory: Callable[[], Any] | None = None
+
+    def check(self, value: Any) -> bool:
+        if self.types is None:
+            return True
+        if isinstance(value, bool) and bool not in self.types:
+            return False
+        if isinstance(value, int) and float in self.types:
+            return True
+        return isinstance(value, self.types)
+
+    def get_default(self) -> Any:
+        if self.default_factory is not None:
+            return self.default_factory()
+        return self.default
+
+
+def _runtime_types(hint: Any) -> tuple[type, ...] | None:
+    """Classes that values of the type `hint` are instances of, or None if they
+    can't be checked with `isinstance()`."""
+    origin = typing.get_origin(hint)
+    if origin is None:
+        return (hint,) if isinstance(hint, type) and hint is not Any else None
+    if origin is Union or origin is UnionType:
+        types: list[type] = []
+        for arg in typing.get_args(hint):
+            arg_types = _runtime_types(arg)
+            if arg_types is None:
+                return None
+            types.extend(arg_types)
+        return tuple(types)
+    if origin is Literal:
+        return None
+    return (origin,) if isinstance(origin, type) else None
+
+
+class ConfigSchema:
+    """The expected types and defaults of config keys. Keys that aren't in the
+    schema are allowed and not validated."""
+
+    def __init__(self, fields: Iterable[SchemaField]) -> None:
+        self.fields = {field.name: field for field in fields}
+
+    @classmethod
+    def from_dataclass(cls, datacls: type) -> ConfigSchema:
+        """Create a schema from the fields of the dataclass `datacls`."""
+        hints = typing.get_type_hints(datacls)
+        return cls(
+            SchemaField(
+                field.name,
+                _runtime_types(hints[field.name]),
+                field.default,
+                None
+                if field.default_factory is dataclasses.MISSING
+                else field.default_factory,
+            )
+            for field in dataclasses.fields(datacls)
+        )
+
+    @classmethod
+    def from_defaults(cls, defaults: Mapping[str, Any]) -> ConfigSchema:
+        """Create a schema from the add-on's default config, requiring values of
+        the same type as the defaults (any value where the default is null)."""
+        return cls(
+            SchemaField(key, None if value is None else (type(value),), value)
+            for key, value in defaults.items()
+        )
+
+    def validate(self, key: str, value: Any) -> Any:
+        field = self.fields.get(key)
+        if field is not None and not field.check(value):
+            raise ConfigValueError(key, value)
+        return value
+
+    def validate_all(
+        self, values: Mapping[str, Any], fallback: Mapping[str, Any]
+    ) -> tuple[dict[str, Any], list[ConfigValueError]]:
+        """Return a copy of `values` where invalid values are replaced with the
+        value in `fallback` or the default, and missing values are filled in
+        with defaults, along with the errors for the invalid values."""
+        result = dict(values)
+        errors = []
+        for key, field in self.fields.items():
+            if key in result:
+                if field.check(result[key]):
+                    continue
+                errors.append(ConfigValueError(key, result[key]))
+                if key in fallback and field.check(fallback[key]):
+                    result[key] = fallback[key]
+                    continue
+                del result[key]
+            default = field.get_default()
+            if default is not MISSING:
+                result[key] = default
+        return result, errors
+
+
+def view_class(
+    base: type, names: Iterable[str], values: dict[str, Any], config: Any
+) -> type:
+    """Create a subclass of `base` whose attributes `names` read the items of
+    `values` and assign the items of `config`."""
+
+    def field_property(name: str) -> property:
+        def get(_: Any) -> Any:
+            try:
+                return values[name]
+            except KeyError:
+                raise AttributeError(name) from None
+
+        def set_(_: Any, value: Any) -> None:
+            config[name] = value
+
+        return property(get, set_)
+
+    namespace: dict[str, Any] = {name: field_property(name) for name in names}
+    namespace["__qualname__"] = base.__qualname__
+    namespace["__module__"] = base.__module__
+    return type(base.__name__, (base,), namespace)
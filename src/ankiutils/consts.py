@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 from aqt import mw
+from typing_extensions import TypeAlias
 
 from ._internal import is_testing
 
@@ -50,12 +53,67 @@ def _get_support_channels(manifest: dict[str, Any]) -> dict[str, str]:
     return manifest.get("support_channels", {})
 
 
-def get_consts(module: str) -> AddonConsts:
+# Modification times of the manifest and version files, None if missing
+_FilesState: TypeAlias = tuple[Optional[int], Optional[int]]
+
+# Maps add-on folder names to their constants and the state of their files when
+# the constants were read
+_consts_cache: dict[str, tuple[AddonConsts, _FilesState]] = {}
+_consts_lock = threading.Lock()
+
+
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _files_state(addon_dir: Path) -> _FilesState:
+    return (_mtime_ns(addon_dir / "manifest.json"), _mtime_ns(addon_dir / ".version"))
+
+
+def get_consts(module: str, check_files: bool = False) -> AddonConsts:
+    """Return the constants of the add-on containing `module`.
+
+    They are read on the first call for each add-on and cached. If `check_files`
+    is true, they are read again if the manifest or version file changed since."""
     if is_testing():
         return AddonConsts(
             "addon", "addon", Path.cwd() / "src", "0.0.1", None, {}, None, None
         )
-    meta = mw.addonManager.addon_meta(mw.addonManager.addonFromModule(module))
+    addon = mw.addonManager.addonFromModule(module)
+    consts = _cached_consts(addon, check_files)
+    if consts is not None:
+        return consts
+    with _consts_lock:
+        consts = _cached_consts(addon, check_files)
+        if consts is not None:
+            return consts
+        addon_dir = Path(mw.addonManager.addonsFolder(addon))
+        state = _files_state(addon_dir)
+        consts = _load_consts(addon)
+        _consts_cache[addon] = (consts, state)
+        return consts
+
+
+def _cached_consts(addon: str, check_files: bool) -> AddonConsts | None:
+    cached = _consts_cache.get(addon)
+    if cached is None:
+        return None
+    consts, state = cached
+    if check_files and _files_state(consts.dir) != state:
+        return None
+    return consts
+
+
+def clear_consts_cache() -> None:
+    with _consts_lock:
+        _consts_cache.clear()
+
+
+def _load_consts(addon: str) -> AddonConsts:
+    meta = mw.addonManager.addon_meta(addon)
     module = meta.dir_name
     addon_dir = Path(mw.addonManager.addonsFolder(module))
     manifest = read_manifest(addon_dir)
@@ -0,0 +1,272 @@
+"""
+Persistent spool of error reports that are delivered by a background thread.
+
+Reports are stored as `{id}.json` files, with their attachments in an `{id}`
+directory next to them. Attachments are copied first and the JSON file is
+renamed into place last, so a report only becomes visible once it's complete;
+leftovers of interrupted writes are removed on startup.
+"""
+
+from __future__ import annotations
+
+import atexit
+import dataclasses
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any, Callable
+
+from typing_extensions import TypeAlias
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 10
+# Delay after the first failed delivery; doubled after each further failure
+DEFAULT_RETRY_DELAY = 10.0
+DEFAULT_MAX_RETRY_DELAY = 60 * 60.0
+# How often the spool is checked when no reports were added
+DEFAULT_POLL_INTERVAL = 5 * 60.0
+
+_REPORT_SUFFIX = ".json"
+_TEMP_SUFFIX = ".tmp"
+
+
+@dataclasses.dataclass
+class SpooledReport:
+    id: str
+    payload: dict[str, Any]
+    attachments: list[Path]
+    size: int
+
+
+@dataclasses.dataclass
+class SpoolStats:
+    pending: int
+    bytes: int
+    delivered: int
+    # Reports removed to stay under the size limit
+    dropped: int
+    # Consecutive failed deliveries
+    failures: int
+    last_success: float | None
+    last_error: str | None
+
+
+# Delivers a batch of reports, raising an exception if that failed
+Transport: TypeAlias = Callable[[list[SpooledReport]], None]
+
+
+class PartialDeliveryError(Exception):
+    """Raised by transports that delivered only the first `delivered` reports of
+    a batch. Those reports are removed; the others are retried."""
+
+    def __init__(self, delivered: int, reason: str) -> None:
+        super().__init__(f"Only {delivered} reports were delivered: {reason}")
+        self.delivered = delivered
+
+
+class ErrorSpool:
+    """Stores error reports in `directory` and delivers them in batches of up to
+    `batch_size` using `transport` on a background thread (see `start()`).
+
+    Failed deliveries are retried with exponential backoff. If the stored
+    reports take up more than `max_bytes`, the oldest ones are dropped."""
+
+    def __init__(
+        self,
+        directory: str | Path,
+        transport: Transport,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        max_retry_delay: float = DEFAULT_MAX_RETRY_DELAY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self.directory = Path(directory)
+        self.transport = transport
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.delivered = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_success: float | None = None
+        self.last_error: str | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._remove_incomplete()
+
+    def _remove_incomplete(self) -> None:
+        for path in self.directory.iterdir():
+            incomplete = path.name.endswith(_TEMP_SUFFIX) or (
+                path.is_dir() and not self._report_path(path.name).exists()
+            )
+            if incomplete:
+                _remove(path)
+
+    def _report_path(self, report_id: str) -> Path:
+        return self.directory / f"{report_id}{_REPORT_SUFFIX}"
+
+    def enqueue(
+        self,
+        payload: dict[str, Any],
+        attachments: Iterable[Path] = (),
+        sync: bool = True,
+    ) -> str:
+        """Store a report with a JSON-serializable `payload` and copies of the
+        `attachments` files, and return its ID. With `sync`, the report is
+        synced to disk, so that it survives a system crash."""
+        report_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        attachments_dir = self.directory / report_id
+        temp_dir = attachments_dir.with_name(report_id + _TEMP_SUFFIX)
+        report_path = self._report_path(report_id)
+        temp_path = report_path.with_name(report_path.name + _TEMP_SUFFIX)
+        names = []
+        for attachment in attachments:
+            temp_dir.mkdir(exist_ok=True)
+            shutil.copyfile(attachment, temp_dir / attachment.name)
+            names.append(attachment.name)
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"payload": payload, "attachments": names}, file, default=repr)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        with self._lock:
+            if names:
+                os.replace(temp_dir, attachments_dir)
+            os.replace(temp_path, report_path)
+            self._enforce_size_limit()
+        self._wakeup.set()
+        return report_id
+
+    def _enforce_size_limit(self) -> None:
+        reports = self._load_reports()
+        total = sum(report.size for report in reports)
+        for report in reports:
+            if total <= self.max_bytes:
+                break
+            self._delete(report)
+            total -= report.size
+            self.dropped += 1
+
+    def _load_reports(self, limit: int | None = None) -> list[SpooledReport]:
+        reports = []
+        for path in sorted(self.directory.glob(f"*{_REPORT_SUFFIX}")):
+            report_id = path.name[: -len(_REPORT_SUFFIX)]
+            try:
+                with open(path, encoding="utf-8") as file:
+                    data = json.load(file)
+                attachments = [
+                    self.directory / report_id / name for name in data["attachments"]
+                ]
+                size = path.stat().st_size + sum(
+                    attachment.stat().st_size for attachment in attachments
+                )
+            except (OSError, ValueError, KeyError, TypeError):
+                # Unreadable reports can't be delivered
+                _remove(path)
+                _remove(self.directory / report_id)
+                continue
+            reports.append(SpooledReport(report_id, data["payload"], attachments, size))
+            if limit is not None and len(reports) >= limit:
+                break
+        return reports
+
+    def _delete(self, report: SpooledReport) -> None:
+        _remove(self._report_path(report.id))
+        _remove(self.directory / report.id)
+
+    def pending(self) -> list[SpooledReport]:
+        with self._lock:
+            return self._load_reports()
+
+    def stats(self) -> SpoolStats:
+        reports = self.pending()
+        return SpoolStats(
+            pending=len(reports),
+            bytes=sum(report.size for report in reports),
+            delivered=self.delivered,
+            dropped=self.dropped,
+            failures=self.failures,
+            last_success=self.last_success,
+            last_error=self.last_error,
+        )
+
+    def deliver_batch(self) -> int:
+        """Deliver the oldest pending reports. Returns how many were delivered;
+        raises the exception of the transport if it failed (reports delivered
+        before a `PartialDeliveryError` are removed)."""
+        with self._lock:
+            reports = self._load_reports(self.batch_size)
+        if not reports:
+            return 0
+        try:
+            self.transport(reports)
+        except PartialDeliveryError as exc:
+            self._remove_delivered(reports[: exc.delivered])
+            self.failures += 1
+            self.last_error = repr(exc)
+            raise
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = repr(exc)
+            raise
+        self._remove_delivered(reports)
+        self.failures = 0
+        self.last_success = time.time()
+        return len(reports)
+
+    def _remove_delivered(self, reports: list[SpooledReport]) -> None:
+        with self._lock:
+            for report in reports:
+                self._delete(report)
+        self.delivered += len(reports)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                if self.deliver_batch():
+                    continue
+            except Exception:
+                # Recorded in the stats; new reports don't cut the backoff short
+                delay = min(
+                    self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay
+                )
+                self._stopping.wait(delay)
+                continue
+            self._wakeup.wait(self.poll_interval)
+
+    def start(self) -> None:
+        """Start delivering reports in the background."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="ErrorSpool", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        """Stop the background thread. Pending reports stay on disk."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
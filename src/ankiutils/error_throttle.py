@@ -0,0 +1,104 @@
+"""
+Rate limiting of error reports.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+# Parts of paths that differ between machines
+_PATH_PREFIX_RE = re.compile(r"^.*?[/\\](?:addons21|site-packages)[/\\]")
+
+
+def _normalize_path(path: str) -> str:
+    return _PATH_PREFIX_RE.sub("", path).replace("\\", "/")
+
+
+def exception_fingerprint(exception: BaseException) -> str:
+    """Return a key that is the same for exceptions of the same type raised
+    through the same code, regardless of their message or where the add-on is
+    installed."""
+    parts = [f"{type(exception).__module__}.{type(exception).__qualname__}"]
+    tb = exception.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        parts.append(
+            f"{_normalize_path(code.co_filename)}:{code.co_name}:{tb.tb_lineno}"
+        )
+        tb = tb.tb_next
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class ReportThrottle:
+    """Decides which exceptions get reported.
+
+    An exception isn't reported if one with the same fingerprint was reported
+    less than `repeat_window` seconds ago (the last `max_fingerprints` reported
+    fingerprints are remembered), or if more than `burst` reports were made in
+    quick succession; reports are allowed again at `rate` per second.
+    Exceptions that weren't reported are counted and returned by `pop_repeats()`,
+    so they can be attached to the next report."""
+
+    def __init__(
+        self,
+        rate: float = 1 / 60,
+        burst: int = 3,
+        repeat_window: float = 10 * 60.0,
+        max_fingerprints: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.repeat_window = repeat_window
+        self.max_fingerprints = max_fingerprints
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        # Maps fingerprints to the time they were last reported
+        self._reported: OrderedDict[str, float] = OrderedDict()
+        # Maps fingerprints to (exception type, count) of unreported exceptions
+        self._repeats: dict[str, tuple[str, int]] = {}
+
+    def _take_token(self, now: float) -> bool:
+        self._tokens = min(
+            float(self.burst), self._tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def should_report(self, exception: BaseException) -> bool:
+        fingerprint = exception_fingerprint(exception)
+        now = self._clock()
+        with self._lock:
+            reported_at = self._reported.get(fingerprint)
+            recent = reported_at is not None and now - reported_at < self.repeat_window
+            if recent or not self._take_token(now):
+                name, count = self._repeats.get(
+                    fingerprint, (type(exception).__qualname__, 0)
+                )
+                self._repeats[fingerprint] = (name, count + 1)
+                return False
+            self._reported[fingerprint] = now
+            self._reported.move_to_end(fingerprint)
+            while len(self._reported) > self.max_fingerprints:
+                self._reported.popitem(last=False)
+            return True
+
+    def pop_repeats(self) -> dict[str, dict[str, Any]]:
+        """Return and reset the counts of exceptions that weren't reported,
+        by fingerprint."""
+        with self._lock:
+            repeats, self._repeats = self._repeats, {}
+        return {
+            fingerprint: {"exception": name, "count": count}
+            for fingerprint, (name, count) in repeats.items()
+        }
@@ -7,32 +7,43 @@ Credit: Adapted from the AnkiHub add-on.
 from __future__ import annotations
 
 import dataclasses
+import functools
+import json
+import logging
 import os
 import re
 import sys
 import threading
 import traceback
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
 from types import TracebackType
 from typing import Any, Callable, Optional
 
 import sentry_sdk
 import structlog
 from anki.collection import Collection
-from anki.utils import checksum, pointVersion
+from anki.utils import pointVersion
 from aqt.qt import QWidget
-from sentry_sdk import capture_exception, new_scope
+from sentry_sdk import capture_event, capture_exception, new_scope
 from sentry_sdk.integrations.argv import ArgvIntegration
 from sentry_sdk.integrations.dedupe import DedupeIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
 from sentry_sdk.integrations.stdlib import StdlibIntegration
 from sentry_sdk.scope import Scope
 from sentry_sdk.types import Event, Hint, Log
+from sentry_sdk.utils import event_from_exception
 
 from .config import Config
 from .consts import AddonConsts
-from .gofile import upload_file
-from .gui.operations import AddonQueryOp
-from .log import log_file_path
+from .error_spool import ErrorSpool, PartialDeliveryError, SpooledReport
+from .error_throttle import ReportThrottle
+from .gofile import ProgressCallback, upload_bytes, upload_file
+from .gui.operations import AddonQueryOp, progress_updater
+from .log import BackgroundLogHandler, current_log_file
+from .log_upload import STATE_FILENAME, file_checksum, upload_log_chunks
+from .sentry_sampling import EVENTS, LOGS, SentryRecordFilter, SentrySampling
 
 
 @dataclasses.dataclass
@@ -42,12 +53,47 @@ class ErrorReportingArgs:
     logger: structlog.stdlib.BoundLogger
     on_handle_exception: Callable[[BaseException, str | None], None] | None = None
     on_sentry_scope: Callable[[Scope], None] | None = None
+    # Upload only the parts of the logs that weren't uploaded before,
+    # see `upload_log_chunks()`
+    incremental_log_uploads: bool = False
+    # Store reports of unhandled exceptions on disk and deliver them in the
+    # background, see `spool_exception()`
+    spool_reports: bool = False
+    # Limits how often unhandled exceptions are reported
+    report_throttle: ReportThrottle = dataclasses.field(default_factory=ReportThrottle)
+    # Sampling of the logs, events and traces sent to Sentry
+    sentry_sampling: SentrySampling = dataclasses.field(default_factory=SentrySampling)
+    _scope_context: _ScopeContext | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+
+@dataclasses.dataclass
+class _ScopeContext:
+    """Sentry tags and contexts that are the same for all reports of an add-on,
+    plus a snapshot of its config for a given `Config.revision`."""
+
+    tags: dict[str, str]
+    contexts: dict[str, dict[str, Any]]
+    config: dict[str, Any] = dataclasses.field(default_factory=dict)
+    config_revision: int = -1
 
 
 ExceptionCallback = Callable[
     [type[BaseException], BaseException, Optional[TracebackType]], None
 ]
 exception_callbacks: list[ExceptionCallback] = []
+# Maps add-on modules to their error report spool
+_spools: dict[str, ErrorSpool] = {}
+
+# How long delivering spooled reports waits for Sentry to send them
+SPOOL_FLUSH_TIMEOUT = 10.0
+# How long spooling a report on the main thread waits for queued log records
+# to be written before the log file is copied
+SPOOL_LOG_FLUSH_TIMEOUT = 0.5
+
+# Largest size of the config attached to reports, as JSON
+MAX_CONFIG_CONTEXT_BYTES = 16 * 1024
 
 DEFAULT_SENTRY_DSN = "https://a60ae1ebef99da387eed46e0fb114ea9@o4507277389201408.ingest.us.sentry.io/4507277391036416"
 
@@ -62,6 +108,8 @@ def setup_error_handler(  # noqa: PLR0913
     _setup_threading_excepthook(args)
     if _error_reporting_enabled(args):
         _initialize_sentry(args, sentry_dsn)
+        if args.spool_reports:
+            _start_spool(args)
 
 
 def register_exception_callback(callback: ExceptionCallback) -> None:
@@ -71,15 +119,20 @@ def register_exception_callback(callback: ExceptionCallback) -> None:
 def _initialize_sentry(args: ErrorReportingArgs, dsn: str | None = None) -> None:
     os.environ["SENTRY_RELEASE"] = args.consts.version
 
+    sampling = args.sentry_sampling
+    sentry_logs_level = sampling.min_log_level()
+    logging_integration = LoggingIntegration(sentry_logs_level=sentry_logs_level)
+    _add_record_filters(args, logging_integration)
     sentry_sdk.init(
         dsn=dsn or DEFAULT_SENTRY_DSN,
-        traces_sample_rate=1.0,
+        traces_sample_rate=None if sampling.traces_sampler else 1.0,
+        traces_sampler=sampling.traces_sampler,
         release=args.consts.version,
         default_integrations=False,
         integrations=[
             ArgvIntegration(),
             DedupeIntegration(),
-            LoggingIntegration(),
+            logging_integration,
             StdlibIntegration(),
             # Causes problems with AnkiHub
             # ThreadingIntegration(),
@@ -88,26 +141,49 @@ def _initialize_sentry(args: ErrorReportingArgs, dsn: str | None = None) -> None
         # it causes a RuntimeError when Anki is closed.
         shutdown_timeout=0,
         before_send=lambda event, hint: _before_send(args, event, hint),
-        enable_logs=True,
+        enable_logs=sentry_logs_level is not None,
         before_send_log=lambda log, hint: _before_send_log(args, log, hint),
     )
 
 
+def _add_record_filters(
+    args: ErrorReportingArgs, integration: LoggingIntegration
+) -> None:
+    """Filter records on the handlers of the LoggingIntegration, so records that
+    won't be sent aren't turned into events and logs first."""
+    handlers = (
+        (getattr(integration, "_handler", None), EVENTS),
+        (getattr(integration, "_sentry_logs_handler", None), LOGS),
+    )
+    for handler, kind in handlers:
+        if isinstance(handler, logging.Handler):
+            handler.addFilter(
+                SentryRecordFilter(args.sentry_sampling, args.logger.name, kind)
+            )
+
+
 def _before_send(args: ErrorReportingArgs, event: Event, hint: Hint) -> Any | None:
     """Filter out events created by the LoggingIntegration
-    that are not related to this add-on."""
+    that are not related to this add-on, and events over the rate limit."""
     if "log_record" in hint:
         logger_name = hint["log_record"].name
         if logger_name != args.logger.name:
+            args.sentry_sampling.record_drop(EVENTS, "other_logger")
             return None
+    if not args.sentry_sampling.sample_event():
+        return None
     return event
 
 
 def _before_send_log(args: ErrorReportingArgs, log: Log, hint: Hint) -> Log | None:
+    # Records are normally filtered by `SentryRecordFilter` already
     if "log_record" in hint:
         logger_name = hint["log_record"].name
-        if logger_name != args.logger.name:
-            return None
+    else:
+        logger_name = log.get("attributes", {}).get("logger.name")
+    if logger_name is not None and logger_name != args.logger.name:
+        args.sentry_sampling.record_drop(LOGS, "other_logger")
+        return None
     return log
 
 
@@ -115,16 +191,18 @@ def report_exception_and_upload_logs(
     exception: BaseException,
     args: ErrorReportingArgs,
     context: dict[str, Any] | None = None,
+    on_progress: ProgressCallback | None = None,
 ) -> str | None:
     """Report the exception to Sentry and upload the logs.
-    Returns the Sentry event ID."""
+    Returns the Sentry event ID.
+    `on_progress` is called with the progress of the log upload."""
 
     if not _error_reporting_enabled(args):
         return None
 
     if not context:
         context = {}
-    logs = upload_logs(args)
+    logs = upload_logs(args, on_progress)
     sentry_id = _report_exception(
         exception=exception,
         args=args,
@@ -139,9 +217,15 @@ def report_exception_and_upload_logs_op(
     exception: BaseException,
     args: ErrorReportingArgs,
     on_success: Callable[[str | None], None] | None = None,
+    context: dict[str, Any] | None = None,
 ) -> AddonQueryOp[str | None]:
     def op(_: Collection) -> str | None:
-        return report_exception_and_upload_logs(exception, args)
+        return report_exception_and_upload_logs(
+            exception,
+            args,
+            context,
+            on_progress=progress_updater("Reporting error..."),
+        )
 
     def wrapped_on_success(result: str | None) -> None:
         if on_success:
@@ -179,7 +263,7 @@ def _setup_excepthook(args: ErrorReportingArgs) -> None:
             if handled:
                 return
 
-            if _this_addon_mentioned_in_tb(tb, args):
+            if _this_addon_mentioned_in_tb(tb, args, val):
                 if _error_reporting_enabled(args):
                     try:
                         _maybe_report_exception(exception=val, args=args)
@@ -227,7 +311,7 @@ def _setup_threading_excepthook(args: ErrorReportingArgs) -> None:
                 return
 
             if exc_args.exc_traceback and _this_addon_mentioned_in_tb(
-                exc_args.exc_traceback, args
+                exc_args.exc_traceback, args, exc_args.exc_value
             ):
                 if _error_reporting_enabled(args):
                     try:
@@ -252,13 +336,31 @@ def _setup_threading_excepthook(args: ErrorReportingArgs) -> None:
 def _maybe_report_exception(exception: BaseException, args: ErrorReportingArgs) -> None:
     from aqt import mw  # noqa: PLC0415
 
+    if not args.report_throttle.should_report(exception):
+        args.logger.info("Not reporting repeated exception", exception=repr(exception))
+        return
+    context = {}
+    repeats = args.report_throttle.pop_repeats()
+    if repeats:
+        context["unreported exceptions"] = repeats
+
+    if get_error_spool(args):
+        sentry_event_id = spool_exception(exception, args, context)
+        if args.on_handle_exception:
+            args.on_handle_exception(exception, sentry_event_id)
+        return
+
     def on_success(sentry_event_id: str | None) -> None:
         # TODO: maybe set our own error dialog here
         if args.on_handle_exception:
             args.on_handle_exception(exception, sentry_event_id)
 
     report_exception_and_upload_logs_op(
-        parent=mw, exception=exception, args=args, on_success=on_success
+        parent=mw,
+        exception=exception,
+        args=args,
+        on_success=on_success,
+        context=context,
     ).run_in_background()
 
 
@@ -282,14 +384,43 @@ def _try_handle_exception(
     return False
 
 
-def _this_addon_mentioned_in_tb(tb: TracebackType, args: ErrorReportingArgs) -> bool:
-    tb_str = "".join(traceback.format_tb(tb))
-    result = _contains_path_to_this_addon(tb_str, args)
+# Attribute of exceptions that holds results of `_this_addon_mentioned_in_tb()`,
+# which is usually called twice for the same traceback (by the excepthook and
+# `_report_exception()`). Maps add-on modules to the traceback and result.
+_TB_RESULTS_ATTR = "_ankiutils_addon_in_tb"
+
+
+def _this_addon_mentioned_in_tb(
+    tb: TracebackType,
+    args: ErrorReportingArgs,
+    exception: BaseException | None = None,
+) -> bool:
+    """Whether a frame of `tb` is in this add-on. The result is stored on
+    `exception` if given, so it is freed along with the exception."""
+    module = args.consts.module
+    results: dict[str, tuple[TracebackType, bool]] | None = None
+    if exception is not None:
+        results = exception.__dict__.setdefault(_TB_RESULTS_ATTR, {})
+        cached = results.get(module)
+        # The exception may have been raised again with another traceback
+        if cached and cached[0] is tb:
+            return cached[1]
+    pattern = _addon_path_pattern(module)
+    result = False
+    current: TracebackType | None = tb
+    while current is not None:
+        if pattern.search(current.tb_frame.f_code.co_filename):
+            result = True
+            break
+        current = current.tb_next
+    if results is not None:
+        results[module] = (tb, result)
     return result
 
 
-def _contains_path_to_this_addon(tb_str: str, args: ErrorReportingArgs) -> bool:
-    return bool(re.search(rf"(/|\\)addons21(/|\\){args.consts.module}(/|\\)", tb_str))
+@functools.cache
+def _addon_path_pattern(module: str) -> re.Pattern[str]:
+    return re.compile(rf"(/|\\)addons21(/|\\){re.escape(module)}(/|\\)")
 
 
 def _report_exception(
@@ -302,20 +433,16 @@ def _report_exception(
         return None
 
     with new_scope() as scope:
-        scope.set_level("error")
-        scope.set_tag("os", sys.platform)
-        scope.set_tag("add-on", args.consts.module)
-        scope.set_context("add-on version", {"version": args.consts.version})
-        scope.set_context("anki version", {"version": pointVersion()})
-        scope.set_context("add-on config", args.config.asdict())
-
-        for key, value in context.items():
-            scope.set_context(key, value)
+        _set_scope_context(scope, args, context)
 
         if exception.__traceback__:
             scope.set_tag(
                 "addon_in_traceback",
-                str(_this_addon_mentioned_in_tb(exception.__traceback__, args)),
+                str(
+                    _this_addon_mentioned_in_tb(
+                        exception.__traceback__, args, exception
+                    )
+                ),
             )
         else:
             args.logger.warning("Exception has no traceback.")
@@ -328,6 +455,165 @@ def _report_exception(
     return sentry_id
 
 
+def _set_scope_context(
+    scope: Scope, args: ErrorReportingArgs, context: dict[str, dict[str, Any]]
+) -> None:
+    scope_context = _get_scope_context(args)
+    scope.set_level("error")
+    for key, tag in scope_context.tags.items():
+        scope.set_tag(key, tag)
+    for key, value in scope_context.contexts.items():
+        scope.set_context(key, value)
+    scope.set_context("add-on config", scope_context.config)
+
+    for key, value in context.items():
+        scope.set_context(key, value)
+
+
+def _get_scope_context(args: ErrorReportingArgs) -> _ScopeContext:
+    scope_context = args._scope_context
+    if scope_context is None:
+        scope_context = args._scope_context = _ScopeContext(
+            tags={"os": sys.platform, "add-on": args.consts.module},
+            contexts={
+                "add-on version": {"version": args.consts.version},
+                "anki version": {"version": pointVersion()},
+            },
+        )
+    revision = args.config.revision
+    if scope_context.config_revision != revision:
+        scope_context.config = _config_snapshot(args.config.asdict())
+        scope_context.config_revision = revision
+    return scope_context
+
+
+def _config_snapshot(config: dict[str, Any]) -> dict[str, Any]:
+    """Return `config` with values replaced by placeholders where needed to keep
+    its JSON size under `MAX_CONFIG_CONTEXT_BYTES`."""
+    snapshot: dict[str, Any] = {}
+    size = 2
+    for key, value in config.items():
+        try:
+            value_size = len(json.dumps(value, default=repr))
+        except ValueError:
+            value_size = MAX_CONFIG_CONTEXT_BYTES
+        # Key, quotes, separators and the value
+        entry_size = len(key) + 4 + value_size
+        if size + entry_size > MAX_CONFIG_CONTEXT_BYTES:
+            placeholder = f"<{value_size} bytes omitted>"
+            snapshot[key] = placeholder
+            size += len(key) + 6 + len(placeholder)
+        else:
+            snapshot[key] = value
+            size += entry_size
+    return snapshot
+
+
+def _start_spool(args: ErrorReportingArgs) -> ErrorSpool:
+    spool = _spools.get(args.consts.module)
+    if spool is None:
+        spool = _spools[args.consts.module] = ErrorSpool(
+            Path(args.consts.dir) / "user_files" / "error_reports",
+            lambda reports: _deliver_spooled_reports(args, reports),
+        )
+        spool.start()
+    return spool
+
+
+def get_error_spool(args: ErrorReportingArgs) -> ErrorSpool | None:
+    """Return the spool of the add-on if `args.spool_reports` is enabled, e.g.
+    to check its `stats()`."""
+    return _spools.get(args.consts.module)
+
+
+def spool_exception(
+    exception: BaseException,
+    args: ErrorReportingArgs,
+    context: dict[str, Any] | None = None,
+) -> str | None:
+    """Store a report of the exception and the current logs in the add-on's
+    spool, to be sent to Sentry in the background.
+    Returns the ID the Sentry event will have."""
+    spool = get_error_spool(args)
+    if not spool or not _error_reporting_enabled(args):
+        return None
+
+    event, _ = event_from_exception(
+        exception, client_options=sentry_sdk.get_client().options
+    )
+    event_id = uuid.uuid4().hex
+    # The report may be sent much later
+    payload_event = {
+        **event,
+        "event_id": event_id,
+        "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+    }
+    tags = {}
+    if exception.__traceback__:
+        tags["addon_in_traceback"] = str(
+            _this_addon_mentioned_in_tb(exception.__traceback__, args, exception)
+        )
+
+    for handler in args.logger.handlers:
+        if isinstance(handler, BackgroundLogHandler):
+            handler.wait(SPOOL_LOG_FLUSH_TIMEOUT)
+        else:
+            handler.flush()
+    log_path = current_log_file(args.consts.module)
+    # Not synced to disk, which would stall the UI; the report still survives
+    # a crash of Anki
+    spool.enqueue(
+        {"event": payload_event, "context": context or {}, "tags": tags},
+        [log_path] if log_path else [],
+        sync=False,
+    )
+    return event_id
+
+
+def _deliver_spooled_reports(
+    args: ErrorReportingArgs, reports: list[SpooledReport]
+) -> None:
+    # Attached logs are snapshots of the log file, whose chunks are deduplicated
+    # against the ones uploaded from the log file itself
+    log_path = current_log_file(args.consts.module)
+    state_path = log_path.with_name(STATE_FILENAME) if log_path else None
+    for index, report in enumerate(reports):
+        try:
+            sentry_id = _deliver_spooled_report(args, report, state_path)
+        except Exception as exc:
+            _flush_sentry(index)
+            raise PartialDeliveryError(index, repr(exc)) from exc
+        if sentry_id is None:
+            # Dropped, e.g. by `_before_send()` because of the rate limit
+            _flush_sentry(index)
+            raise PartialDeliveryError(index, "Sentry dropped an event")
+    _flush_sentry(0)
+
+
+def _deliver_spooled_report(
+    args: ErrorReportingArgs, report: SpooledReport, state_path: Path | None
+) -> str | None:
+    context = report.payload["context"]
+    if report.attachments:
+        logs = _upload_log(report.attachments[0], args, state_path=state_path)
+        context = {**context, "logs": dataclasses.asdict(logs)}
+    with new_scope() as scope:
+        _set_scope_context(scope, args, context)
+        for key, value in report.payload["tags"].items():
+            scope.set_tag(key, value)
+        if args.on_sentry_scope:
+            args.on_sentry_scope(scope)
+        return capture_event(report.payload["event"])
+
+
+def _flush_sentry(delivered: int) -> None:
+    # Captured events are only queued until Sentry's transport sends them
+    sentry_sdk.flush(timeout=SPOOL_FLUSH_TIMEOUT)
+    transport = sentry_sdk.get_client().transport
+    if transport is not None and not transport.is_healthy():
+        raise PartialDeliveryError(delivered, "Sentry's transport is unhealthy")
+
+
 def _error_reporting_enabled(args: ErrorReportingArgs) -> bool:
     return (
         args.config.get("report_errors") and not os.getenv("REPORT_ERRORS", None) == "0"
@@ -340,24 +626,55 @@ class LogsUpload:
     filename: str
 
 
-def upload_logs(args: ErrorReportingArgs) -> LogsUpload | None:
-    """Upload add-on logs and return `LogsUpload` (containing `url` and `filename`)"""
+def upload_logs(
+    args: ErrorReportingArgs, on_progress: ProgressCallback | None = None
+) -> LogsUpload | None:
+    """Upload add-on logs and return `LogsUpload` (containing `url` and `filename`).
+    With `args.incremental_log_uploads`, `url` points to a manifest of the
+    uploaded chunks. `on_progress` is called with the progress of each upload."""
     addon = args.consts.module
-    if not log_file_path(addon).exists():
+    path = current_log_file(addon)
+    if not path:
         return None
 
     for handler in args.logger.handlers:
         handler.flush()
 
-    path = log_file_path(addon)
-    name = f"{addon}_{checksum(path.read_text(encoding='utf-8'))}.log"
     try:
-        return LogsUpload(url=upload_file(path, name), filename=name)
+        return _upload_log(path, args, on_progress)
     except Exception as exc:
         _report_exception(exc, args, {})
         return None
 
 
+def _upload_log(
+    path: Path,
+    args: ErrorReportingArgs,
+    on_progress: ProgressCallback | None = None,
+    state_path: Path | None = None,
+) -> LogsUpload:
+    """Upload the log file at `path`, incrementally if
+    `args.incremental_log_uploads` is set (see `upload_log_chunks()`)."""
+    addon = args.consts.module
+    if args.incremental_log_uploads:
+        url, name = upload_log_chunks(
+            path,
+            addon,
+            lambda data, name: upload_bytes(data, name, on_progress),
+            state_path=state_path,
+        )
+        return LogsUpload(url=url, filename=name)
+    return _upload_log_file(path, addon, on_progress)
+
+
+def _upload_log_file(
+    path: Path, addon: str, on_progress: ProgressCallback | None = None
+) -> LogsUpload:
+    suffix = ".log.gz" if path.name.endswith(".gz") else ".log"
+    name = f"{addon}_{file_checksum(path)}{suffix}"
+    return LogsUpload(url=upload_file(path, name, on_progress), filename=name)
+
+
 def upload_logs_op(
     parent: QWidget,
     args: ErrorReportingArgs,
@@ -368,7 +685,7 @@ def upload_logs_op(
             on_success(result)
 
     def op(_: Collection) -> LogsUpload | None:
-        return upload_logs(args)
+        return upload_logs(args, progress_updater("Uploading logs..."))
 
     return AddonQueryOp(parent=parent, op=op, success=wrapped_on_success).with_progress(
         "Uploading logs..."
@@ -1,22 +1,148 @@
 from __future__ import annotations
 
+import io
 import json
+import os
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+from typing_extensions import TypeAlias
+from urllib3.util.retry import Retry
 
 from ._gofile_api_key import get_gofile_api_key
 
 API_URL = "https://api.gofile.io"
+UPLOAD_URL = "https://{server}.gofile.io/contents/uploadfile"
 LOGS_FOLDER_ID = "59e5ae0b-9c62-44f5-89e8-62f60777d7c4"
 TIMEOUT = 20
+# Most bytes of an uploaded file held in memory at once
+CHUNK_SIZE = 64 * 1024
+# Retries of failed API requests (uploads are retried on the next server instead)
+RETRIES = 3
+# Retries wait RETRY_BACKOFF * 2 ** (retry - 1) seconds
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# How long the list of upload servers is reused
+SERVERS_CACHE_TTL = 10 * 60.0
+# How many servers an upload is tried on
+MAX_UPLOAD_ATTEMPTS = 3
+# Kept-alive connections per host
+POOL_SIZE = 4
+
+# Called with the number of bytes sent so far and the total size of the upload
+ProgressCallback: TypeAlias = Callable[[int, int], None]
+
+
+class MultipartFileStream:
+    """A multipart/form-data request body with text `fields` and one file field
+    ("file"), which is read from `file` in chunks of at most `chunk_size` bytes
+    as the body is sent. Its length is known up front, so requests sends it
+    with a Content-Length instead of chunked encoding."""
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        filename: str,
+        fields: dict[str, str],
+        on_progress: ProgressCallback | None = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.boundary = uuid.uuid4().hex
+        self.on_progress = on_progress
+        self.chunk_size = chunk_size
+        head = b"".join(
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n".encode()
+            for name, value in fields.items()
+        )
+        head += (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+        start = file.tell()
+        file_size = file.seek(0, os.SEEK_END) - start
+        file.seek(start)
+        self._parts: list[BinaryIO] = [io.BytesIO(head), file, io.BytesIO(tail)]
+        self._part = 0
+        self.total = len(head) + file_size + len(tail)
+        self.sent = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.total
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.chunk_size
+        size = min(size, self.chunk_size)
+        data = b""
+        while not data and self._part < len(self._parts):
+            data = self._parts[self._part].read(size)
+            if not data:
+                self._part += 1
+        self.sent += len(data)
+        if data and self.on_progress:
+            self.on_progress(self.sent, self.total)
+        return data
+
+
+class NoUploadServersError(requests.RequestException):
+    def __init__(self) -> None:
+        super().__init__("No upload servers available")
+
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+# (time fetched, servers)
+_servers_cache: tuple[float, list[dict]] | None = None
+
+
+def get_session() -> requests.Session:
+    """Return the session shared by all requests, which keeps connections alive
+    and retries failed idempotent requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def close_session() -> None:
+    """Close pooled connections. The next request starts a new session, which
+    picks up changes to the settings above."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
 
 
 def _request(method: str, url: str, **kwargs: Any) -> requests.Response:
     headers = kwargs.pop("headers", {}).copy()
     headers.update({"Authorization": f"Bearer {get_gofile_api_key()}"})
-    response = requests.request(
+    response = get_session().request(
         method=method,
         url=url,
         timeout=TIMEOUT,
@@ -39,26 +165,73 @@ def _api_request(method: str, path: str, **kwargs: Any) -> requests.Response:
     return response
 
 
-def get_servers() -> list[dict]:
+def get_servers(use_cache: bool = True) -> list[dict]:
+    """Return the upload servers, reusing the last list for `SERVERS_CACHE_TTL`
+    seconds unless `use_cache` is false."""
+    global _servers_cache
+    if use_cache and _servers_cache is not None:
+        fetched_at, servers = _servers_cache
+        if time.monotonic() - fetched_at < SERVERS_CACHE_TTL:
+            return servers
     response = _api_request(method="get", path="servers?zone=eu")
-    return response.json()["data"]["servers"]
+    servers = response.json()["data"]["servers"]
+    _servers_cache = (time.monotonic(), servers)
+    return servers
+
+
+def invalidate_servers_cache() -> None:
+    global _servers_cache
+    _servers_cache = None
 
 
-def upload_file(path: str | Path, name: str) -> str:
-    server = get_servers()[0]["name"]
+def upload_file(
+    path: str | Path, name: str, on_progress: ProgressCallback | None = None
+) -> str:
     with open(path, "rb") as file:
-        upload_data = _request(
-            method="post",
-            url=f"https://{server}.gofile.io/contents/uploadfile",
-            files={"file": file.read()},
-            data={"folderId": LOGS_FOLDER_ID},
-        ).json()["data"]
-        file_id = upload_data["id"]
-        _api_request(
-            method="put",
-            path=f"contents/{file_id}/update",
-            data=json.dumps({"attribute": "name", "attributeValue": name}),
-            headers={"Content-Type": "application/json"},
+        return upload_fileobj(file, name, on_progress)
+
+
+def upload_bytes(
+    data: bytes, name: str, on_progress: ProgressCallback | None = None
+) -> str:
+    return upload_fileobj(io.BytesIO(data), name, on_progress)
+
+
+def upload_fileobj(
+    file: BinaryIO, name: str, on_progress: ProgressCallback | None = None
+) -> str:
+    """Upload the rest of `file` as `name` and return its download page.
+    The file is streamed; see `MultipartFileStream`. If uploading to a server
+    fails, the next one from `get_servers()` is tried."""
+    start = file.tell()
+    servers = get_servers()[:MAX_UPLOAD_ATTEMPTS]
+    if not servers:
+        invalidate_servers_cache()
+        raise NoUploadServersError()
+    for i, server in enumerate(servers):
+        file.seek(start)
+        body = MultipartFileStream(
+            file, name, {"folderId": LOGS_FOLDER_ID}, on_progress=on_progress
         )
+        try:
+            upload_data = _request(
+                method="post",
+                url=UPLOAD_URL.format(server=server["name"]),
+                data=body,
+                headers={"Content-Type": body.content_type},
+            ).json()["data"]
+            break
+        except requests.RequestException:
+            if i == len(servers) - 1:
+                # The cached list may be outdated
+                invalidate_servers_cache()
+                raise
+    file_id = upload_data["id"]
+    _api_request(
+        method="put",
+        path=f"contents/{file_id}/update",
+        data=json.dumps({"attribute": "name", "attributeValue": name}),
+        headers={"Content-Type": "application/json"},
+    )
 
     return upload_data["downloadPage"]
@@ -26,6 +26,20 @@ class AddonQueryOp(QueryOp[T]):
         return self
 
 
+def progress_updater(label: str | None = None) -> Callable[[int, int], None]:
+    """Return a callback that shows the progress (value, max) of a background
+    operation in the progress dialog of `AddonQueryOp.with_progress()`."""
+    from aqt import mw  # noqa: PLC0415
+
+    def update(value: int, total: int) -> None:
+        if point_version() >= 50:
+            mw.taskman.run_on_main(
+                lambda: mw.progress.update(label=label, value=value, max=total)
+            )
+
+    return update
+
+
 def run_task_in_background(
     mw: AnkiQt,
     task: Callable,
@@ -6,38 +6,236 @@ Credit: Adapted from the AnkiHub add-on.
 
 from __future__ import annotations
 
+import atexit
 import json
 import logging
+import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Any
+from types import CodeType
+from typing import Any, Literal
 
 import structlog
 from aqt import mw
 from aqt.addons import AddonManager
-from structlog.processors import CallsiteParameter
-from structlog.typing import Processor
+from structlog.typing import EventDict, Processor, WrappedLogger
 
 from ._internal import is_devmode, is_testing
+from .log_storage import CompressedRotatingFileHandler, IndexedRotatingFileHandler
+
+OverflowPolicy = Literal["block", "drop_oldest", "sample"]
+
+# How long flushing a queued handler waits for pending records to be written
+FLUSH_TIMEOUT = 5.0
+
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The default implementation fails if the queue is full
+        self.queue.put(self._sentinel)  # type: ignore[attr-defined]
+
+
+class BackgroundLogHandler(QueueHandler):
+    """Hands records over to a background thread that formats and writes them
+    using `handlers`, so logging calls don't block on rendering or disk I/O.
+
+    The queue holds at most `queue_size` records. When it's full, `overflow_policy`
+    decides what happens to new records:
+    - "block": wait for the background thread to make room.
+    - "drop_oldest": discard the oldest queued record.
+    - "sample": keep only every `sample_every`-th record below WARNING,
+      waiting for room for kept records. Warnings and errors are always kept.
+    """
+
+    def __init__(
+        self,
+        handlers: list[logging.Handler],
+        queue_size: int = 10000,
+        overflow_policy: OverflowPolicy = "block",
+        sample_every: int = 10,
+    ) -> None:
+        self.queue: queue.Queue[logging.LogRecord | None]
+        super().__init__(queue.Queue(queue_size))
+        self.overflow_policy = overflow_policy
+        self.sample_every = sample_every
+        self.dropped = 0
+        self._overflowed = 0
+        self._lock = threading.Lock()
+        self.listener = _QueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the target handlers on the background thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.listener._thread is None:
+            # Stopped; write synchronously instead of losing the record
+            self.listener.handle(record)
+            return
+        if self.queue.full():
+            if self.overflow_policy == "drop_oldest":
+                self._drop_oldest()
+            elif self.overflow_policy == "sample" and not self._sample(record):
+                return
+        self.queue.put(record)
+
+    def _drop_oldest(self) -> None:
+        with self._lock:
+            while self.queue.full():
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.queue.task_done()
+                self.dropped += 1
+
+    def _sample(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            self._overflowed += 1
+            if self._overflowed % self.sample_every == 0:
+                return True
+            self.dropped += 1
+            return False
+
+    def wait(self, timeout: float | None = FLUSH_TIMEOUT) -> bool:
+        """Wait until all queued records are written, then flush the target
+        handlers. Returns False if `timeout` expired first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self.listener._thread is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        for handler in self.listener.handlers:
+            handler.flush()
+        return True
+
+    def flush(self) -> None:
+        self.wait()
+
+    def stop(self) -> None:
+        """Write all pending records and stop the background thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self) -> None:
+        self.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        super().close()
+
+
+class _CallsiteAdder:
+    """Adds the "thread", "module" and "func_name" of the logging call, like
+    `structlog.processors.CallsiteParameterAdder` does for those parameters.
+
+    Whether a frame belongs to structlog (or `additional_ignores`) and the
+    callsite info of app frames are worked out once per code object."""
+
+    def __init__(self, additional_ignores: Sequence[str] = ()) -> None:
+        self._ignores = ("structlog", *additional_ignores)
+        # Maps code objects to (module, func_name), or None for ignored frames
+        self._callsites: dict[CodeType, tuple[str, str] | None] = {}
+
+    def __call__(
+        self, logger: WrappedLogger, method_name: str, event_dict: EventDict
+    ) -> EventDict:
+        record: logging.LogRecord | None = event_dict.get("_record")
+        if record is not None:
+            # Foreign record; the logging module already recorded the callsite
+            event_dict["thread"] = record.thread
+            event_dict["module"] = record.module
+            event_dict["func_name"] = record.funcName
+            return event_dict
+        module, func_name = self._find_callsite(sys._getframe(1))
+        event_dict["thread"] = threading.get_ident()
+        event_dict["module"] = module
+        event_dict["func_name"] = func_name
+        return event_dict
+
+    def _find_callsite(self, frame: Any) -> tuple[str, str]:
+        callsites = self._callsites
+        while True:
+            code = frame.f_code
+            try:
+                callsite = callsites[code]
+            except KeyError:
+                callsite = callsites[code] = self._classify(frame)
+            if callsite is not None or frame.f_back is None:
+                break
+            frame = frame.f_back
+        return callsite or _describe_code(code)
+
+    def _classify(self, frame: Any) -> tuple[str, str] | None:
+        name = frame.f_globals.get("__name__") or "?"
+        if name.startswith(self._ignores):
+            return None
+        return _describe_code(frame.f_code)
+
+
+def _describe_code(code: CodeType) -> tuple[str, str]:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return module, code.co_name
+
+
+def _capture_exc_info(
+    logger: WrappedLogger, method_name: str, event_dict: EventDict
+) -> EventDict:
+    # Handlers may format the exception later or on another thread, by which
+    # time `sys.exc_info()` no longer refers to it
+    exc_info = event_dict.get("exc_info")
+    if exc_info is True:
+        event_dict["exc_info"] = sys.exc_info()
+    elif isinstance(exc_info, BaseException):
+        event_dict["exc_info"] = (type(exc_info), exc_info, exc_info.__traceback__)
+    return event_dict
+
+
+def add_timestamp(
+    logger: WrappedLogger, method_name: str, event_dict: EventDict
+) -> EventDict:
+    """Handler-side equivalent of `structlog.processors.TimeStamper(fmt="iso")`
+    that uses the creation time of the log record."""
+    record: logging.LogRecord | None = event_dict.get("_record")
+    created = record.created if record is not None else time.time()
+    event_dict["timestamp"] = (
+        datetime.fromtimestamp(created, tz=timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+    return event_dict
+
+
+# Processors run by each handler, only for records the handler actually writes
+DEFAULT_HANDLER_PROCESSORS: tuple[Processor, ...] = (
+    add_timestamp,
+    structlog.processors.format_exc_info,
+)
 
 
 def _shared_log_processors(addon: str) -> list[Processor]:
+    # Cheap processors only: everything here runs on the logging thread for
+    # every event that passes the level check at the front of the chain.
     return [
         structlog.stdlib.filter_by_level,
         structlog.stdlib.add_log_level,
         structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.CallsiteParameterAdder(
-            parameters=[
-                CallsiteParameter.THREAD,
-                CallsiteParameter.MODULE,
-                CallsiteParameter.FUNC_NAME,
-            ],
-            additional_ignores=[f"{addon}.vendor.structlog"],
-        ),
-        structlog.processors.TimeStamper(fmt="iso"),
+        _CallsiteAdder(additional_ignores=[f"{addon}.vendor.structlog"]),
         structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
+        _capture_exc_info,
         structlog.processors.UnicodeDecoder(),
     ]
 
@@ -45,10 +243,12 @@ def _shared_log_processors(addon: str) -> list[Processor]:
 def _structlog_formatter(
     addon: str,
     renderer: structlog.dev.ConsoleRenderer | structlog.processors.JSONRenderer,
+    processors: Sequence[Processor] = DEFAULT_HANDLER_PROCESSORS,
 ) -> logging.Formatter:
     formatter = structlog.stdlib.ProcessorFormatter(
         foreign_pre_chain=_shared_log_processors(addon),
         processors=[
+            *processors,
             structlog.stdlib.ProcessorFormatter.remove_processors_meta,
             renderer,
         ],
@@ -56,83 +256,189 @@ def _structlog_formatter(
     return formatter
 
 
-def log_file_path(addon: str) -> Path:
+def log_file_path(addon: str, compressed: bool = False) -> Path:
     logs_dir = Path(mw.addonManager.addonsFolder(addon)) / "user_files" / "logs"
     logs_dir.mkdir(parents=True, exist_ok=True)
-    return logs_dir / f"{addon}.log"
+    return logs_dir / (f"{addon}.log.gz" if compressed else f"{addon}.log")
 
 
-def get_logger(module: str) -> structlog.stdlib.BoundLogger:
-    addon_name = "addon"
-    logger_name = addon_name
-    if not is_testing():
-        addon_name = mw.addonManager.addonFromModule(module)
-        # This is a workaround to avoid handling logs from vendored modules.
-        logger_name = f"{addon_name}_"
-    std_logger = logging.getLogger(logger_name)
-    std_logger.propagate = False
-    std_logger.setLevel(logging.DEBUG)
-    structlog.configure(
-        processors=_shared_log_processors(addon_name)
-        + [
-            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
-        ],
-        logger_factory=lambda _: std_logger,
-        cache_logger_on_first_use=True,
-        wrapper_class=structlog.stdlib.BoundLogger,
-    )
+class _AddonLogging:
+    """The handler stack and structlog configuration of one add-on."""
 
-    stdout_handler = logging.StreamHandler(stream=sys.stdout)
-    stdout_handler.setLevel(logging.DEBUG if is_devmode() else logging.INFO)
-    stdout_handler.setFormatter(
-        _structlog_formatter(
-            addon_name,
-            structlog.dev.ConsoleRenderer(colors=True),
+    def __init__(
+        self,
+        addon_name: str,
+        logger_name: str,
+        background: bool,
+        queue_size: int,
+        overflow_policy: OverflowPolicy,
+        console_processors: Sequence[Processor],
+        file_processors: Sequence[Processor],
+        compress: bool,
+    ) -> None:
+        self.addon_name = addon_name
+        self.std_logger = logging.getLogger(logger_name)
+        self.std_logger.propagate = False
+        # Drop handlers left behind by an earlier copy of this module
+        for handler in self.std_logger.handlers[:]:
+            self.std_logger.removeHandler(handler)
+            handler.close()
+        structlog.configure(
+            processors=_shared_log_processors(addon_name)
+            + [
+                structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+            ],
+            logger_factory=lambda _: self.std_logger,
+            cache_logger_on_first_use=True,
+            wrapper_class=structlog.stdlib.BoundLogger,
         )
-    )
-    std_logger.addHandler(stdout_handler)
 
-    file_handler: RotatingFileHandler | None = None
+        stdout_handler = logging.StreamHandler(stream=sys.stdout)
+        stdout_handler.setLevel(logging.DEBUG if is_devmode() else logging.INFO)
+        stdout_handler.setFormatter(
+            _structlog_formatter(
+                addon_name,
+                structlog.dev.ConsoleRenderer(colors=True),
+                console_processors,
+            )
+        )
+        self.handlers: list[logging.Handler] = [stdout_handler]
+        self.file_handler: (
+            IndexedRotatingFileHandler | CompressedRotatingFileHandler | None
+        ) = None
+        self.background_handler: BackgroundLogHandler | None = None
+
+        if not is_testing():
+            if compress:
+                self.file_handler = CompressedRotatingFileHandler(
+                    log_file_path(addon_name, compressed=True)
+                )
+            else:
+                self.file_handler = IndexedRotatingFileHandler(
+                    log_file_path(addon_name),
+                    "a",
+                    maxBytes=3 * 1024 * 1024,
+                    backupCount=5,
+                    encoding="utf-8",
+                )
+            self.file_handler.setLevel(logging.DEBUG if is_devmode() else logging.INFO)
+
+            try:
+                import orjson  # noqa: PLC0415
+
+                def json_serializer(*args: Any, **kwargs: Any) -> str:
+                    return orjson.dumps(*args, **kwargs).decode()
+            except ImportError:
+                json_serializer = json.dumps
+            self.file_handler.setFormatter(
+                _structlog_formatter(
+                    addon_name,
+                    structlog.processors.JSONRenderer(serializer=json_serializer),
+                    file_processors,
+                )
+            )
+            self.handlers.append(self.file_handler)
+
+            from anki.hooks import wrap  # noqa: PLC0415
+
+            AddonManager.deleteAddon = wrap(  # type: ignore[method-assign]
+                AddonManager.deleteAddon, self.close_log_file, "before"
+            )
+            AddonManager.backupUserFiles = wrap(  # type: ignore[method-assign]
+                AddonManager.backupUserFiles, self.close_log_file, "before"
+            )
+
+        # Drop events no handler would write before running any processors
+        self.std_logger.setLevel(min(handler.level for handler in self.handlers))
+
+        if background:
+            self.background_handler = BackgroundLogHandler(
+                self.handlers, queue_size=queue_size, overflow_policy=overflow_policy
+            )
+            self.std_logger.addHandler(self.background_handler)
+        else:
+            for handler in self.handlers:
+                self.std_logger.addHandler(handler)
+
+        self.logger: structlog.stdlib.BoundLogger = structlog.stdlib.get_logger(
+            addon_name
+        )
+
+    @property
+    def log_path(self) -> Path | None:
+        """The file the add-on currently logs to."""
+        if isinstance(self.file_handler, CompressedRotatingFileHandler):
+            return self.file_handler.path
+        if self.file_handler is not None:
+            return Path(self.file_handler.baseFilename)
+        return None
 
     # Prevent errors when deleting/updating the add-on on Windows
     def close_log_file(
-        manager: AddonManager, m: str, *args: Any, **kwargs: Any
+        self, manager: AddonManager, m: str, *args: Any, **kwargs: Any
     ) -> None:
-        if m == addon_name and file_handler:
-            file_handler.close()
+        if m == self.addon_name and self.file_handler:
+            if self.background_handler:
+                self.background_handler.stop()
+            self.file_handler.close()
 
-    if not is_testing():
-        file_handler = RotatingFileHandler(
-            log_file_path(addon_name),
-            "a",
-            maxBytes=3 * 1024 * 1024,
-            backupCount=5,
-            encoding="utf-8",
-        )
-        file_handler.setLevel(logging.DEBUG if is_devmode() else logging.INFO)
+    def close(self) -> None:
+        for handler in self.std_logger.handlers[:]:
+            self.std_logger.removeHandler(handler)
+            handler.close()
 
-        try:
-            import orjson  # noqa: PLC0415
 
-            def json_serializer(*args: Any, **kwargs: Any) -> str:
-                return orjson.dumps(*args, **kwargs).decode()
-        except ImportError:
-            json_serializer = json.dumps
-        file_handler.setFormatter(
-            _structlog_formatter(
-                addon_name,
-                structlog.processors.JSONRenderer(serializer=json_serializer),
-            )
-        )
-        std_logger.addHandler(file_handler)
+# Maps add-on names to their logging setup
+_addon_logging: dict[str, _AddonLogging] = {}
+_addon_logging_lock = threading.Lock()
 
-        from anki.hooks import wrap  # noqa: PLC0415
 
-        AddonManager.deleteAddon = wrap(  # type: ignore[method-assign]
-            AddonManager.deleteAddon, close_log_file, "before"
-        )
-        AddonManager.backupUserFiles = wrap(  # type: ignore[method-assign]
-            AddonManager.backupUserFiles, close_log_file, "before"
-        )
+def current_log_file(addon: str) -> Path | None:
+    """Return the file that `addon` logs to, if logging was set up by
+    `get_logger()` and the file exists."""
+    addon_logging = _addon_logging.get(addon)
+    path = addon_logging.log_path if addon_logging else None
+    return path if path is not None and path.exists() else None
+
 
-    return structlog.stdlib.get_logger(addon_name)
+def get_logger(
+    module: str,
+    background: bool = False,
+    queue_size: int = 10000,
+    overflow_policy: OverflowPolicy = "block",
+    console_processors: Sequence[Processor] = DEFAULT_HANDLER_PROCESSORS,
+    file_processors: Sequence[Processor] = DEFAULT_HANDLER_PROCESSORS,
+    compress: bool = False,
+) -> structlog.stdlib.BoundLogger:
+    """Set up logging for the add-on containing `module`.
+    If `background` is true, log records are rendered and written by a
+    background thread. See `BackgroundLogHandler` for the other arguments.
+    `console_processors` and `file_processors` run before the renderer of the
+    respective handler, only for records that handler writes.
+    If `compress` is true, the log file is written in gzip-compressed blocks by
+    `CompressedRotatingFileHandler` (see `log_file_path(compressed=True)`).
+
+    Logging is set up once per add-on; later calls (from any module of the
+    add-on) return the same logger and ignore the other arguments."""
+    addon_name = "addon"
+    logger_name = addon_name
+    if not is_testing():
+        addon_name = mw.addonManager.addonFromModule(module)
+        # This is a workaround to avoid handling logs from vendored modules.
+        logger_name = f"{addon_name}_"
+    addon_logging = _addon_logging.get(addon_name)
+    if addon_logging is None:
+        with _addon_logging_lock:
+            addon_logging = _addon_logging.get(addon_name)
+            if addon_logging is None:
+                addon_logging = _addon_logging[addon_name] = _AddonLogging(
+                    addon_name,
+                    logger_name,
+                    background,
+                    queue_size,
+                    overflow_policy,
+                    console_processors,
+                    file_processors,
+                    compress,
+                )
+    return addon_logging.logger
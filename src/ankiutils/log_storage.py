@@ -0,0 +1,547 @@
+"""
+Compressed and indexed log files, and streaming access to log records.
+
+File handlers here also write a sidecar index (`{segment}.idx`) next to each log
+segment. Every line of the index describes one block of the segment: its byte
+range, the time range of its records, how many records of each level it holds
+and which threads logged them. `iter_logs` uses it to read only the blocks that
+can match a query; parts of a segment that the index doesn't cover are scanned.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Union
+
+from typing_extensions import TypeAlias
+
+# Uncompressed bytes collected before they're compressed into a block
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# Longest time a record may wait in the buffer before its block is written
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Bytes of a plain log file covered by one index entry
+DEFAULT_INDEX_BLOCK_SIZE = 64 * 1024
+INDEX_SUFFIX = ".idx"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# Compressed bytes read at once when checking the blocks of a file
+_CHECK_CHUNK_SIZE = 64 * 1024
+
+# Datetimes or Unix timestamps
+TimeBound: TypeAlias = Union[datetime, float]
+
+
+class _BlockStats:
+    """Summary of the records of a block that is being written."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.start = 0.0
+        self.end = 0.0
+        self.levels: dict[str, int] = {}
+        self.threads: set[int] = set()
+
+    def add(self, record: logging.LogRecord) -> None:
+        if not self.count:
+            self.start = self.end = record.created
+        else:
+            self.start = min(self.start, record.created)
+            self.end = max(self.end, record.created)
+        self.count += 1
+        level = record.levelname.lower()
+        self.levels[level] = self.levels.get(level, 0) + 1
+        if record.thread is not None:
+            self.threads.add(record.thread)
+
+    def write_entry(self, segment: Path, offset: int, length: int) -> None:
+        """Append the index entry of the block to the index of `segment` and
+        start a new block."""
+        if self.count:
+            entry = {
+                "offset": offset,
+                "length": length,
+                "start": self.start,
+                "end": self.end,
+                "levels": self.levels,
+                "threads": sorted(self.threads),
+            }
+            with open(_index_path(segment), "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+        self.reset()
+
+
+def _index_path(segment: Path) -> Path:
+    return segment.with_name(segment.name + INDEX_SUFFIX)
+
+
+def _rotate_indexes(path: Path, backup_count: int) -> None:
+    """Rename the indexes of the segments of `path` the way the segments are
+    about to be rotated."""
+    for i in range(backup_count - 1, -1, -1):
+        if _segment_path(path, i).exists():
+            source = _index_path(_segment_path(path, i))
+            target = _index_path(_segment_path(path, i + 1))
+            if source.exists():
+                os.replace(source, target)
+            else:
+                target.unlink(missing_ok=True)
+
+
+class IndexedRotatingFileHandler(RotatingFileHandler):
+    """`RotatingFileHandler` that indexes every `index_block_size` bytes of
+    the log file. See the module docstring."""
+
+    def __init__(
+        self,
+        filename: str | Path,
+        mode: str = "a",
+        maxBytes: int = 0,  # noqa: N803
+        backupCount: int = 0,  # noqa: N803
+        encoding: str | None = None,
+        delay: bool = False,
+        index_block_size: int = DEFAULT_INDEX_BLOCK_SIZE,
+    ) -> None:
+        super().__init__(filename, mode, maxBytes, backupCount, encoding, delay)
+        self.index_block_size = index_block_size
+        self._block = _BlockStats()
+        self._block_offset = 0
+
+    def _file_size(self) -> int:
+        if self.stream is not None:
+            self.stream.flush()
+            return os.fstat(self.stream.fileno()).st_size
+        try:
+            return os.path.getsize(self.baseFilename)
+        except OSError:
+            return 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not self._block.count:
+            self._block_offset = self._file_size()
+        super().emit(record)
+        try:
+            self._block.add(record)
+            size = self._file_size()
+            if size - self._block_offset >= self.index_block_size:
+                self._write_index_entry(size)
+        except Exception:
+            self.handleError(record)
+
+    def _write_index_entry(self, size: int) -> None:
+        self._block.write_entry(
+            Path(self.baseFilename), self._block_offset, size - self._block_offset
+        )
+        self._block_offset = size
+
+    def doRollover(self) -> None:  # noqa: N802
+        if self._block.count:
+            self._write_index_entry(self._file_size())
+        _rotate_indexes(Path(self.baseFilename), self.backupCount)
+        super().doRollover()
+        self._block_offset = 0
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                if self._block.count:
+                    self._write_index_entry(self._file_size())
+            finally:
+                super().close()
+
+
+class CompressedRotatingFileHandler(logging.Handler):
+    """Writes formatted records as lines of text into gzip-compressed blocks.
+
+    Records are buffered until `block_size` uncompressed bytes are collected,
+    `flush_interval` seconds passed since the first buffered record (checked by
+    a timer, so idle buffers are written too), or a record of at least
+    `flush_level` arrives. The buffer is then compressed into one gzip member
+    and appended to the file. Concatenated members are a valid gzip file,
+    so segments can be read by `gzip.open` or `zcat` as well as `iter_records`.
+    A block left incomplete by a crash is cut off before the file is appended to.
+
+    Files are rotated like `RotatingFileHandler` (`{filename}.1` to
+    `{filename}.{backup_count}`), but based on their compressed size.
+    Every block gets an entry in the index of its segment.
+    """
+
+    def __init__(
+        self,
+        filename: str | Path,
+        max_bytes: int = 3 * 1024 * 1024,
+        backup_count: int = 5,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        flush_level: int = logging.ERROR,
+        compresslevel: int = 6,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__()
+        self.path = Path(filename).absolute()
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.compresslevel = compresslevel
+        self._clock = clock
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+        self._buffered_since = 0.0
+        self._block = _BlockStats()
+        self._stream: BinaryIO | None = None
+        self._flush_timer: threading.Timer | None = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = (self.format(record) + "\n").encode("utf-8")
+            if not self._buffer:
+                self._buffered_since = self._clock()
+                self._start_flush_timer()
+            self._buffer.append(line)
+            self._buffered += len(line)
+            self._block.add(record)
+            if (
+                self._buffered >= self.block_size
+                or record.levelno >= self.flush_level
+                or self._clock() - self._buffered_since >= self.flush_interval
+            ):
+                self._write_block()
+        except Exception:
+            self.handleError(record)
+
+    def _start_flush_timer(self) -> None:
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _cancel_flush_timer(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _write_block(self) -> None:
+        self._cancel_flush_timer()
+        if not self._buffer:
+            return
+        block = gzip.compress(
+            b"".join(self._buffer), compresslevel=self.compresslevel, mtime=0
+        )
+        self._buffer = []
+        self._buffered = 0
+        stream = self._open()
+        size = stream.tell()
+        if self.max_bytes and size and size + len(block) > self.max_bytes:
+            self._rollover()
+            stream = self._open()
+        # Blocks are written in one call, so a crash can only truncate the last one,
+        # which is cut off when the file is opened again
+        offset = stream.tell()
+        stream.write(block)
+        stream.flush()
+        self._block.write_entry(self.path, offset, len(block))
+
+    def _open(self) -> BinaryIO:
+        if self._stream is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _truncate_incomplete_block(self.path)
+            self._stream = open(self.path, "ab")
+        return self._stream
+
+    def _rollover(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        _rotate_indexes(self.path, self.backup_count)
+        if self.backup_count <= 0:
+            self.path.unlink(missing_ok=True)
+            _index_path(self.path).unlink(missing_ok=True)
+        else:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = _segment_path(self.path, i)
+                if source.exists():
+                    os.replace(source, _segment_path(self.path, i + 1))
+            if self.path.exists():
+                os.replace(self.path, _segment_path(self.path, 1))
+
+    def flush(self) -> None:
+        with self.lock:
+            self._write_block()
+            if self._stream is not None:
+                self._stream.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                self._write_block()
+            finally:
+                if self._stream is not None:
+                    self._stream.close()
+                    self._stream = None
+                super().close()
+
+
+def _complete_blocks_end(file: BinaryIO, start: int) -> int:
+    """Return the offset after the last complete gzip member of `file`, checking
+    the members from `start` on."""
+    file.seek(start)
+    end = position = start
+    decompressor = zlib.decompressobj(wbits=31)
+    while chunk := file.read(_CHECK_CHUNK_SIZE):
+        while chunk:
+            try:
+                decompressor.decompress(chunk)
+            except zlib.error:
+                return end
+            if not decompressor.eof:
+                position += len(chunk)
+                break
+            rest = decompressor.unused_data
+            position += len(chunk) - len(rest)
+            end = position
+            chunk = rest
+            decompressor = zlib.decompressobj(wbits=31)
+    return end
+
+
+def _truncate_incomplete_block(path: Path) -> None:
+    """Cut off a block of the compressed log file at `path` that a crash left
+    incomplete, so that readers don't stop at it before blocks appended later."""
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        if not size or file.read(2) != _GZIP_MAGIC:
+            return
+        # Indexed blocks were written completely
+        entries = _read_index(path, size)
+        start = entries[-1]["offset"] + entries[-1]["length"] if entries else 0
+        end = _complete_blocks_end(file, start)
+    if end < size:
+        os.truncate(path, end)
+        if not entries:
+            # It can't describe the file anymore; blocks that it doesn't cover
+            # are scanned by readers
+            _index_path(path).unlink(missing_ok=True)
+
+
+def _segment_path(path: Path, index: int) -> Path:
+    return path.with_name(f"{path.name}.{index}") if index else path
+
+
+def log_segments(path: str | Path) -> list[Path]:
+    """Return the existing segments of the log file at `path`, oldest first."""
+    path = Path(path)
+    backups: list[tuple[int, Path]] = []
+    for candidate in path.parent.glob(f"{path.name}.*"):
+        suffix = candidate.name[len(path.name) + 1 :]
+        if suffix.isdigit():
+            backups.append((int(suffix), candidate))
+    segments = [candidate for _, candidate in sorted(backups, reverse=True)]
+    if path.exists():
+        segments.append(path)
+    return segments
+
+
+def is_compressed(path: str | Path) -> bool:
+    with open(path, "rb") as file:
+        return file.read(2) == _GZIP_MAGIC
+
+
+def iter_records(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Lazily decode the JSON records of a plain or compressed log file.
+    A last block truncated by a crash is skipped."""
+    opener: Callable[..., Any] = gzip.open if is_compressed(path) else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        try:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            return
+
+
+def iter_all_records(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Lazily decode the records of all segments of a log file, oldest first."""
+    for segment in log_segments(path):
+        yield from iter_records(segment)
+
+
+def _timestamp(bound: TimeBound) -> float:
+    return bound.timestamp() if isinstance(bound, datetime) else bound
+
+
+def _record_timestamp(record: dict[str, Any]) -> float | None:
+    value = record.get("timestamp")
+    if not isinstance(value, str):
+        return None
+    try:
+        # fromisoformat() only accepts "Z" since Python 3.11
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _level_number(level: str | int) -> int:
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(level.upper())
+    return number if isinstance(number, int) else 0
+
+
+def _read_index(segment: Path, size: int) -> list[dict[str, Any]]:
+    """Return the index entries of `segment`, or an empty list if it has no
+    usable index. The entries may leave parts of the segment uncovered."""
+    try:
+        with open(_index_path(segment), encoding="utf-8") as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+    except (OSError, ValueError):
+        return []
+    covered = 0
+    for entry in entries:
+        if entry["offset"] < covered or entry["offset"] + entry["length"] > size:
+            # Doesn't describe this file (e.g. it was replaced)
+            return []
+        covered = entry["offset"] + entry["length"]
+    return entries
+
+
+def _decode_lines(lines: Iterable[bytes]) -> Iterator[dict[str, Any]]:
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A partially written last line
+                continue
+
+
+def _decode_block(data: bytes, compressed: bool) -> Iterator[dict[str, Any]]:
+    if compressed:
+        try:
+            data = gzip.decompress(data)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            return
+    yield from _decode_lines(data.splitlines())
+
+
+def _iter_gzip_lines(file: BinaryIO) -> Iterator[bytes]:
+    with gzip.GzipFile(fileobj=file) as gzip_file:
+        try:
+            yield from gzip_file
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            return
+
+
+def _iter_lines_until(file: BinaryIO, end: int) -> Iterator[bytes]:
+    position = file.tell()
+    for line in file:
+        yield line
+        position += len(line)
+        if position >= end:
+            return
+
+
+def _iter_unindexed(
+    file: BinaryIO, start: int, end: int | None, compressed: bool
+) -> Iterator[dict[str, Any]]:
+    """Decode the records between `start` and `end` (the end of the file if
+    None), which no index entry covers."""
+    file.seek(start)
+    if end is None:
+        yield from _decode_lines(_iter_gzip_lines(file) if compressed else file)
+    elif compressed:
+        # Only blocks of a session that crashed before indexing them
+        try:
+            data = gzip.decompress(file.read(end - start))
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            return
+        yield from _decode_lines(data.splitlines())
+    else:
+        yield from _decode_lines(_iter_lines_until(file, end))
+
+
+def _iter_segment_blocks(
+    segment: Path, block_matches: Callable[[dict[str, Any]], bool]
+) -> Iterator[dict[str, Any]]:
+    compressed = is_compressed(segment)
+    with open(segment, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        # Records before the first entry, between entries and after the last one
+        # are scanned. They were logged before the file was indexed (e.g. by
+        # `RotatingFileHandler`), or by a session that crashed before indexing
+        # its last block.
+        indexed = 0
+        for entry in _read_index(segment, size):
+            if indexed < entry["offset"]:
+                yield from _iter_unindexed(file, indexed, entry["offset"], compressed)
+            if block_matches(entry):
+                file.seek(entry["offset"])
+                yield from _decode_block(file.read(entry["length"]), compressed)
+            indexed = entry["offset"] + entry["length"]
+        if indexed < size:
+            yield from _iter_unindexed(file, indexed, None, compressed)
+
+
+def iter_logs(
+    path: str | Path,
+    since: TimeBound | None = None,
+    until: TimeBound | None = None,
+    min_level: str | int | None = None,
+    thread: int | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Lazily yield the records of the log file at `path` and its rotated
+    segments, oldest first, that were logged between `since` and `until`
+    (inclusive), at `min_level` or above, and by `thread` (a thread ID).
+
+    Blocks whose index entry rules them out are not read at all. Records without
+    a timestamp are skipped if `since` or `until` is given."""
+    start = _timestamp(since) if since is not None else None
+    end = _timestamp(until) if until is not None else None
+    level = _level_number(min_level) if min_level is not None else None
+
+    def block_matches(entry: dict[str, Any]) -> bool:
+        if start is not None and entry["end"] < start:
+            return False
+        if end is not None and entry["start"] > end:
+            return False
+        if level is not None and not any(
+            _level_number(name) >= level for name in entry["levels"]
+        ):
+            return False
+        return thread is None or thread in entry["threads"]
+
+    def record_matches(record: dict[str, Any]) -> bool:
+        if start is not None or end is not None:
+            created = _record_timestamp(record)
+            if (
+                created is None
+                or (start is not None and created < start)
+                or (end is not None and created > end)
+            ):
+                return False
+        if level is not None and _level_number(record.get("level", "")) < level:
+            return False
+        return thread is None or record.get("thread") == thread
+
+    for segment in log_segments(path):
+        for record in _iter_segment_blocks(segment, block_matches):
+            if record_matches(record):
+                yield record
@@ -0,0 +1,146 @@
+"""
+Incremental uploads of log files.
+
+Log segments are split into fixed-size chunks that are identified by their
+SHA-1 hash. Chunks that were uploaded before (as recorded in a state file next
+to the logs) are not uploaded again; rotated segments keep their content, so
+only the chunks written since the last upload are sent. A manifest listing the
+chunks of every segment in order is uploaded last and links everything
+together.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Callable
+
+from typing_extensions import TypeAlias
+
+from .log_storage import log_segments
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+STATE_FILENAME = "uploads.json"
+
+# Uploads data under the given name and returns its URL
+Uploader: TypeAlias = Callable[[bytes, str], str]
+
+_state_lock = threading.Lock()
+
+
+def _iter_chunks(file: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    while chunk := file.read(chunk_size):
+        yield chunk
+
+
+def file_checksum(path: str | Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """SHA-1 hex digest of the file at `path` (like `anki.utils.checksum()` of
+    its content), computed without reading the whole file into memory."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in _iter_chunks(file, chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_state(path: Path) -> dict[str, str]:
+    try:
+        with open(path, encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    chunks = state.get("chunks") if isinstance(state, dict) else None
+    return chunks if isinstance(chunks, dict) else {}
+
+
+def _save_state(path: Path, chunks: dict[str, str]) -> None:
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"chunks": chunks}, file)
+    os.replace(temp_path, path)
+
+
+def _upload_segment(
+    segment: Path,
+    addon: str,
+    upload: Uploader,
+    chunk_size: int,
+    uploaded: dict[str, str],
+    current: dict[str, str],
+) -> dict[str, Any]:
+    segment_digest = hashlib.sha1()
+    chunks = []
+    offset = 0
+    with open(segment, "rb") as file:
+        for data in _iter_chunks(file, chunk_size):
+            segment_digest.update(data)
+            digest = hashlib.sha1(data).hexdigest()
+            url = uploaded.get(digest)
+            if url is None:
+                url = uploaded[digest] = upload(data, f"{addon}_{digest}.part")
+            current[digest] = url
+            chunks.append(
+                {"offset": offset, "size": len(data), "sha1": digest, "url": url}
+            )
+            offset += len(data)
+    return {
+        "name": segment.name,
+        "size": offset,
+        "sha1": segment_digest.hexdigest(),
+        "chunks": chunks,
+    }
+
+
+def upload_log_chunks(
+    log_path: str | Path,
+    addon: str,
+    upload: Uploader,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    state_path: str | Path | None = None,
+) -> tuple[str, str]:
+    """Upload the chunks of the log file at `log_path` and its rotated segments
+    that weren't uploaded yet, followed by a manifest.
+    Returns the URL and name of the manifest.
+
+    Uploaded chunks are recorded in `state_path` (by default `uploads.json` in
+    the log directory). Records of chunks that no longer exist are dropped."""
+    log_path = Path(log_path)
+    state_path = Path(state_path or log_path.with_name(STATE_FILENAME))
+    with _state_lock:
+        uploaded = _load_state(state_path)
+        current: dict[str, str] = {}
+        segments: list[dict[str, Any]] = []
+        completed = False
+        try:
+            for segment in log_segments(log_path):
+                segments.append(
+                    _upload_segment(
+                        segment, addon, upload, chunk_size, uploaded, current
+                    )
+                )
+            completed = True
+        finally:
+            # Keep what was uploaded even if a later chunk failed
+            _save_state(
+                state_path,
+                {digest: url for digest, url in uploaded.items() if digest in current}
+                if completed
+                else uploaded,
+            )
+
+    manifest = json.dumps(
+        {
+            "addon": addon,
+            "created": datetime.now(tz=timezone.utc).isoformat(),
+            "chunk_size": chunk_size,
+            "segments": segments,
+        },
+        indent=1,
+    ).encode("utf-8")
+    name = f"{addon}_{hashlib.sha1(manifest).hexdigest()}.manifest.json"
+    return upload(manifest, name), name
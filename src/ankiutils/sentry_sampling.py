@@ -0,0 +1,115 @@
+"""
+Sampling of the logs, events and traces sent to Sentry.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
+from typing import Callable, Union
+
+from sentry_sdk.types import SamplingContext
+from typing_extensions import TypeAlias
+
+# Returns the sample rate of a transaction, see the `traces_sampler` option of
+# `sentry_sdk.init()`
+TracesSampler: TypeAlias = Callable[[SamplingContext], Union[float, int, bool]]
+
+LOGS = "logs"
+EVENTS = "events"
+
+# Levels of the records that may be sent as Sentry logs
+_LOG_LEVELS = (logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL)
+
+
+class SentrySampling:
+    """Decides which records and events are sent to Sentry.
+
+    Log records are sent with the probability given for their level in
+    `log_sample_rates` (levels that aren't listed are always sent). At most
+    `max_events_per_minute` logs and as many error events are sent per minute.
+    `traces_sampler` is passed to Sentry; without it all transactions are sampled.
+    What wasn't sent is counted by reason, see `dropped()`."""
+
+    def __init__(
+        self,
+        log_sample_rates: Mapping[int, float] | None = None,
+        traces_sampler: TracesSampler | None = None,
+        max_events_per_minute: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        rand: Callable[[], float] = random.random,
+    ) -> None:
+        self.log_sample_rates = dict(log_sample_rates or {})
+        self.traces_sampler = traces_sampler
+        self.max_events_per_minute = max_events_per_minute
+        self._clock = clock
+        self._rand = rand
+        self._lock = threading.Lock()
+        # Maps LOGS and EVENTS to the start of the current minute and the number
+        # of items sent in it
+        self._windows: dict[str, tuple[float, int]] = {}
+        self._dropped: dict[str, Counter[str]] = {LOGS: Counter(), EVENTS: Counter()}
+
+    def min_log_level(self) -> int | None:
+        """The lowest level of records that can be sent as logs, or None if no
+        logs are sent."""
+        for level in _LOG_LEVELS:
+            if self.log_sample_rates.get(level, 1.0) > 0:
+                return level
+        return None
+
+    def record_drop(self, kind: str, reason: str) -> None:
+        with self._lock:
+            self._dropped[kind][reason] += 1
+
+    def _within_limit(self, kind: str) -> bool:
+        if self.max_events_per_minute is None:
+            return True
+        now = self._clock()
+        with self._lock:
+            start, count = self._windows.get(kind, (now, 0))
+            if now - start >= 60:
+                start, count = now, 0
+            if count >= self.max_events_per_minute:
+                self._dropped[kind]["rate_limited"] += 1
+                return False
+            self._windows[kind] = (start, count + 1)
+            return True
+
+    def sample_log(self, level: int) -> bool:
+        rate = self.log_sample_rates.get(level, 1.0)
+        if rate < 1.0 and self._rand() >= rate:
+            self.record_drop(LOGS, "sampled")
+            return False
+        return self._within_limit(LOGS)
+
+    def sample_event(self) -> bool:
+        return self._within_limit(EVENTS)
+
+    def dropped(self) -> dict[str, dict[str, int]]:
+        """Return the number of logs and events that weren't sent, by reason."""
+        with self._lock:
+            return {kind: dict(counter) for kind, counter in self._dropped.items()}
+
+
+class SentryRecordFilter(logging.Filter):
+    """Rejects records of loggers other than `logger_name`, and log records
+    that are sampled out, before Sentry's logging handlers process them."""
+
+    def __init__(self, sampling: SentrySampling, logger_name: str, kind: str) -> None:
+        super().__init__()
+        self.sampling = sampling
+        self.logger_name = logger_name
+        self.kind = kind
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name != self.logger_name:
+            self.sampling.record_drop(self.kind, "other_logger")
+            return False
+        if self.kind == LOGS:
+            return self.sampling.sample_log(record.levelno)
+        return True
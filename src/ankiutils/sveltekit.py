@@ -1,23 +1,46 @@
 from __future__ import annotations
 
-import mimetypes
+import asyncio
+import base64
+import concurrent.futures
+import inspect
+import json
 import os
 import secrets
+import struct
+import sys
 import threading
+import time
 import traceback
+from collections.abc import Awaitable, Collection, Coroutine, Iterable, Iterator
 from http import HTTPStatus
-from typing import TYPE_CHECKING, Any, Callable
+from typing import TYPE_CHECKING, Any, Callable, Union
 
 import flask
 from flask import abort, request
 from structlog.stdlib import BoundLogger
 from typing_extensions import TypeAlias
 from waitress.server import create_server
+from werkzeug.exceptions import HTTPException
 
 if TYPE_CHECKING:
+    from _typeshed.wsgi import StartResponse, WSGIEnvironment
+
     from ankiutils.gui.sveltekit_web import SveltekitWebDialog
 
+from ._internal import is_devmode
 from .consts import AddonConsts
+from .sveltekit_assets import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_STREAM_THRESHOLD,
+    ENCODINGS,
+    Asset,
+    AssetCache,
+    CachedAsset,
+)
+from .sveltekit_cache import DEFAULT_MAX_BYTES as DEFAULT_RESULT_CACHE_SIZE
+from .sveltekit_cache import CacheKey, ProtoResultCache
+from .sveltekit_metrics import MetricsTaskDispatcher, ServerMetrics
 
 
 def _text_response(code: HTTPStatus, text: str) -> flask.Response:
@@ -49,6 +72,36 @@ def get_api_port(consts: AddonConsts) -> int:
     return int(get_addon_env_var(consts, "API_PORT", "0"))
 
 
+def get_server_threads(consts: AddonConsts) -> int:
+    return int(get_addon_env_var(consts, "SERVER_THREADS", "4"))
+
+
+def get_server_connection_limit(consts: AddonConsts) -> int:
+    return int(get_addon_env_var(consts, "SERVER_CONNECTION_LIMIT", "100"))
+
+
+def get_server_backlog(consts: AddonConsts) -> int:
+    return int(get_addon_env_var(consts, "SERVER_BACKLOG", "1024"))
+
+
+def get_result_cache_size(consts: AddonConsts) -> int:
+    return int(
+        get_addon_env_var(consts, "RESULT_CACHE_SIZE", str(DEFAULT_RESULT_CACHE_SIZE))
+    )
+
+
+def get_asset_cache_size(consts: AddonConsts) -> int:
+    return int(get_addon_env_var(consts, "ASSET_CACHE_SIZE", str(DEFAULT_MAX_BYTES)))
+
+
+def get_asset_stream_threshold(consts: AddonConsts) -> int:
+    return int(
+        get_addon_env_var(
+            consts, "ASSET_STREAM_THRESHOLD", str(DEFAULT_STREAM_THRESHOLD)
+        )
+    )
+
+
 _APIKEY = secrets.token_urlsafe(32)
 
 
@@ -68,30 +121,203 @@ class SveltekitServerNotInitializedError(SveltekitServerError):
         super().__init__("Sveltekit server is not initialized")
 
 
+class BatchFormatError(SveltekitServerError):
+    def __init__(self) -> None:
+        super().__init__("Truncated batch frame")
+
+
 ProtoHandler: TypeAlias = Callable[[bytes], bytes]
+# Run on the server's event loop instead of a worker thread
+AsyncProtoHandler: TypeAlias = Callable[[bytes], Awaitable[bytes]]
+# Either of the above
+AnyProtoHandler: TypeAlias = Callable[[bytes], Union[bytes, Awaitable[bytes]]]
+# Yields any number of messages in response to a single request
+StreamingProtoHandler: TypeAlias = Callable[[bytes], Iterable[bytes]]
+
+# How often callers waiting for the event loop check whether it was stopped
+_EVENT_LOOP_POLL_INTERVAL = 1.0
+# How long shutting down waits for cancelled tasks of the event loop
+_EVENT_LOOP_SHUTDOWN_TIMEOUT = 5.0
+
+# Batched API calls are framed as a sequence of
+# (service length, method length, payload length, service, method, payload)
+# and their results as a sequence of (status, body length, body).
+_BATCH_CALL_HEADER = struct.Struct("!HHI")
+_BATCH_RESULT_HEADER = struct.Struct("!HI")
+
+
+def _internal_error(exc: BaseException) -> dict[str, str]:
+    return {"code": "internal", "message": str(exc)}
+
+
+def _internal_error_result(exc: BaseException) -> tuple[HTTPStatus, str, bytes]:
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=sys.stdout)
+    return (
+        HTTPStatus.INTERNAL_SERVER_ERROR,
+        "application/json",
+        json.dumps(_internal_error(exc)).encode(),
+    )
+
+
+async def _gather(awaitables: Iterable[Awaitable[bytes]]) -> list[Any]:
+    return await asyncio.gather(*awaitables, return_exceptions=True)
+
+
+def _close_unstarted(awaitable: Awaitable[Any]) -> None:
+    """Close a coroutine that will never run, so it isn't reported as never
+    awaited."""
+    if (
+        inspect.iscoroutine(awaitable)
+        and inspect.getcoroutinestate(awaitable) == inspect.CORO_CREATED
+    ):
+        awaitable.close()
+
+
+async def _cancel_tasks_and_stop(timeout: float) -> None:
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        # Handlers may suppress cancellation, so they aren't waited for forever
+        await asyncio.wait(tasks, timeout=timeout)
+    asyncio.get_running_loop().stop()
+
+
+def _run_event_loop(loop: asyncio.AbstractEventLoop) -> None:
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+def _sse_event(event: str, data: str = "") -> bytes:
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+def encode_batch_request(calls: Iterable[tuple[str, str, bytes]]) -> bytes:
+    parts = []
+    for service, method, payload in calls:
+        service_bytes = service.encode()
+        method_bytes = method.encode()
+        parts.append(
+            _BATCH_CALL_HEADER.pack(len(service_bytes), len(method_bytes), len(payload))
+        )
+        parts.extend((service_bytes, method_bytes, payload))
+    return b"".join(parts)
+
+
+def decode_batch_request(data: bytes) -> list[tuple[str, str, bytes]]:
+    calls = []
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + _BATCH_CALL_HEADER.size > len(view):
+            raise BatchFormatError()
+        service_len, method_len, payload_len = _BATCH_CALL_HEADER.unpack_from(
+            view, offset
+        )
+        offset += _BATCH_CALL_HEADER.size
+        end = offset + service_len + method_len + payload_len
+        if end > len(view):
+            raise BatchFormatError()
+        service = bytes(view[offset : offset + service_len]).decode()
+        offset += service_len
+        method = bytes(view[offset : offset + method_len]).decode()
+        offset += method_len
+        calls.append((service, method, bytes(view[offset:end])))
+        offset = end
+    return calls
+
+
+def encode_batch_response(results: Iterable[tuple[int, bytes]]) -> bytes:
+    parts = []
+    for status, body in results:
+        parts.append(_BATCH_RESULT_HEADER.pack(status, len(body)))
+        parts.append(body)
+    return b"".join(parts)
+
+
+def decode_batch_response(data: bytes) -> list[tuple[int, bytes]]:
+    results = []
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + _BATCH_RESULT_HEADER.size > len(view):
+            raise BatchFormatError()
+        status, body_len = _BATCH_RESULT_HEADER.unpack_from(view, offset)
+        offset += _BATCH_RESULT_HEADER.size
+        if offset + body_len > len(view):
+            raise BatchFormatError()
+        results.append((status, bytes(view[offset : offset + body_len])))
+        offset += body_len
+    return results
 
 
 class SveltekitServer(threading.Thread):
-    _ready = threading.Event()
     daemon = True
 
-    def __init__(self, consts: AddonConsts, logger: BoundLogger) -> None:
+    def __init__(
+        self, consts: AddonConsts, logger: BoundLogger, lean_dispatch: bool = False
+    ) -> None:
+        """If `lean_dispatch` is true, calls to /api/<service>/<method> are served
+        by a minimal WSGI app that skips Flask's routing and request parsing.
+        All other requests are still handled by Flask."""
         super().__init__()
+        self._ready = threading.Event()
         self.consts = consts
+        self.lean_dispatch = lean_dispatch
         self.logger = logger
         self.is_shutdown = False
         self.flask_app = flask.Flask(__name__)
-        self.proto_handlers: dict[tuple[str, str], ProtoHandler] = {}
+        self.proto_handlers: dict[tuple[str, str], AnyProtoHandler] = {}
         self.proto_handlers_for_dialog: dict[
-            int, dict[tuple[str, str], Callable[[bytes], bytes]]
+            int, dict[tuple[str, str], AnyProtoHandler]
         ] = {}
+        self.streaming_proto_handlers: dict[tuple[str, str], StreamingProtoHandler] = {}
+        self.streaming_proto_handlers_for_dialog: dict[
+            int, dict[tuple[str, str], StreamingProtoHandler]
+        ] = {}
+        # Cancellation events of open streams, keyed by dialog ID
+        self._active_streams: dict[int | None, set[threading.Event]] = {}
+        self._active_streams_lock = threading.Lock()
+        self._event_loop: asyncio.AbstractEventLoop | None = None
+        self._event_loop_lock = threading.Lock()
+        self.metrics = ServerMetrics()
+        self.result_cache = ProtoResultCache(get_result_cache_size(consts))
+        # Maps /api/<service>/<method> paths, as they appear in the WSGI
+        # environ, to registered (service, method) keys
+        self._api_routes: dict[str, tuple[str, str]] = {}
+        self._auth_header = f"Bearer {_APIKEY}"
+        self._open_api_access = get_api_host(consts) == "0.0.0.0"
         self.page_paths: set[str] = set()
+        self.assets = AssetCache(
+            self.consts.dir / "web" / "sveltekit",
+            max_bytes=get_asset_cache_size(consts),
+            check_changes=is_hmr_enabled(consts) or is_devmode(),
+            stream_threshold=get_asset_stream_threshold(consts),
+        )
         self._register_routes()
 
     def register_page(self, path: str) -> None:
         self.page_paths.add(path)
 
     def _register_routes(self) -> None:
+        self.flask_app.add_url_rule(
+            "/api/_metrics",
+            methods=["GET"],
+            view_func=self._handle_metrics_request,
+        )
+        self.flask_app.add_url_rule(
+            "/api/_batch",
+            methods=["POST"],
+            view_func=self._handle_batch_api_request,
+        )
+        self.flask_app.add_url_rule(
+            "/api/_stream/<path:service>/<path:method>",
+            methods=["POST"],
+            view_func=self._handle_streaming_api_request,
+        )
         self.flask_app.add_url_rule(
             "/api/<path:service>/<path:method>",
             methods=["POST"],
@@ -104,86 +330,448 @@ class SveltekitServer(threading.Thread):
         )
 
     def add_proto_handler(
-        self, service: str, method: str, handler: ProtoHandler
+        self,
+        service: str,
+        method: str,
+        handler: AnyProtoHandler,
+        cache: bool = False,
+        cache_ttl: float | None = None,
     ) -> None:
+        """Register a handler for /api/<service>/<method>.
+        The handler can be a coroutine function, in which case it runs on an
+        event loop thread owned by the server.
+        If `cache` is true, responses are memoized per request payload for
+        `cache_ttl` seconds (or until invalidated if None). Only use this for
+        handlers whose response depends solely on the payload, and call
+        `invalidate_cached_results` when the data they return changes."""
+        self.result_cache.invalidate(service, method)
+        if cache:
+            handler = self._cached_handler(None, service, method, handler, cache_ttl)
         self.proto_handlers[(service, method)] = handler
+        self._add_api_route(service, method)
 
     def add_proto_handler_for_dialog(
         self,
         dialog: SveltekitWebDialog,
         service: str,
         method: str,
-        func: ProtoHandler,
+        func: AnyProtoHandler,
+        cache: bool = False,
+        cache_ttl: float | None = None,
     ) -> None:
         dialog_id = id(dialog)
+        self.result_cache.invalidate(service, method)
+        if cache:
+            func = self._cached_handler(dialog_id, service, method, func, cache_ttl)
         self.proto_handlers_for_dialog.setdefault(dialog_id, {})
         handlers = self.proto_handlers_for_dialog[dialog_id]
         handlers[(service, method)] = func
+        self._add_api_route(service, method)
+
+    def _add_api_route(self, service: str, method: str) -> None:
+        # WSGI servers decode the path as latin-1
+        path = f"/api/{service}/{method}".encode().decode("latin-1")
+        self._api_routes[path] = (service, method)
+
+    @property
+    def wsgi_app(self) -> Callable[[WSGIEnvironment, StartResponse], Iterable[bytes]]:
+        return self._lean_wsgi_app if self.lean_dispatch else self.flask_app
+
+    def _lean_wsgi_app(
+        self, environ: WSGIEnvironment, start_response: StartResponse
+    ) -> Iterable[bytes]:
+        route = (
+            self._api_routes.get(environ.get("PATH_INFO", ""))
+            if environ.get("REQUEST_METHOD") == "POST"
+            else None
+        )
+        if route is None or (
+            environ.get("HTTP_AUTHORIZATION") != self._auth_header
+            and not self._open_api_access
+        ):
+            # Flask serves everything else and rejects unauthorized requests
+            return self.flask_app(environ, start_response)
+
+        dialog_id = environ.get("HTTP_QT_WIDGET_ID")
+        length = environ.get("CONTENT_LENGTH")
+        data = environ["wsgi.input"].read(int(length)) if length else b""
+        status, content_type, body = self._call_proto_handler(
+            int(dialog_id) if dialog_id else None, *route, data
+        )
+        start_response(
+            f"{status.value} {status.phrase}",
+            [("Content-Type", content_type), ("Content-Length", str(len(body)))],
+        )
+        return [body]
+
+    def invalidate_cached_results(
+        self, service: str | None = None, method: str | None = None
+    ) -> None:
+        """Drop cached responses of `service`/`method`, or of all cached handlers
+        by default (e.g. after the collection is modified)."""
+        self.result_cache.invalidate(service, method)
+
+    def _cached_handler(
+        self,
+        scope: int | None,
+        service: str,
+        method: str,
+        handler: AnyProtoHandler,
+        ttl: float | None,
+    ) -> AnyProtoHandler:
+        cache = self.result_cache
+
+        async def store_when_done(key: CacheKey, response: Awaitable[bytes]) -> bytes:
+            result = await response
+            cache.put(key, result, ttl)
+            return result
+
+        def cached_handler(data: bytes) -> bytes | Awaitable[bytes]:
+            key = cache.key(scope, service, method, data)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            response = handler(data)
+            if inspect.isawaitable(response):
+                return store_when_done(key, response)
+            cache.put(key, response, ttl)
+            return response
+
+        return cached_handler
+
+    def add_streaming_proto_handler(
+        self, service: str, method: str, handler: StreamingProtoHandler
+    ) -> None:
+        self.streaming_proto_handlers[(service, method)] = handler
+
+    def add_streaming_proto_handler_for_dialog(
+        self,
+        dialog: SveltekitWebDialog,
+        service: str,
+        method: str,
+        func: StreamingProtoHandler,
+    ) -> None:
+        dialog_id = id(dialog)
+        self.streaming_proto_handlers_for_dialog.setdefault(dialog_id, {})
+        handlers = self.streaming_proto_handlers_for_dialog[dialog_id]
+        handlers[(service, method)] = func
 
     def remove_proto_handlers_for_dialog(self, dialog: SveltekitWebDialog) -> None:
         dialog_id = id(dialog)
         self.proto_handlers_for_dialog.pop(dialog_id, None)
+        self.streaming_proto_handlers_for_dialog.pop(dialog_id, None)
+        self.result_cache.invalidate_scope(dialog_id)
+        self._cancel_streams(dialog_id)
+
+    def _cancel_streams(self, dialog_id: int | None = None) -> None:
+        with self._active_streams_lock:
+            if dialog_id is None:
+                streams = set().union(*self._active_streams.values())
+            else:
+                streams = self._active_streams.get(dialog_id, set())
+            for cancelled in streams:
+                cancelled.set()
 
     def _handle_api_request(self, service: str, method: str) -> flask.Response:
         if not _have_api_access(self.consts):
             self.logger.warning("Unexpected API access", headers=request.headers)
             return abort(HTTPStatus.FORBIDDEN)
 
-        dialog_id: str | None = request.headers.get("qt-widget-id", None)
-        handler: ProtoHandler | None = None
+        status, content_type, body = self._call_proto_handler(
+            self._request_dialog_id(), service, method, request.data
+        )
+        response = flask.make_response(body, status)
+        response.headers["Content-type"] = content_type
+        return response
+
+    def _handle_metrics_request(self) -> flask.Response:
+        if not _have_api_access(self.consts):
+            self.logger.warning("Unexpected API access", headers=request.headers)
+            return abort(HTTPStatus.FORBIDDEN)
+        return _json_response(HTTPStatus.OK, self.metrics.snapshot())
+
+    def _handle_batch_api_request(self) -> flask.Response:
+        """Handle a sequence of framed API calls sent in a single request.
+        Each call gets the status and body it would have gotten if it had been
+        sent to /api/<service>/<method> on its own."""
+        if not _have_api_access(self.consts):
+            self.logger.warning("Unexpected API access", headers=request.headers)
+            return abort(HTTPStatus.FORBIDDEN)
+
+        try:
+            calls = decode_batch_request(request.data)
+        except (BatchFormatError, UnicodeDecodeError) as exc:
+            return _text_response(HTTPStatus.BAD_REQUEST, str(exc))
+        dialog_id = self._request_dialog_id()
+        results = [
+            (int(status), body)
+            for status, _content_type, body in self._call_proto_handlers(
+                dialog_id, calls
+            )
+        ]
+        response = flask.make_response(encode_batch_response(results))
+        response.headers["Content-type"] = "application/octet-stream"
+        return response
+
+    def _handle_streaming_api_request(
+        self, service: str, method: str
+    ) -> flask.Response:
+        """Run a streaming handler and send its messages as server-sent events.
+        Each message is base64-encoded in a `message` event. The stream ends with
+        an `end` event, or an `error` event carrying the same JSON body that
+        /api/<service>/<method> returns on errors. Streams of a dialog are
+        stopped when its handlers are removed."""
+        if not _have_api_access(self.consts):
+            self.logger.warning("Unexpected API access", headers=request.headers)
+            return abort(HTTPStatus.FORBIDDEN)
+
+        dialog_id = self._request_dialog_id()
+        handler: StreamingProtoHandler | None = None
         if dialog_id:
-            handler = self.proto_handlers_for_dialog.get(int(dialog_id), {}).get(
+            handler = self.streaming_proto_handlers_for_dialog.get(dialog_id, {}).get(
                 (service, method)
             )
         if not handler:
-            handler = self.proto_handlers.get((service, method))
+            handler = self.streaming_proto_handlers.get((service, method))
         if not handler:
             return _text_response(
                 HTTPStatus.NOT_FOUND, f"No handler found for {service}/{method}"
             )
+
+        data = request.data
+
+        def generate(handler: StreamingProtoHandler) -> Iterator[bytes]:
+            cancelled = threading.Event()
+            with self._active_streams_lock:
+                self._active_streams.setdefault(dialog_id, set()).add(cancelled)
+            messages: Iterable[bytes] = ()
+            started_at = time.perf_counter()
+            try:
+                messages = handler(data)
+                for message in messages:
+                    if cancelled.is_set():
+                        break
+                    yield _sse_event("message", base64.b64encode(message).decode())
+                yield _sse_event("end")
+            except Exception as exc:
+                print(traceback.format_exc())
+                yield _sse_event("error", json.dumps(_internal_error(exc)))
+            finally:
+                close = getattr(messages, "close", None)
+                if close:
+                    close()
+                self._observe_api_call(service, method, started_at)
+                with self._active_streams_lock:
+                    streams = self._active_streams.get(dialog_id, set())
+                    streams.discard(cancelled)
+                    if not streams:
+                        self._active_streams.pop(dialog_id, None)
+
+        response = flask.Response(generate(handler), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _request_dialog_id(self) -> int | None:
+        dialog_id: str | None = request.headers.get("qt-widget-id", None)
+        return int(dialog_id) if dialog_id else None
+
+    def _call_proto_handler(
+        self, dialog_id: int | None, service: str, method: str, data: bytes
+    ) -> tuple[HTTPStatus, str, bytes]:
+        """Run the handler registered for `service`/`method`, preferring the
+        dialog's handlers, and return (status, content type, body)."""
+        return self._call_proto_handlers(dialog_id, [(service, method, data)])[0]
+
+    def _call_proto_handlers(
+        self, dialog_id: int | None, calls: list[tuple[str, str, bytes]]
+    ) -> list[tuple[HTTPStatus, str, bytes]]:
+        """Like `_call_proto_handler`, but for several calls. Synchronous
+        handlers run one after the other on the current thread, then all async
+        handlers are awaited concurrently on the event loop."""
+        results: list[tuple[HTTPStatus, str, bytes] | None] = []
+        # Maps indexes of results to the service, method, start time and response
+        # of async handlers
+        pending: dict[int, tuple[str, str, float, Awaitable[bytes]]] = {}
+        for service, method, data in calls:
+            handler: AnyProtoHandler | None = None
+            if dialog_id:
+                handler = self.proto_handlers_for_dialog.get(dialog_id, {}).get(
+                    (service, method)
+                )
+            if not handler:
+                handler = self.proto_handlers.get((service, method))
+            if not handler:
+                results.append(
+                    (
+                        HTTPStatus.NOT_FOUND,
+                        "text/plain",
+                        f"No handler found for {service}/{method}".encode(),
+                    )
+                )
+                continue
+            started_at = time.perf_counter()
+            try:
+                response = handler(data)
+            except Exception as exc:
+                self._observe_api_call(service, method, started_at)
+                results.append(_internal_error_result(exc))
+                continue
+            if inspect.isawaitable(response):
+                pending[len(results)] = (service, method, started_at, response)
+                results.append(None)
+            else:
+                self._observe_api_call(service, method, started_at)
+                results.append((HTTPStatus.OK, "application/proto", response))
+
+        if pending:
+            for index, result in zip(pending, self._await_handlers(pending.values())):
+                results[index] = result
+        return [result for result in results if result is not None]
+
+    def _await_handlers(
+        self, calls: Collection[tuple[str, str, float, Awaitable[bytes]]]
+    ) -> list[tuple[HTTPStatus, str, bytes]]:
         try:
-            response = flask.make_response(handler(request.data))
-            response.headers["Content-type"] = "application/proto"
-        except Exception as exc:
-            print(traceback.format_exc())
-            response = _json_response(
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-                {"code": "internal", "message": str(exc)},
+            # The timing wrappers are only created once the loop runs `_gather()`
+            outcomes = self._run_on_event_loop(
+                _gather(self._await_timed(*call) for call in calls)
+            )
+        except concurrent.futures.CancelledError:
+            # The server was shut down
+            for *_, response in calls:
+                _close_unstarted(response)
+            return [
+                (HTTPStatus.SERVICE_UNAVAILABLE, "text/plain", b"Shutting down")
+            ] * len(calls)
+        return [
+            _internal_error_result(outcome)
+            if isinstance(outcome, BaseException)
+            else (HTTPStatus.OK, "application/proto", outcome)
+            for outcome in outcomes
+        ]
+
+    async def _await_timed(
+        self,
+        service: str,
+        method: str,
+        started_at: float,
+        response: Awaitable[bytes],
+    ) -> bytes:
+        try:
+            return await response
+        finally:
+            self._observe_api_call(service, method, started_at)
+
+    def _observe_api_call(self, service: str, method: str, started_at: float) -> None:
+        self.metrics.observe_api_call(service, method, time.perf_counter() - started_at)
+
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=_run_event_loop,
+                    args=(loop,),
+                    name=f"{self.consts.module} Sveltekit event loop",
+                    daemon=True,
+                ).start()
+                self._event_loop = loop
+            return self._event_loop
+
+    def _run_on_event_loop(self, coro: Coroutine[Any, Any, list[Any]]) -> list[Any]:
+        """Run `coro` on the event loop and return its result. Raises
+        `concurrent.futures.CancelledError` if the loop is stopped first."""
+        loop = self._get_event_loop()
+        try:
+            future = asyncio.run_coroutine_threadsafe(coro, loop)
+        except RuntimeError as exc:
+            # The loop was closed
+            coro.close()
+            raise concurrent.futures.CancelledError from exc
+        while True:
+            try:
+                return future.result(timeout=_EVENT_LOOP_POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                # A loop that was stopped before running the coroutine
+                if not loop.is_running():
+                    future.cancel()
+                    _close_unstarted(coro)
+                    raise concurrent.futures.CancelledError from None
+
+    def _stop_event_loop(self) -> None:
+        """Cancel the pending tasks of the event loop, then stop and close it."""
+        with self._event_loop_lock:
+            loop, self._event_loop = self._event_loop, None
+        if loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                _cancel_tasks_and_stop(_EVENT_LOOP_SHUTDOWN_TIMEOUT), loop
             )
-        return response
 
     def _handle_sveltekit_request(self, path: str) -> flask.Response:
         immutable = "immutable" in path
         if not immutable and path in self.page_paths:
             path = "index.html"
-        mimetype, _encoding = mimetypes.guess_type(path)
-        if not mimetype:
-            mimetype = "application/octet-stream"
         try:
-            full_path = self.consts.dir / "web" / "sveltekit" / path
-            data = full_path.read_bytes()
-            response = flask.Response(data, mimetype=mimetype)
+            asset = self.assets.get(path)
+            if asset is None:
+                self.logger.error("Sveltekit request returned 404", path=path)
+                return _text_response(HTTPStatus.NOT_FOUND, f"Invalid path: {path}")
+            if isinstance(asset, CachedAsset):
+                response = self._cached_asset_response(asset)
+            else:
+                response = self._stream_asset(asset)
             if immutable:
                 response.headers["Cache-Control"] = "max-age=31536000"
-        except FileNotFoundError:
-            self.logger.exception("Sveltekit request returned 404", path=path)
-            resp = _text_response(HTTPStatus.NOT_FOUND, f"Invalid path: {path}")
-            resp.headers["Content-type"] = "text/plain"
-            return resp
+        except HTTPException:
+            raise
         except Exception as error:
             self.logger.exception("Sveltekit server exception", path=path)
             return _text_response(HTTPStatus.INTERNAL_SERVER_ERROR, str(error))
         return response
 
+    def _cached_asset_response(self, asset: CachedAsset) -> flask.Response:
+        encoding = request.accept_encodings.best_match(
+            [e for e in ENCODINGS if e in asset.variants]
+        )
+        etag = asset.etag_for(encoding)
+        if etag in request.if_none_match:
+            response = flask.Response(status=HTTPStatus.NOT_MODIFIED)
+        else:
+            data = asset.variants[encoding] if encoding else asset.data
+            response = flask.Response(data, mimetype=asset.mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        if asset.variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def _stream_asset(self, asset: Asset) -> flask.Response:
+        """Serve a large file in chunks through the server's `wsgi.file_wrapper`
+        without reading it into memory. Handles conditional and Range requests."""
+        return flask.send_file(
+            asset.path,
+            mimetype=asset.mimetype,
+            etag=asset.etag,
+            conditional=True,
+            max_age=None,
+        )
+
     def run(self) -> None:
         try:
             desired_host = get_api_host(self.consts)
             desired_port = get_api_port(self.consts)
+            # waitress only uses its `threads` setting for its own dispatcher
+            dispatcher = MetricsTaskDispatcher(self.metrics)
+            dispatcher.set_thread_count(get_server_threads(self.consts))
             self.server = create_server(
-                self.flask_app,
+                self.wsgi_app,
                 host=desired_host,
                 port=desired_port,
                 clear_untrusted_proxy_headers=True,
+                connection_limit=get_server_connection_limit(self.consts),
+                backlog=get_server_backlog(self.consts),
+                _dispatcher=dispatcher,
             )
             print(
                 f"Started Sveltekit server at http://{self.server.effective_host}:{self.server.effective_port}",  # type: ignore
@@ -197,9 +785,12 @@ class SveltekitServer(threading.Thread):
                 raise
 
     def shutdown(self) -> None:
-        if not self.server:
+        self._stop_event_loop()
+        # Not set if the server wasn't started
+        if not getattr(self, "server", None):
             return
         self.is_shutdown = True
+        self._cancel_streams()
         sockets = list(self.server._map.values())  # type: ignore
         for socket in sockets:
             socket.handle_close()
@@ -220,7 +811,8 @@ class SveltekitServer(threading.Thread):
 def init_server(
     consts: AddonConsts,
     logger: BoundLogger,
+    lean_dispatch: bool = False,
 ) -> SveltekitServer:
-    server = SveltekitServer(consts, logger)
+    server = SveltekitServer(consts, logger, lean_dispatch=lean_dispatch)
     server.start()
     return server
@@ -0,0 +1,258 @@
+"""
+In-memory cache of the static files served by `SveltekitServer`.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    try:
+        import brotlicffi as brotli  # type: ignore
+    except ImportError:
+        brotli = None
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Files larger than this are streamed from disk instead of being cached
+DEFAULT_STREAM_THRESHOLD = 1024 * 1024
+# Files smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+_COMPRESSIBLE_MIMETYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/wasm",
+    "application/xml",
+    "image/svg+xml",
+}
+
+# Content codings in order of preference
+ENCODINGS = ("br", "gzip")
+_ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_MIMETYPES
+
+
+def guess_mimetype(path: str) -> str:
+    mimetype, _encoding = mimetypes.guess_type(path)
+    return mimetype or "application/octet-stream"
+
+
+@dataclass
+class Asset:
+    path: Path
+    mimetype: str
+    # Unquoted entity tag of the uncompressed contents
+    etag: str
+    mtime_ns: int
+    size: int
+
+    @property
+    def cost(self) -> int:
+        return 0
+
+
+@dataclass
+class CachedAsset(Asset):
+    data: bytes
+    # Maps content codings ("br", "gzip") to the encoded bytes
+    variants: dict[str, bytes]
+
+    @property
+    def cost(self) -> int:
+        return len(self.data) + sum(len(v) for v in self.variants.values())
+
+    def etag_for(self, encoding: str | None) -> str:
+        return f"{self.etag}-{encoding}" if encoding else self.etag
+
+
+class AssetCache:
+    """Thread-safe LRU cache of static files under `root`.
+
+    The directory is scanned once on creation. File contents, mimetypes, ETags
+    and compressed variants are loaded on first access and kept in memory until
+    the total size exceeds `max_bytes`. Files larger than `stream_threshold`
+    are never read into memory; only their metadata is cached and they are
+    returned as plain `Asset`s to be streamed from disk. If `check_changes` is
+    true, files are stat'ed on every access and reloaded if modified, and files
+    created after the initial scan are picked up too (useful with HMR and in
+    dev mode).
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        check_changes: bool = False,
+        stream_threshold: int = DEFAULT_STREAM_THRESHOLD,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stream_threshold = stream_threshold
+        self.check_changes = check_changes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._assets: OrderedDict[str, Asset] = OrderedDict()
+        self._size = 0
+        self._index: dict[str, Path] = {}
+        self.scan()
+
+    def scan(self) -> None:
+        """Rebuild the index of servable files and drop all cached contents."""
+        index: dict[str, Path] = {}
+        if self.root.is_dir():
+            for dirpath, _dirnames, filenames in os.walk(self.root):
+                for filename in filenames:
+                    full_path = Path(dirpath) / filename
+                    index[full_path.relative_to(self.root).as_posix()] = full_path
+        with self._lock:
+            self._index = index
+            self._assets.clear()
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def get(self, path: str) -> Asset | None:
+        """Return the asset for `path` (relative to the root),
+        or None if there is no such file. The returned asset is a `CachedAsset`
+        unless the file is too large to be held in memory."""
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None:
+                self._assets.move_to_end(path)
+            full_path = self._index.get(path)
+        if full_path is None and self.check_changes:
+            full_path = self._resolve_new_file(path)
+        if full_path is None:
+            return None
+
+        if asset is not None:
+            if not self.check_changes:
+                self.hits += 1
+                return asset
+            try:
+                stat = full_path.stat()
+            except FileNotFoundError:
+                self._forget(path)
+                return None
+            if stat.st_mtime_ns == asset.mtime_ns and stat.st_size == asset.size:
+                self.hits += 1
+                return asset
+
+        self.misses += 1
+        try:
+            asset = self._load(full_path)
+        except FileNotFoundError:
+            self._forget(path)
+            return None
+        self._store(path, asset)
+        return asset
+
+    def invalidate(self, path: str | None = None) -> None:
+        """Drop `path` from the cache, or everything if `path` is None."""
+        with self._lock:
+            if path is None:
+                self._assets.clear()
+                self._size = 0
+            else:
+                self._drop(path)
+
+    def _resolve_new_file(self, path: str) -> Path | None:
+        root = self.root.resolve()
+        full_path = (root / path).resolve()
+        if not full_path.is_relative_to(root) or not full_path.is_file():
+            return None
+        with self._lock:
+            self._index[path] = full_path
+        return full_path
+
+    def _load(self, full_path: Path) -> Asset:
+        stat = full_path.stat()
+        mimetype = guess_mimetype(full_path.name)
+        if stat.st_size > self.stream_threshold:
+            return Asset(
+                path=full_path,
+                mimetype=mimetype,
+                etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+            )
+        data = full_path.read_bytes()
+        variants = self._load_variants(full_path, data, mimetype)
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        return CachedAsset(
+            path=full_path,
+            mimetype=mimetype,
+            etag=digest,
+            mtime_ns=stat.st_mtime_ns,
+            size=len(data),
+            data=data,
+            variants=variants,
+        )
+
+    def _load_variants(
+        self, full_path: Path, data: bytes, mimetype: str
+    ) -> dict[str, bytes]:
+        variants: dict[str, bytes] = {}
+        if not _is_compressible(mimetype) or len(data) < COMPRESS_MIN_SIZE:
+            return variants
+        # Prefer variants generated at build time (e.g. by SvelteKit's
+        # `precompress` option) over compressing at runtime.
+        compressors: dict[str, Callable[[bytes], bytes] | None] = {
+            "br": (lambda d: brotli.compress(d, quality=5)) if brotli else None,
+            "gzip": lambda d: gzip.compress(d, compresslevel=6, mtime=0),
+        }
+        for encoding, compress in compressors.items():
+            precompressed = full_path.with_name(
+                full_path.name + _ENCODING_SUFFIXES[encoding]
+            )
+            if precompressed.is_file():
+                encoded = precompressed.read_bytes()
+            elif compress is not None:
+                encoded = compress(data)
+            else:
+                continue
+            if len(encoded) < len(data):
+                variants[encoding] = encoded
+        return variants
+
+    def _store(self, path: str, asset: Asset) -> None:
+        if asset.cost > self.max_bytes:
+            # Too big to cache; serve it once without keeping it around.
+            return
+        with self._lock:
+            self._drop(path)
+            self._assets[path] = asset
+            self._size += asset.cost
+            while self._size > self.max_bytes:
+                _evicted_path, evicted = self._assets.popitem(last=False)
+                self._size -= evicted.cost
+
+    def _forget(self, path: str) -> None:
+        with self._lock:
+            self._drop(path)
+            self._index.pop(path, None)
+
+    def _drop(self, path: str) -> None:
+        asset = self._assets.pop(path, None)
+        if asset is not None:
+            self._size -= asset.cost
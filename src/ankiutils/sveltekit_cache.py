@@ -0,0 +1,99 @@
+"""
+Cache of proto handler responses for `SveltekitServer`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from typing_extensions import TypeAlias
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+# (dialog ID or None for global handlers, service, method, payload digest)
+CacheKey: TypeAlias = tuple[Optional[int], str, str, bytes]
+
+
+class ProtoResultCache:
+    """Thread-safe LRU cache of handler responses with optional expiry.
+    The total size of cached responses is kept under `max_bytes`."""
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Maps keys to (expiry time or None, response)
+        self._entries: OrderedDict[CacheKey, tuple[float | None, bytes]] = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def key(scope: int | None, service: str, method: str, payload: bytes) -> CacheKey:
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        return (scope, service, method, digest)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: CacheKey, value: bytes, ttl: float | None = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        expires_at = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (expires_at, value)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _key, (_expires_at, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, service: str | None = None, method: str | None = None) -> None:
+        """Drop cached responses of `service`/`method` in all scopes.
+        Either can be None to match everything."""
+        self._drop_matching(
+            lambda key: (
+                (service is None or key[1] == service)
+                and (method is None or key[2] == method)
+            )
+        )
+
+    def invalidate_scope(self, scope: int | None) -> None:
+        """Drop cached responses of the handlers registered for a dialog
+        (or the global handlers if `scope` is None)."""
+        self._drop_matching(lambda key: key[0] == scope)
+
+    def _drop_matching(self, predicate: Callable[[CacheKey], bool]) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._drop(key)
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
@@ -0,0 +1,150 @@
+"""
+Request concurrency and latency metrics for `SveltekitServer`.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from typing import Any
+
+from waitress.task import ThreadedTaskDispatcher
+
+# Upper bounds of histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    50.0,
+    100.0,
+    250.0,
+    500.0,
+    1000.0,
+    2500.0,
+    5000.0,
+    10000.0,
+    float("inf"),
+)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram. Not thread-safe on its own."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket containing the `q` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def asdict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum_ms": self.total_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)
+                if count
+            },
+        }
+
+
+class ServerMetrics:
+    """Thread-safe counters shared by the server's worker threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests_total = 0
+        self.queue_wait = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.api_latency: dict[tuple[str, str], LatencyHistogram] = {}
+        self.dispatcher: ThreadedTaskDispatcher | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        if self.dispatcher is None:
+            return 0
+        return len(self.dispatcher.queue)
+
+    def request_started(self, queue_wait: float) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.requests_total += 1
+            self.queue_wait.observe(queue_wait)
+
+    def request_finished(self, service_time: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.service_time.observe(service_time)
+
+    def observe_api_call(self, service: str, method: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.api_latency.get((service, method))
+            if histogram is None:
+                histogram = self.api_latency[(service, method)] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "requests_total": self.requests_total,
+                "threads": len(self.dispatcher.threads) if self.dispatcher else 0,
+                "queue_wait": self.queue_wait.asdict(),
+                "service_time": self.service_time.asdict(),
+                "api": {
+                    f"{service}/{method}": histogram.asdict()
+                    for (service, method), histogram in self.api_latency.items()
+                },
+            }
+
+
+class MetricsTaskDispatcher(ThreadedTaskDispatcher):
+    """Waitress task dispatcher that records how long each request waited for a
+    worker thread and how long the worker spent on it."""
+
+    def __init__(self, metrics: ServerMetrics) -> None:
+        super().__init__()
+        self.metrics = metrics
+        metrics.dispatcher = self
+
+    def add_task(self, task: Any) -> None:
+        queued_at = time.perf_counter()
+        service = task.service
+
+        def timed_service() -> None:
+            started_at = time.perf_counter()
+            self.metrics.request_started(started_at - queued_at)
+            try:
+                service()
+            finally:
+                self.metrics.request_finished(time.perf_counter() - started_at)
+
+        task.service = timed_service
+        super().add_task(task)
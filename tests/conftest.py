@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+import structlog
+
+from ankiutils.consts import AddonConsts, clear_consts_cache
+from ankiutils.sveltekit import SveltekitServer
+
+from .helpers import FakeAddonManager, install_fake_addon_manager
+
+
+@pytest.fixture
+def consts(tmp_path: Path) -> AddonConsts:
+    return AddonConsts("addon", "addon", tmp_path, "0.0.1", None, {}, None, None)
+
+
+@pytest.fixture
+def server(consts: AddonConsts) -> SveltekitServer:
+    return SveltekitServer(consts, structlog.stdlib.get_logger())
+
+
+@pytest.fixture
+def addon_manager(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[FakeAddonManager]:
+    (tmp_path / "myaddon").mkdir()
+    yield install_fake_addon_manager(monkeypatch, tmp_path)
+    clear_consts_cache()
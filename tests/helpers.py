@@ -0,0 +1,63 @@
+"""
+Helpers shared by the tests and benchmarks.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from ankiutils import consts
+from ankiutils.consts import clear_consts_cache
+from ankiutils.sveltekit import _APIKEY
+
+AUTH = {"Authorization": f"Bearer {_APIKEY}"}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeAddonManager:
+    """Stands in for `mw.addonManager` with add-ons in `addons_dir`."""
+
+    def __init__(self, addons_dir: Path) -> None:
+        self.addons_dir = addons_dir
+        self.loads = 0
+
+    def addonFromModule(self, module: str) -> str:
+        return module.split(".", maxsplit=1)[0]
+
+    def addonsFolder(self, module: str) -> str:
+        return str(self.addons_dir / module)
+
+    def addon_meta(self, dir_name: str) -> Any:
+        self.loads += 1
+        # Anki reads meta.json here
+        try:
+            meta_path = self.addons_dir / dir_name / "meta.json"
+            with open(meta_path, encoding="utf-8") as file:
+                name = json.load(file)["name"]
+        except FileNotFoundError:
+            name = dir_name
+        return SimpleNamespace(dir_name=dir_name, human_name=lambda: name)
+
+
+def install_fake_addon_manager(
+    monkeypatch: pytest.MonkeyPatch, addons_dir: Path
+) -> FakeAddonManager:
+    """Make `get_consts()` use a `FakeAddonManager` instead of returning the
+    constants used in tests."""
+    manager = FakeAddonManager(addons_dir)
+    monkeypatch.setattr(consts, "is_testing", lambda: False)
+    monkeypatch.setattr(consts, "mw", SimpleNamespace(addonManager=manager))
+    clear_consts_cache()
+    return manager
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import dataclasses
+import threading
+from typing import Any, Optional
+
+import pytest
+
+from ankiutils.config import Config
+from ankiutils.config_schema import ConfigValueError
+
+
+class RecordingConfig(Config):
+    def __init__(self, write_delay: float | None = None) -> None:
+        super().__init__("addon", write_delay)
+        self.writes: list[dict[str, Any]] = []
+        self.written = threading.Event()
+
+    def _write(self, config: dict[str, Any]) -> None:
+        self.writes.append(config)
+        self.written.set()
+
+
+def test_changes_are_written_right_away() -> None:
+    config = RecordingConfig()
+    config["a"] = 1
+    config["b"] = 2
+    assert config.writes == [{"a": 1}, {"a": 1, "b": 2}]
+
+
+def test_batch_is_written_once() -> None:
+    config = RecordingConfig()
+    with config.batch():
+        for i in range(10):
+            config[f"key{i}"] = i
+        with config.batch():
+            config["nested"] = True
+        assert config.writes == []
+    assert config.writes == [{**{f"key{i}": i for i in range(10)}, "nested": True}]
+    with config.batch():
+        pass
+    assert len(config.writes) == 1
+
+
+def test_writes_are_debounced() -> None:
+    config = RecordingConfig(write_delay=0.05)
+    for i in range(10):
+        config["key"] = i
+    assert config.writes == []
+    assert config.written.wait(5)
+    assert config.writes == [{"key": 9}]
+
+
+def test_flush_writes_pending_changes() -> None:
+    config = RecordingConfig(write_delay=60)
+    config["key"] = 1
+    config.flush()
+    config.flush()
+    assert config.writes == [{"key": 1}]
+
+
+@dataclasses.dataclass
+class Settings:
+    timeout: float = 10.0
+    check_updates: bool = True
+    # Evaluated by get_type_hints(), which needs Optional on Python 3.9
+    name: Optional[str] = None  # noqa: UP045
+    tags: list[str] = dataclasses.field(default_factory=list)
+
+
+def test_schema_fills_defaults_and_validates() -> None:
+    config = RecordingConfig()
+    config["timeout"] = "slow"
+    config["other"] = 1
+    config.set_schema(Settings)
+    assert [error.key for error in config.validation_errors] == ["timeout"]
+    assert config.asdict() == {
+        "timeout": 10.0,
+        "check_updates": True,
+        "name": None,
+        "tags": [],
+        "other": 1,
+    }
+    config["timeout"] = 5
+    config["name"] = "name"
+    with pytest.raises(ConfigValueError):
+        config["check_updates"] = 1
+    assert config["check_updates"] is True
+
+
+def test_schema_from_defaults() -> None:
+    config = RecordingConfig()
+    config._defaults = {"limit": 10, "label": "x", "extra": None}
+    config._config_updated_action({"limit": "10", "extra": [1]})
+    config.set_schema()
+    assert config.asdict() == {"limit": 10, "label": "x", "extra": [1]}
+    # Invalid values from the config editor are ignored
+    config._config_updated_action({"limit": 20.5, "label": "y"})
+    assert config.asdict() == {"limit": 10, "label": "y", "extra": [1]}
+    assert [error.key for error in config.validation_errors] == ["limit"]
+    assert config.typed().label == "y"
+
+
+def test_typed_view() -> None:
+    config = RecordingConfig()
+    config.set_schema(Settings)
+    settings = config.typed(Settings)
+    assert isinstance(settings, Settings)
+    assert config.typed(Settings) is settings
+    assert settings.timeout == 10.0
+    settings.timeout = 3.0
+    assert config["timeout"] == 3.0
+    assert config.writes[-1]["timeout"] == 3.0
+    config._config_updated_action({"timeout": 4.0})
+    assert settings.timeout == 4.0
+    assert dataclasses.asdict(settings) == dataclasses.asdict(Settings(timeout=4.0))
+    with pytest.raises(ConfigValueError):
+        settings.check_updates = "yes"  # type: ignore[assignment]
+
+
+def test_change_callbacks() -> None:
+    config = RecordingConfig()
+    config["a"] = 1
+    changes: list[tuple[str, Any, Any]] = []
+    all_changes: list[str] = []
+    config.on_change(lambda *change: changes.append(change), "a")
+    config.on_change(lambda key, old, new: all_changes.append(key))
+    config["a"] = 1
+    config["a"] = 2
+    config["b"] = 3
+    config._config_updated_action({"a": 2, "b": 4})
+    assert changes == [("a", 1, 2)]
+    assert all_changes == ["a", "b", "b"]
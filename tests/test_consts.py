@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+from ankiutils.consts import get_consts
+
+from .helpers import FakeAddonManager
+
+
+def _write_manifest(path: Path, name: str, mtime: int) -> None:
+    path.write_text(json.dumps({"name": name}), encoding="utf-8")
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_consts_are_cached_per_addon(addon_manager: FakeAddonManager) -> None:
+    manifest = addon_manager.addons_dir / "myaddon" / "manifest.json"
+    _write_manifest(manifest, "Name", 1_000_000_000)
+    first = get_consts("myaddon.module")
+    assert first.name == "Name"
+    assert first.version == "dev"
+    assert get_consts("myaddon") is first
+    assert get_consts("myaddon.other", check_files=True) is first
+    assert addon_manager.loads == 1
+
+    _write_manifest(manifest, "New name", 2_000_000_000)
+    assert get_consts("myaddon") is first
+    assert get_consts("myaddon", check_files=True).name == "New name"
+    assert addon_manager.loads == 2
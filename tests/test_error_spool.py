@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+
+import pytest
+
+from ankiutils.error_spool import ErrorSpool, SpooledReport
+
+
+class StandInTransport:
+    def __init__(self) -> None:
+        self.batches: list[list[dict]] = []
+        self.attachments: list[bytes] = []
+        self.failing = False
+        self.delivered = threading.Event()
+
+    def __call__(self, reports: list[SpooledReport]) -> None:
+        if self.failing:
+            raise ConnectionError("offline")
+        self.batches.append([report.payload for report in reports])
+        for report in reports:
+            self.attachments.extend(path.read_bytes() for path in report.attachments)
+        self.delivered.set()
+
+
+def test_reports_are_delivered_in_batches(tmp_path: Path) -> None:
+    transport = StandInTransport()
+    spool = ErrorSpool(tmp_path / "spool", transport, batch_size=2)
+    log = tmp_path / "addon.log"
+    log.write_bytes(b"log line\n")
+    for i in range(3):
+        spool.enqueue({"n": i}, [log])
+    stats = spool.stats()
+    assert stats.pending == 3
+    assert stats.bytes > 3 * len(b"log line\n")
+
+    assert spool.deliver_batch() == 2
+    assert spool.deliver_batch() == 1
+    assert spool.deliver_batch() == 0
+    assert transport.batches == [[{"n": 0}, {"n": 1}], [{"n": 2}]]
+    assert transport.attachments == [b"log line\n"] * 3
+    stats = spool.stats()
+    assert (stats.pending, stats.bytes, stats.delivered) == (0, 0, 3)
+    assert stats.last_success is not None
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_failed_deliveries_are_kept(tmp_path: Path) -> None:
+    transport = StandInTransport()
+    transport.failing = True
+    spool = ErrorSpool(tmp_path, transport)
+    spool.enqueue({"n": 0})
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            spool.deliver_batch()
+    stats = spool.stats()
+    assert (stats.pending, stats.failures) == (1, 2)
+    assert stats.last_error == "ConnectionError('offline')"
+
+    # Reports survive a restart
+    transport.failing = False
+    spool = ErrorSpool(tmp_path, transport)
+    assert spool.deliver_batch() == 1
+    assert spool.stats().failures == 0
+
+
+def test_background_delivery(tmp_path: Path) -> None:
+    transport = StandInTransport()
+    transport.failing = True
+    spool = ErrorSpool(tmp_path, transport, retry_delay=0.01, poll_interval=60)
+    spool.start()
+    try:
+        spool.enqueue({"n": 0})
+        transport.failing = False
+        assert transport.delivered.wait(5)
+        assert transport.batches == [[{"n": 0}]]
+        transport.delivered.clear()
+        spool.enqueue({"n": 1})
+        assert transport.delivered.wait(5)
+    finally:
+        spool.stop()
+
+
+def test_size_limit_drops_oldest_reports(tmp_path: Path) -> None:
+    spool = ErrorSpool(tmp_path, StandInTransport(), max_bytes=100)
+    for i in range(5):
+        spool.enqueue({"data": "x" * 30, "n": i})
+    stats = spool.stats()
+    assert stats.bytes <= 100
+    assert stats.dropped == 5 - stats.pending
+    assert [report.payload["n"] for report in spool.pending()][-1] == 4
+
+
+def test_incomplete_writes_are_removed(tmp_path: Path) -> None:
+    spool = ErrorSpool(tmp_path, StandInTransport())
+    report_id = spool.enqueue({"n": 0})
+    (tmp_path / "1-partial.json.tmp").write_text("{")
+    (tmp_path / "2-partial.tmp").mkdir()
+    (tmp_path / "3-orphan").mkdir()
+    (tmp_path / "4-corrupt.json").write_text("{")
+
+    spool = ErrorSpool(tmp_path, StandInTransport())
+    assert [report.id for report in spool.pending()] == [report_id]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [f"{report_id}.json"]
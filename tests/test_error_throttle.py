@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from ankiutils.error_throttle import ReportThrottle, exception_fingerprint
+
+from .helpers import FakeClock
+
+
+def _throw(exc_type: type[Exception], message: str) -> None:
+    raise exc_type(message)
+
+
+def _raise(exc_type: type[Exception], message: str) -> Exception:
+    try:
+        _throw(exc_type, message)
+    except Exception as exc:
+        return exc
+    raise AssertionError
+
+
+def _raise_elsewhere(message: str) -> Exception:
+    try:
+        int(message)
+    except Exception as exc:
+        return exc
+    raise AssertionError
+
+
+def test_fingerprint_ignores_message() -> None:
+    first = exception_fingerprint(_raise(ValueError, "a"))
+    assert first == exception_fingerprint(_raise(ValueError, "b"))
+    assert first != exception_fingerprint(_raise(KeyError, "a"))
+    assert first != exception_fingerprint(_raise_elsewhere("a"))
+
+
+def test_repeats_are_counted_until_next_report() -> None:
+    clock = FakeClock()
+    throttle = ReportThrottle(repeat_window=60, clock=clock)
+    assert throttle.should_report(_raise(ValueError, "a"))
+    for _ in range(5):
+        assert not throttle.should_report(_raise(ValueError, "a"))
+    clock.now = 60
+    assert throttle.should_report(_raise(ValueError, "a"))
+    repeats = throttle.pop_repeats()
+    assert list(repeats.values()) == [{"exception": "ValueError", "count": 5}]
+    assert throttle.pop_repeats() == {}
+
+
+def test_distinct_exceptions_are_rate_limited() -> None:
+    clock = FakeClock()
+    throttle = ReportThrottle(rate=0.5, burst=2, clock=clock)
+    assert throttle.should_report(_raise(ValueError, "a"))
+    assert throttle.should_report(_raise(KeyError, "a"))
+    assert not throttle.should_report(_raise(TypeError, "a"))
+    clock.now = 2
+    assert throttle.should_report(_raise(TypeError, "a"))
+    assert not throttle.should_report(_raise(OSError, "a"))
+    assert len(throttle.pop_repeats()) == 2
+
+
+def test_old_fingerprints_are_forgotten() -> None:
+    throttle = ReportThrottle(burst=10, max_fingerprints=1)
+    assert throttle.should_report(_raise(ValueError, "a"))
+    assert throttle.should_report(_raise(KeyError, "a"))
+    assert throttle.should_report(_raise(ValueError, "a"))
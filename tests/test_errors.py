@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import gc
+import json
+import logging
+import threading
+import time
+import weakref
+from collections.abc import Iterator
+from pathlib import Path
+from types import TracebackType
+from typing import Any, cast
+
+import pytest
+import sentry_sdk
+import structlog
+from sentry_sdk.envelope import Envelope
+from sentry_sdk.scope import Scope
+from sentry_sdk.transport import Transport
+from sentry_sdk.types import Event
+
+from ankiutils import error_spool, errors
+from ankiutils.config import Config
+from ankiutils.consts import AddonConsts
+from ankiutils.error_spool import PartialDeliveryError
+from ankiutils.errors import (
+    ErrorReportingArgs,
+    _before_send,
+    _config_snapshot,
+    _set_scope_context,
+    _start_spool,
+    _this_addon_mentioned_in_tb,
+    spool_exception,
+)
+from ankiutils.log import BackgroundLogHandler
+from ankiutils.sentry_sampling import SentrySampling
+
+
+def _args(module: str, config: Config | None = None) -> ErrorReportingArgs:
+    consts = AddonConsts(module, module, Path(), "0.0.1", None, {}, None, None)
+    return ErrorReportingArgs(consts, cast(Any, config), structlog.stdlib.get_logger())
+
+
+def _traceback_from(filename: str) -> TracebackType:
+    code = compile("def fail():\n    raise ValueError\n", filename, "exec")
+    namespace: dict[str, Any] = {}
+    exec(code, namespace)
+    try:
+        namespace["fail"]()
+    except ValueError as exc:
+        assert exc.__traceback__
+        return exc.__traceback__
+    raise AssertionError
+
+
+def test_addon_frames_are_detected() -> None:
+    tb = _traceback_from("/home/user/Anki2/addons21/myaddon/module.py")
+    assert _this_addon_mentioned_in_tb(tb, _args("myaddon"))
+    assert not _this_addon_mentioned_in_tb(tb, _args("myaddon2"))
+    assert not _this_addon_mentioned_in_tb(tb, _args("other"))
+    windows_tb = _traceback_from(r"C:\Anki2\addons21\myaddon\module.py")
+    assert _this_addon_mentioned_in_tb(windows_tb, _args("myaddon"))
+
+
+def test_results_are_memoized_on_the_exception() -> None:
+    tb = _traceback_from("/addons21/cached/module.py")
+    exception = ValueError()
+    args = _args("cached")
+    assert _this_addon_mentioned_in_tb(tb, args, exception)
+    assert exception.__dict__[errors._TB_RESULTS_ATTR] == {"cached": (tb, True)}
+    exception.__dict__[errors._TB_RESULTS_ATTR]["cached"] = (tb, False)
+    assert not _this_addon_mentioned_in_tb(tb, args, exception)
+    # Results for other tracebacks aren't used
+    other_tb = _traceback_from("/addons21/cached/other.py")
+    assert _this_addon_mentioned_in_tb(other_tb, args, exception)
+
+
+class Dialog:
+    pass
+
+
+def _raise_with_local(dialog: Dialog) -> None:
+    raise ValueError(dialog)
+
+
+def test_tracebacks_are_not_kept_alive() -> None:
+    dialog = Dialog()
+    dialog_ref = weakref.ref(dialog)
+    try:
+        _raise_with_local(dialog)
+    except ValueError as exc:
+        assert exc.__traceback__
+        assert not _this_addon_mentioned_in_tb(exc.__traceback__, _args("myaddon"), exc)
+    del dialog
+    gc.collect()
+    assert dialog_ref() is None
+
+
+def test_scope_context_is_cached_until_config_changes(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    calls = {"pointVersion": 0, "snapshot": 0}
+
+    def point_version() -> int:
+        calls["pointVersion"] += 1
+        return 250000
+
+    def snapshot(config: dict[str, Any]) -> dict[str, Any]:
+        calls["snapshot"] += 1
+        return _config_snapshot(config)
+
+    monkeypatch.setattr(errors, "pointVersion", point_version)
+    monkeypatch.setattr(errors, "_config_snapshot", snapshot)
+    config = Config("scoped")
+    config["option"] = 1
+    args = _args("scoped", config)
+    for _ in range(3):
+        scope = Scope()
+        _set_scope_context(scope, args, {"extra": {"key": "value"}})
+    assert calls == {"pointVersion": 1, "snapshot": 1}
+    assert scope._tags == {"os": errors.sys.platform, "add-on": "scoped"}
+    assert scope._contexts["anki version"] == {"version": 250000}
+    assert scope._contexts["add-on config"] == {"option": 1}
+    assert scope._contexts["extra"] == {"key": "value"}
+
+    config["option"] = 2
+    scope = Scope()
+    _set_scope_context(scope, args, {})
+    assert calls == {"pointVersion": 1, "snapshot": 2}
+    assert scope._contexts["add-on config"] == {"option": 2}
+
+
+def test_config_snapshot_is_size_bounded() -> None:
+    config = {"small": 1, "large": "x" * errors.MAX_CONFIG_CONTEXT_BYTES, "last": 2}
+    snapshot = _config_snapshot(config)
+    assert snapshot["small"] == 1
+    assert snapshot["large"] == f"<{errors.MAX_CONFIG_CONTEXT_BYTES + 2} bytes omitted>"
+    assert snapshot["last"] == 2
+    assert len(json.dumps(snapshot)) <= errors.MAX_CONFIG_CONTEXT_BYTES
+
+
+class StandInSentryTransport(Transport):
+    def __init__(self, options: dict[str, Any] | None = None) -> None:
+        super().__init__(options)
+        self.events: list[Event] = []
+        self.healthy = True
+
+    def capture_envelope(self, envelope: Envelope) -> None:
+        event = envelope.get_event()
+        if event is not None:
+            self.events.append(event)
+
+    def is_healthy(self) -> bool:
+        return self.healthy
+
+
+@pytest.fixture
+def spooled_args(
+    tmp_path: Path, consts: AddonConsts, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[tuple[ErrorReportingArgs, StandInSentryTransport]]:
+    config = Config("addon")
+    config["report_errors"] = True
+    args = ErrorReportingArgs(
+        consts,
+        config,
+        structlog.stdlib.BoundLogger(logging.getLogger("addon"), [], {}),
+        spool_reports=True,
+        sentry_sampling=SentrySampling(max_events_per_minute=1),
+    )
+    log = tmp_path / "addon.log"
+    log.write_text("log line\n")
+    monkeypatch.setattr(errors, "current_log_file", lambda addon: log)
+    monkeypatch.setattr(
+        errors, "upload_file", lambda path, name, on_progress: f"https://logs/{name}"
+    )
+    monkeypatch.setattr(
+        errors, "upload_bytes", lambda data, name, on_progress: f"https://logs/{name}"
+    )
+    sentry_sdk.init(
+        dsn="https://key@sentry.invalid/1",
+        transport=StandInSentryTransport,
+        default_integrations=False,
+        before_send=lambda event, hint: _before_send(args, event, hint),
+    )
+    transport = sentry_sdk.get_client().transport
+    assert isinstance(transport, StandInSentryTransport)
+    # Deliveries are made by the test instead of the spool's thread
+    _start_spool(args).stop()
+    yield args, transport
+    errors._spools.clear()
+    sentry_sdk.init()
+
+
+def _raise_and_spool(args: ErrorReportingArgs, message: str) -> str | None:
+    try:
+        raise ValueError(message)  # noqa: TRY301
+    except ValueError as exc:
+        return spool_exception(exc, args, {"extra": {"n": message}})
+
+
+def test_spooled_reports_are_sent_to_sentry(
+    spooled_args: tuple[ErrorReportingArgs, StandInSentryTransport],
+) -> None:
+    args, transport = spooled_args
+    spool = errors.get_error_spool(args)
+    assert spool
+    first_id = _raise_and_spool(args, "first")
+    second_id = _raise_and_spool(args, "second")
+    assert spool.stats().pending == 2
+
+    # The second event is dropped by the per-minute cap and stays in the spool
+    with pytest.raises(PartialDeliveryError):
+        spool.deliver_batch()
+    (event,) = transport.events
+    assert event["event_id"] == first_id
+    assert event["exception"]["values"][0]["value"] == "first"
+    assert event["contexts"]["extra"] == {"n": "first"}
+    assert str(event["contexts"]["logs"]["filename"]).endswith(".log")
+    assert event["tags"]["add-on"] == "addon"
+    stats = spool.stats()
+    assert (stats.pending, stats.delivered, stats.failures) == (1, 1, 1)
+
+    args.sentry_sampling.max_events_per_minute = None
+    assert spool.deliver_batch() == 1
+    assert transport.events[-1]["event_id"] == second_id
+    assert spool.stats().pending == 0
+
+
+def test_spooled_reports_are_kept_if_sentry_is_unhealthy(
+    spooled_args: tuple[ErrorReportingArgs, StandInSentryTransport],
+) -> None:
+    args, transport = spooled_args
+    args.sentry_sampling.max_events_per_minute = None
+    spool = errors.get_error_spool(args)
+    assert spool
+    _raise_and_spool(args, "offline")
+    transport.healthy = False
+    with pytest.raises(PartialDeliveryError):
+        spool.deliver_batch()
+    assert spool.stats().pending == 1
+    transport.healthy = True
+    assert spool.deliver_batch() == 1
+
+
+def test_spooled_reports_are_kept_if_a_log_upload_fails(
+    spooled_args: tuple[ErrorReportingArgs, StandInSentryTransport],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    args, transport = spooled_args
+    args.sentry_sampling.max_events_per_minute = None
+    spool = errors.get_error_spool(args)
+    assert spool
+    _raise_and_spool(args, "first")
+    _raise_and_spool(args, "second")
+    uploads = iter([None, OSError("offline")])
+
+    def upload_file(path: Path, name: str, on_progress: Any) -> str:
+        error = next(uploads)
+        if error:
+            raise error
+        return f"https://logs/{name}"
+
+    monkeypatch.setattr(errors, "upload_file", upload_file)
+    with pytest.raises(PartialDeliveryError) as exc_info:
+        spool.deliver_batch()
+    assert exc_info.value.delivered == 1
+    assert len(transport.events) == 1
+    (report,) = spool.pending()
+    assert report.payload["context"]["extra"] == {"n": "second"}
+
+
+def test_spooled_reports_upload_logs_incrementally(
+    spooled_args: tuple[ErrorReportingArgs, StandInSentryTransport],
+) -> None:
+    args, transport = spooled_args
+    args.incremental_log_uploads = True
+    spool = errors.get_error_spool(args)
+    assert spool
+    _raise_and_spool(args, "first")
+    assert spool.deliver_batch() == 1
+    (event,) = transport.events
+    assert str(event["contexts"]["logs"]["filename"]).endswith(".manifest.json")
+    # Uploaded chunks are recorded next to the log file
+    assert (args.consts.dir / "addon.log").with_name("uploads.json").exists()
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.unblocked = threading.Event()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.unblocked.wait()
+
+
+def test_spooling_does_not_block_on_logging(
+    spooled_args: tuple[ErrorReportingArgs, StandInSentryTransport],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    args, _ = spooled_args
+    blocking = BlockingHandler()
+    handler = BackgroundLogHandler([blocking])
+    logger = logging.getLogger("addon")
+    logger.addHandler(handler)
+    monkeypatch.setattr(error_spool.os, "fsync", lambda fd: pytest.fail("synced"))
+    try:
+        logger.warning("stuck")
+        start = time.monotonic()
+        assert _raise_and_spool(args, "first")
+        assert time.monotonic() - start < errors.SPOOL_LOG_FLUSH_TIMEOUT + 1
+    finally:
+        blocking.unblocked.set()
+        logger.removeHandler(handler)
+        handler.close()
+    spool = errors.get_error_spool(args)
+    assert spool
+    assert spool.stats().pending == 1
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import io
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+import pytest
+import requests
+
+from ankiutils import gofile
+
+
+class FakeGofile(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FakeGofileHandler)
+        self.servers = ["store1"]
+        self.failing_servers: set[str] = set()
+        # Statuses returned by the next requests to rename files
+        self.rename_statuses: list[int] = []
+        self.server_requests = 0
+        self.connections = 0
+        self.uploads: list[dict[str, Any]] = []
+        self.renames: list[dict[str, Any]] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeGofileHandler(BaseHTTPRequestHandler):
+    server: FakeGofile
+    # Keep connections alive
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, data: Any, status: int = 200) -> None:
+        body = json.dumps({"status": "ok", "data": data}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers["Content-Length"]))
+
+    def do_GET(self) -> None:
+        self.server.server_requests += 1
+        self._send_json(
+            {"servers": [{"name": name, "zone": "eu"} for name in self.server.servers]}
+        )
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        if self.path.split("/")[1] in self.server.failing_servers:
+            self._send_json({}, status=500)
+            return
+        boundary = self.headers.get_param("boundary")
+        parts = {}
+        for part in body.split(f"--{boundary}".encode())[1:-1]:
+            headers, _, content = part[2:-2].partition(b"\r\n\r\n")
+            name = headers.split(b'name="')[1].split(b'"')[0].decode()
+            parts[name] = content
+        self.server.uploads.append(
+            {"path": self.path, "headers": dict(self.headers), "parts": parts}
+        )
+        file_id = str(len(self.server.uploads))
+        self._send_json(
+            {"id": file_id, "downloadPage": f"{self.server.url}/d/{file_id}"}
+        )
+
+    def do_PUT(self) -> None:
+        body = json.loads(self._read_body())
+        if self.server.rename_statuses:
+            self._send_json({}, status=self.server.rename_statuses.pop(0))
+            return
+        self.server.renames.append({"path": self.path, "body": body})
+        self._send_json({})
+
+
+@pytest.fixture
+def fake_gofile(monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeGofile]:
+    server = FakeGofile()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(gofile, "API_URL", server.url)
+    monkeypatch.setattr(gofile, "UPLOAD_URL", server.url + "/{server}/uploadfile")
+    monkeypatch.setattr(gofile, "RETRY_BACKOFF", 0)
+    gofile.close_session()
+    gofile.invalidate_servers_cache()
+    yield server
+    gofile.close_session()
+    gofile.invalidate_servers_cache()
+    server.shutdown()
+    server.server_close()
+
+
+class RecordingFile(io.BytesIO):
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.read_sizes: list[int] = []
+
+    def read(self, size: int | None = -1) -> bytes:
+        data = super().read(size)
+        self.read_sizes.append(len(data))
+        return data
+
+
+def test_upload_streams_file(fake_gofile: FakeGofile) -> None:
+    data = bytes(range(256)) * 2000
+    file = RecordingFile(data)
+    progress: list[tuple[int, int]] = []
+    url = gofile.upload_fileobj(
+        file, "addon.log", lambda sent, total: progress.append((sent, total))
+    )
+
+    (upload,) = fake_gofile.uploads
+    assert upload["path"] == "/store1/uploadfile"
+    assert "Transfer-Encoding" not in upload["headers"]
+    assert upload["parts"]["file"] == data
+    assert upload["parts"]["folderId"] == gofile.LOGS_FOLDER_ID.encode()
+    assert max(file.read_sizes) <= gofile.CHUNK_SIZE
+    assert fake_gofile.renames[0]["body"]["attributeValue"] == "addon.log"
+    assert url.endswith("/d/1")
+
+    sent = [value for value, _ in progress]
+    assert sent == sorted(sent)
+    assert progress[-1] == (int(upload["headers"]["Content-Length"]),) * 2
+
+
+def test_upload_file(fake_gofile: FakeGofile, tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    path.write_bytes(b"log line\n" * 10000)
+    gofile.upload_file(path, "addon.log")
+    assert fake_gofile.uploads[0]["parts"]["file"] == path.read_bytes()
+
+
+def test_connections_and_servers_are_reused(fake_gofile: FakeGofile) -> None:
+    for i in range(3):
+        gofile.upload_bytes(b"data", f"{i}.log")
+    assert len(fake_gofile.uploads) == 3
+    assert fake_gofile.server_requests == 1
+    assert fake_gofile.connections == 1
+
+
+def test_upload_falls_back_to_next_server(fake_gofile: FakeGofile) -> None:
+    fake_gofile.servers = ["store1", "store2"]
+    fake_gofile.failing_servers = {"store1"}
+    progress: list[int] = []
+    gofile.upload_bytes(b"data", "addon.log", lambda sent, _: progress.append(sent))
+    (upload,) = fake_gofile.uploads
+    assert upload["path"] == "/store2/uploadfile"
+    assert upload["parts"]["file"] == b"data"
+
+    fake_gofile.failing_servers = {"store1", "store2"}
+    with pytest.raises(requests.HTTPError):
+        gofile.upload_bytes(b"data", "addon.log")
+    # The server list is fetched again after all servers failed
+    fake_gofile.failing_servers = set()
+    gofile.upload_bytes(b"data", "addon.log")
+    assert fake_gofile.server_requests == 2
+
+
+def test_api_requests_are_retried(fake_gofile: FakeGofile) -> None:
+    fake_gofile.rename_statuses = [503, 502]
+    gofile.upload_bytes(b"data", "addon.log")
+    assert fake_gofile.renames[0]["body"]["attributeValue"] == "addon.log"
+
+    fake_gofile.rename_statuses = [503] * (gofile.RETRIES + 1)
+    with pytest.raises(requests.HTTPError):
+        gofile.upload_bytes(b"data", "addon.log")
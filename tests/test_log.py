@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+import structlog
+from structlog.processors import CallsiteParameter
+
+from ankiutils import log
+from ankiutils.log import (
+    BackgroundLogHandler,
+    _CallsiteAdder,
+    _shared_log_processors,
+    _structlog_formatter,
+    current_log_file,
+    get_logger,
+)
+from ankiutils.log_storage import IndexedRotatingFileHandler
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self, gate: threading.Event | None = None) -> None:
+        super().__init__()
+        self.gate = gate
+        self.messages: list[str] = []
+        self.threads: set[str] = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.gate:
+            self.gate.wait()
+        self.messages.append(record.getMessage())
+        self.threads.add(threading.current_thread().name)
+
+
+def _logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"ankiutils.tests.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+    return logger
+
+
+def test_background_handler_writes_on_another_thread() -> None:
+    target = RecordingHandler()
+    handler = BackgroundLogHandler([target])
+    logger = _logger("background", handler)
+    for i in range(100):
+        logger.info("message %d", i)
+    assert handler.wait()
+    assert target.messages == [f"message {i}" for i in range(100)]
+    assert threading.current_thread().name not in target.threads
+
+    handler.stop()
+    logger.info("after stop")
+    assert target.messages[-1] == "after stop"
+    handler.close()
+
+
+def test_background_handler_drops_oldest_when_full() -> None:
+    gate = threading.Event()
+    target = RecordingHandler(gate)
+    handler = BackgroundLogHandler(
+        [target], queue_size=2, overflow_policy="drop_oldest"
+    )
+    logger = _logger("drop_oldest", handler)
+    logger.info("0")
+    # Wait for the listener to pick up the first record and block on it
+    while handler.queue.qsize():
+        pass
+    for i in range(1, 6):
+        logger.info(str(i))
+    gate.set()
+    assert handler.wait()
+    assert target.messages == ["0", "4", "5"]
+    assert handler.dropped == 3
+    handler.close()
+
+
+def test_background_handler_samples_when_full() -> None:
+    gate = threading.Event()
+    target = RecordingHandler(gate)
+    handler = BackgroundLogHandler(
+        [target], queue_size=20, overflow_policy="sample", sample_every=5
+    )
+    logger = _logger("sample", handler)
+    logger.info("first")
+    while handler.queue.qsize():
+        pass
+    for i in range(20):
+        logger.info(str(i))
+    for i in range(4):
+        logger.info(f"overflow {i}")
+    # Errors are always kept, so this waits for room in the queue
+    threading.Timer(0.1, gate.set).start()
+    logger.error("error")
+    assert handler.wait()
+    assert target.messages == ["first", *(str(i) for i in range(20)), "error"]
+    assert handler.dropped == 4
+    logger.info("kept")
+    assert handler.wait()
+    assert target.messages[-1] == "kept"
+    handler.close()
+
+
+def test_callsite_adder_matches_structlog() -> None:
+    expected = structlog.processors.CallsiteParameterAdder(
+        [
+            CallsiteParameter.THREAD,
+            CallsiteParameter.MODULE,
+            CallsiteParameter.FUNC_NAME,
+        ]
+    )
+    adder = _CallsiteAdder()
+    for _ in range(2):
+        assert adder(None, "info", {}) == expected(None, "info", {})
+
+
+def _structlog_to_stream(
+    name: str, level: int, processors: Any = None
+) -> tuple[structlog.stdlib.BoundLogger, io.StringIO]:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    renderer = structlog.processors.JSONRenderer()
+    if processors is None:
+        handler.setFormatter(_structlog_formatter("addon", renderer))
+    else:
+        handler.setFormatter(_structlog_formatter("addon", renderer, processors))
+    std_logger = _logger(name, handler)
+    std_logger.setLevel(level)
+    logger = structlog.wrap_logger(
+        std_logger,
+        processors=[
+            *_shared_log_processors("addon"),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    )
+    return logger, stream
+
+
+def test_structlog_output_format() -> None:
+    logger, stream = _structlog_to_stream("format", logging.INFO)
+    logger.debug("skipped")
+    try:
+        int("boom")
+    except ValueError:
+        logger.exception("failed", key="value")
+    (line,) = stream.getvalue().splitlines()
+    event = json.loads(line)
+    assert event.keys() == {
+        "event",
+        "key",
+        "level",
+        "thread",
+        "module",
+        "func_name",
+        "timestamp",
+        "exception",
+    }
+    assert event["event"] == "failed"
+    assert event["level"] == "error"
+    assert event["module"] == "test_log"
+    assert event["func_name"] == "test_structlog_output_format"
+    assert event["timestamp"].endswith("Z")
+    assert "ValueError: invalid literal" in event["exception"]
+
+
+def test_handler_processors_are_configurable() -> None:
+    logger, stream = _structlog_to_stream("processors", logging.DEBUG, ())
+    logger.info("message")
+    event = json.loads(stream.getvalue())
+    assert "timestamp" not in event
+    assert event["event"] == "message"
+
+
+def test_background_handler_formats_captured_exception() -> None:
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(
+        _structlog_formatter("addon", structlog.processors.JSONRenderer())
+    )
+    handler = BackgroundLogHandler([target])
+    std_logger = _logger("background_exc", handler)
+    logger = structlog.wrap_logger(
+        std_logger,
+        processors=[
+            *_shared_log_processors("addon"),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    )
+    try:
+        os.environ["ANKIUTILS_MISSING"]
+    except KeyError:
+        logger.exception("failed")
+    assert handler.wait()
+    assert "ANKIUTILS_MISSING" in json.loads(stream.getvalue())["exception"]
+    handler.close()
+
+
+@pytest.fixture
+def reset_logging() -> Iterator[None]:
+    yield
+    for addon_logging in log._addon_logging.values():
+        addon_logging.close()
+    log._addon_logging.clear()
+    structlog.reset_defaults()
+
+
+@pytest.mark.usefixtures("reset_logging")
+def test_get_logger_sets_up_logging_once(capsys: pytest.CaptureFixture[str]) -> None:
+    loggers = [get_logger(f"addon.module{i}") for i in range(5)]
+    assert all(logger is loggers[0] for logger in loggers)
+    assert len(logging.getLogger("addon").handlers) == 1
+    for logger in loggers:
+        logger.info("logged once")
+    assert capsys.readouterr().out.count("logged once") == len(loggers)
+
+
+@pytest.mark.usefixtures("reset_logging")
+def test_current_log_file_is_the_active_one(tmp_path: Path) -> None:
+    get_logger("addon")
+    assert current_log_file("addon") is None
+    # A file left from when the add-on logged with compression
+    (tmp_path / "addon.log.gz").write_bytes(b"")
+    handler = IndexedRotatingFileHandler(tmp_path / "addon.log", encoding="utf-8")
+    log._addon_logging["addon"].file_handler = handler
+    handler.emit(logging.makeLogRecord({"msg": "line"}))
+    assert current_log_file("addon") == tmp_path / "addon.log"
+    handler.close()
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import logging.handlers
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from ankiutils import log_storage
+from ankiutils.log_storage import (
+    CompressedRotatingFileHandler,
+    IndexedRotatingFileHandler,
+    iter_all_records,
+    iter_logs,
+    iter_records,
+    log_segments,
+)
+
+from .helpers import FakeClock
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc)
+        return json.dumps(
+            {
+                "event": record.getMessage(),
+                "level": record.levelname.lower(),
+                "thread": record.thread,
+                "timestamp": timestamp.isoformat().replace("+00:00", "Z"),
+            }
+        )
+
+
+def _logger(name: str, handler: logging.Handler) -> logging.Logger:
+    handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger(f"ankiutils.tests.log_storage.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+    return logger
+
+
+def test_records_are_written_in_blocks(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log.gz"
+    clock = FakeClock()
+    handler = CompressedRotatingFileHandler(path, block_size=1024, clock=clock)
+    logger = _logger("blocks", handler)
+    logger.info("buffered")
+    assert not path.exists()
+    clock.now = 10
+    logger.info("interval elapsed")
+    size = path.stat().st_size
+    logger.info("buffered again")
+    assert path.stat().st_size == size
+    logger.error("errors are written immediately")
+    assert path.stat().st_size > size
+    logger.info("written on close")
+    handler.close()
+
+    events = [record["event"] for record in iter_records(path)]
+    assert events == [
+        "buffered",
+        "interval elapsed",
+        "buffered again",
+        "errors are written immediately",
+        "written on close",
+    ]
+    # Blocks are plain gzip members
+    with gzip.open(path, "rt") as file:
+        assert len(file.readlines()) == len(events)
+
+
+def test_idle_buffer_is_written_after_interval(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log.gz"
+    handler = CompressedRotatingFileHandler(path, flush_interval=0.05)
+    logger = _logger("idle", handler)
+    logger.info("idle")
+    deadline = time.monotonic() + 5
+    while not (path.exists() and path.stat().st_size) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [record["event"] for record in iter_records(path)] == ["idle"]
+    handler.close()
+
+
+def test_rotation_uses_compressed_size(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log.gz"
+    handler = CompressedRotatingFileHandler(
+        path, max_bytes=2048, backup_count=2, block_size=1
+    )
+    logger = _logger("rotation", handler)
+    for i in range(200):
+        logger.info("message %d", i)
+    handler.close()
+
+    segments = log_segments(path)
+    assert [segment.name for segment in segments] == [
+        "addon.log.gz.2",
+        "addon.log.gz.1",
+        "addon.log.gz",
+    ]
+    assert all(segment.stat().st_size <= 2048 for segment in segments)
+    events = [record["event"] for record in iter_all_records(path)]
+    assert events == [f"message {i}" for i in range(200 - len(events), 200)]
+
+
+def test_reader_is_lazy_and_skips_truncated_block(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log.gz"
+    handler = CompressedRotatingFileHandler(path, block_size=1)
+    logger = _logger("truncated", handler)
+    for i in range(3):
+        logger.info(str(i))
+    handler.close()
+    data = path.read_bytes()
+    # Cut the last block off after its gzip header
+    path.write_bytes(data[: data.rindex(b"\x1f\x8b") + 12])
+
+    records = iter_records(path)
+    assert next(records)["event"] == "0"
+    assert [record["event"] for record in records] == ["1"]
+
+
+def test_truncated_block_is_cut_off_before_appending(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log.gz"
+    for session in ("a", "b"):
+        handler = CompressedRotatingFileHandler(path, block_size=1)
+        logger = _logger(f"crash_{session}", handler)
+        for i in range(3):
+            logger.info(f"{session}{i}")
+        handler.close()
+        if session == "a":
+            data = path.read_bytes()
+            path.write_bytes(data[: data.rindex(b"\x1f\x8b") + 12])
+
+    events = ["a0", "a1", "b0", "b1", "b2"]
+    assert [record["event"] for record in iter_records(path)] == events
+    assert [record["event"] for record in iter_logs(path)] == events
+    with gzip.open(path, "rt") as file:
+        assert len(file.readlines()) == len(events)
+
+
+def test_reader_accepts_plain_files(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    path.write_text('{"event": "a"}\n{"event": "b"}\n', encoding="utf-8")
+    assert [record["event"] for record in iter_records(path)] == ["a", "b"]
+
+
+def _emit(
+    handler: logging.Handler,
+    message: str,
+    created: float,
+    level: int = logging.INFO,
+    thread: int = 1,
+) -> None:
+    record = logging.LogRecord("test", level, __file__, 0, message, None, None)
+    record.created = created
+    record.thread = thread
+    handler.handle(record)
+
+
+def _count_block_reads(monkeypatch: pytest.MonkeyPatch) -> list[int]:
+    reads: list[int] = []
+    decode_block = log_storage._decode_block
+
+    def counting_decode_block(data: bytes, compressed: bool) -> Any:
+        reads.append(len(data))
+        return decode_block(data, compressed)
+
+    monkeypatch.setattr(log_storage, "_decode_block", counting_decode_block)
+    return reads
+
+
+def test_index_limits_reads(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "addon.log"
+    handler = IndexedRotatingFileHandler(path, index_block_size=500)
+    handler.setFormatter(JSONFormatter())
+    for i in range(100):
+        level = logging.ERROR if i == 42 else logging.INFO
+        _emit(handler, str(i), created=i * 60.0, level=level, thread=i % 2)
+    handler.close()
+
+    entries = log_storage._read_index(path, path.stat().st_size)
+    assert len(entries) > 5
+    assert entries[-1]["offset"] + entries[-1]["length"] == path.stat().st_size
+    assert sum(sum(entry["levels"].values()) for entry in entries) == 100
+
+    reads = _count_block_reads(monkeypatch)
+    since = datetime.fromtimestamp(90 * 60, tz=timezone.utc)
+    events = [record["event"] for record in iter_logs(path, since=since)]
+    assert events == [str(i) for i in range(90, 100)]
+    assert len(reads) == len([entry for entry in entries if entry["end"] >= 90 * 60])
+    assert len(reads) < len(entries) / 2
+
+    reads.clear()
+    errors = list(iter_logs(path, min_level="error"))
+    assert [record["event"] for record in errors] == ["42"]
+    assert len(reads) == 1
+
+    events = [
+        record["event"] for record in iter_logs(path, since=0, until=600, thread=1)
+    ]
+    assert events == ["1", "3", "5", "7", "9"]
+
+
+def test_iter_logs_across_rotated_segments(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    handler = IndexedRotatingFileHandler(
+        path, maxBytes=4000, backupCount=3, index_block_size=300
+    )
+    handler.setFormatter(JSONFormatter())
+    for i in range(150):
+        _emit(handler, str(i), created=float(i))
+    # Records logged after the last index entry are found too
+    handler.close()
+    with open(path, "a", encoding="utf-8") as file:
+        record = {"event": "unindexed", "timestamp": "2024-01-01T00:00:00Z"}
+        file.write(json.dumps(record) + "\n")
+
+    assert len(log_segments(path)) == 4
+    for segment in log_segments(path):
+        assert log_storage._read_index(segment, segment.stat().st_size)
+    records = list(iter_logs(path))
+    assert records == list(iter_all_records(path))
+    assert records[-1]["event"] == "unindexed"
+    events = [record["event"] for record in iter_logs(path, since=140, until=145)]
+    assert events == [str(i) for i in range(140, 146)]
+
+
+def test_iter_logs_reads_content_from_before_indexing(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    # Written by `RotatingFileHandler` before the add-on was upgraded
+    plain = logging.handlers.RotatingFileHandler(path)
+    plain.setFormatter(JSONFormatter())
+    for i in range(50):
+        _emit(plain, f"old {i}", created=float(i), level=logging.ERROR)
+    plain.close()
+    handler = IndexedRotatingFileHandler(path, index_block_size=100)
+    handler.setFormatter(JSONFormatter())
+    for i in range(5):
+        _emit(handler, f"new {i}", created=float(50 + i))
+    handler.close()
+
+    assert log_storage._read_index(path, path.stat().st_size)[0]["offset"] > 0
+    records = list(iter_logs(path))
+    assert records == list(iter_all_records(path))
+    assert len(records) == 55
+    assert len(list(iter_logs(path, min_level="error"))) == 50
+
+
+def test_iter_logs_reads_blocks_missing_from_index(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    for session in ("first", "crashed", "last"):
+        handler = IndexedRotatingFileHandler(path, index_block_size=10_000)
+        handler.setFormatter(JSONFormatter())
+        for i in range(3):
+            _emit(handler, f"{session} {i}", created=float(i))
+        if session == "crashed":
+            # The handler is never closed, so its block isn't indexed
+            assert handler.stream is not None
+            handler.stream.close()
+        else:
+            handler.close()
+
+    assert len(log_storage._read_index(path, path.stat().st_size)) == 2
+    events = [record["event"] for record in iter_logs(path)]
+    assert events == [
+        f"{session} {i}" for session in ("first", "crashed", "last") for i in range(3)
+    ]
+    assert [record["event"] for record in iter_logs(path, since=2)] == [
+        "first 2",
+        "crashed 2",
+        "last 2",
+    ]
+
+
+def test_compressed_segments_are_indexed(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "addon.log.gz"
+    handler = CompressedRotatingFileHandler(
+        path, max_bytes=1024, backup_count=5, block_size=300
+    )
+    handler.setFormatter(JSONFormatter())
+    for i in range(200):
+        _emit(handler, str(i), created=float(i), thread=7 if i == 150 else 1)
+    handler.close()
+
+    assert len(log_segments(path)) > 1
+    reads = _count_block_reads(monkeypatch)
+    assert [record["event"] for record in iter_logs(path, thread=7)] == ["150"]
+    assert len(reads) == 1
+
+
+def test_stale_index_is_ignored(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    handler = IndexedRotatingFileHandler(path, index_block_size=100)
+    handler.setFormatter(JSONFormatter())
+    for i in range(20):
+        _emit(handler, str(i), created=float(i))
+    handler.close()
+    path.write_text(json.dumps({"event": "new", "level": "info"}) + "\n")
+    assert [record["event"] for record in iter_logs(path)] == ["new"]
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from ankiutils.log_upload import file_checksum, upload_log_chunks
+
+
+class FakeStorage:
+    def __init__(self) -> None:
+        self.files: dict[str, bytes] = {}
+        self.uploads: list[str] = []
+
+    def upload(self, data: bytes, name: str) -> str:
+        self.uploads.append(name)
+        url = f"https://example.com/{name}"
+        self.files[url] = data
+        return url
+
+    def restore(self, manifest_url: str) -> dict[str, bytes]:
+        manifest = json.loads(self.files[manifest_url])
+        return {
+            segment["name"]: b"".join(
+                self.files[chunk["url"]] for chunk in segment["chunks"]
+            )
+            for segment in manifest["segments"]
+        }
+
+
+def test_file_checksum(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    data = os.urandom(10_000)
+    path.write_bytes(data)
+    assert file_checksum(path, chunk_size=1000) == hashlib.sha1(data).hexdigest()
+
+
+def test_only_new_chunks_are_uploaded(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    storage = FakeStorage()
+    path.write_bytes(b"a" * 250)
+    url, name = upload_log_chunks(path, "addon", storage.upload, chunk_size=100)
+    assert name.endswith(".manifest.json")
+    # Two identical full chunks are only uploaded once
+    assert len(storage.uploads) == 3
+    assert storage.restore(url) == {"addon.log": path.read_bytes()}
+
+    storage.uploads.clear()
+    with open(path, "ab") as file:
+        file.write(b"b" * 100)
+    url, _ = upload_log_chunks(path, "addon", storage.upload, chunk_size=100)
+    # The changed last chunk, a new chunk and the manifest
+    assert len(storage.uploads) == 3
+    assert storage.restore(url) == {"addon.log": path.read_bytes()}
+
+    storage.uploads.clear()
+    os.replace(path, tmp_path / "addon.log.1")
+    path.write_bytes(b"c" * 50)
+    url, _ = upload_log_chunks(path, "addon", storage.upload, chunk_size=100)
+    assert storage.uploads[:-1] == [f"addon_{hashlib.sha1(b'c' * 50).hexdigest()}.part"]
+    assert storage.restore(url) == {
+        "addon.log.1": (tmp_path / "addon.log.1").read_bytes(),
+        "addon.log": path.read_bytes(),
+    }
+
+
+def test_uploaded_chunks_are_kept_after_failure(tmp_path: Path) -> None:
+    path = tmp_path / "addon.log"
+    path.write_bytes(b"a" * 100 + b"b" * 100)
+    storage = FakeStorage()
+
+    def failing_upload(data: bytes, name: str) -> str:
+        if data.startswith(b"b"):
+            raise ConnectionError
+        return storage.upload(data, name)
+
+    with pytest.raises(ConnectionError):
+        upload_log_chunks(path, "addon", failing_upload, chunk_size=100)
+    assert len(storage.uploads) == 1
+    upload_log_chunks(path, "addon", storage.upload, chunk_size=100)
+    assert len(storage.uploads) == 3
+
+    state = json.loads((tmp_path / "uploads.json").read_text())
+    assert len(state["chunks"]) == 2
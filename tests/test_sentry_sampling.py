@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Any, cast
+
+import structlog
+from sentry_sdk.integrations.logging import LoggingIntegration
+
+from ankiutils.consts import AddonConsts
+from ankiutils.errors import (
+    ErrorReportingArgs,
+    _add_record_filters,
+    _before_send,
+    _before_send_log,
+)
+from ankiutils.sentry_sampling import EVENTS, LOGS, SentrySampling
+
+from .helpers import FakeClock
+
+
+def _record(name: str, level: int) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "message", None, None)
+
+
+def _args(sampling: SentrySampling) -> ErrorReportingArgs:
+    consts = AddonConsts("addon", "addon", Path(), "0.0.1", None, {}, None, None)
+    return ErrorReportingArgs(
+        consts,
+        cast(Any, None),
+        structlog.stdlib.BoundLogger(logging.getLogger("addon"), [], {}),
+        sentry_sampling=sampling,
+    )
+
+
+def test_logs_are_sampled_by_level() -> None:
+    values = iter([0.05, 0.5, 0.95])
+    sampling = SentrySampling(
+        {logging.INFO: 0.1, logging.DEBUG: 0.0}, rand=lambda: next(values)
+    )
+    assert [sampling.sample_log(logging.INFO) for _ in range(3)] == [
+        True,
+        False,
+        False,
+    ]
+    assert all(sampling.sample_log(logging.ERROR) for _ in range(10))
+    assert sampling.dropped() == {LOGS: {"sampled": 2}, EVENTS: {}}
+
+
+def test_min_log_level() -> None:
+    assert SentrySampling().min_log_level() == logging.INFO
+    assert SentrySampling({logging.INFO: 0}).min_log_level() == logging.WARNING
+    rates = {level: 0.0 for level in range(logging.INFO, logging.CRITICAL + 1, 10)}
+    assert SentrySampling(rates).min_log_level() is None
+
+
+def test_events_per_minute_are_capped() -> None:
+    clock = FakeClock()
+    sampling = SentrySampling(max_events_per_minute=2, clock=clock)
+    assert [sampling.sample_event() for _ in range(4)] == [True, True, False, False]
+    # Logs are counted separately
+    assert sampling.sample_log(logging.INFO)
+    clock.now = 60
+    assert sampling.sample_event()
+    assert sampling.dropped() == {LOGS: {}, EVENTS: {"rate_limited": 2}}
+
+
+def test_records_are_filtered_before_sentry_handlers() -> None:
+    sampling = SentrySampling({logging.INFO: 0.0})
+    integration = LoggingIntegration(sentry_logs_level=sampling.min_log_level())
+    _add_record_filters(_args(sampling), integration)
+    logs_handler = cast(logging.Handler, integration._sentry_logs_handler)
+    events_handler = cast(logging.Handler, integration._handler)
+    assert not logs_handler.filter(_record("other", logging.WARNING))
+    assert not logs_handler.filter(_record("addon", logging.INFO))
+    assert logs_handler.filter(_record("addon", logging.WARNING))
+    assert not events_handler.filter(_record("other", logging.ERROR))
+    assert events_handler.filter(_record("addon", logging.ERROR))
+    assert sampling.dropped() == {
+        LOGS: {"other_logger": 1, "sampled": 1},
+        EVENTS: {"other_logger": 1},
+    }
+
+
+def test_before_send_hooks() -> None:
+    sampling = SentrySampling(max_events_per_minute=1)
+    args = _args(sampling)
+    other_log: Any = {"attributes": {"logger.name": "other"}}
+    addon_log: Any = {"attributes": {"logger.name": "addon"}}
+    assert _before_send_log(args, other_log, {}) is None
+    assert _before_send_log(args, addon_log, {}) is addon_log
+    event: Any = {}
+    assert _before_send(args, event, {"log_record": _record("other", 40)}) is None
+    assert _before_send(args, event, {}) is event
+    assert _before_send(args, event, {}) is None
+    assert sampling.dropped() == {
+        LOGS: {"other_logger": 1},
+        EVENTS: {"other_logger": 1, "rate_limited": 1},
+    }
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import gc
+import json
+import threading
+import time
+import warnings
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+import structlog
+from flask.testing import FlaskClient
+from werkzeug.test import Client
+
+from ankiutils.consts import AddonConsts
+from ankiutils.sveltekit import (
+    SveltekitServer,
+    decode_batch_response,
+    encode_batch_request,
+)
+
+from .helpers import AUTH
+
+
+def _fail(data: bytes) -> bytes:
+    raise RuntimeError("failed")
+
+
+@pytest.fixture
+def server(server: SveltekitServer) -> SveltekitServer:
+    server.add_proto_handler("svc", "echo", lambda data: data)
+    server.add_proto_handler("svc", "fail", _fail)
+    return server
+
+
+@pytest.fixture
+def client(server: SveltekitServer) -> FlaskClient:
+    return server.flask_app.test_client()
+
+
+def test_api_requires_auth(client: FlaskClient) -> None:
+    assert client.post("/api/svc/echo", data=b"x").status_code == 403
+    assert client.post("/api/_batch", data=b"").status_code == 403
+
+
+def test_single_calls(client: FlaskClient) -> None:
+    resp = client.post("/api/svc/echo", data=b"hello", headers=AUTH)
+    assert resp.status_code == 200
+    assert resp.data == b"hello"
+    resp = client.post("/api/svc/missing", data=b"", headers=AUTH)
+    assert resp.status_code == 404
+    resp = client.post("/api/svc/fail", data=b"", headers=AUTH)
+    assert resp.status_code == 500
+    assert json.loads(resp.data) == {"code": "internal", "message": "failed"}
+
+
+def test_batch_isolates_errors(server: SveltekitServer, client: FlaskClient) -> None:
+    dialog: Any = object()
+    server.add_proto_handler_for_dialog(dialog, "svc", "echo", lambda data: b"dlg")
+    body = encode_batch_request(
+        [
+            ("svc", "echo", b"one"),
+            ("svc", "fail", b""),
+            ("svc", "missing", b""),
+            ("svc", "echo", b"two"),
+        ]
+    )
+    resp = client.post("/api/_batch", data=body, headers=AUTH)
+    assert resp.status_code == 200
+    results = decode_batch_response(resp.data)
+    assert [status for status, _ in results] == [200, 500, 404, 200]
+    assert results[0][1] == b"one"
+    assert json.loads(results[1][1])["message"] == "failed"
+    assert results[3][1] == b"two"
+
+    resp = client.post(
+        "/api/_batch",
+        data=encode_batch_request([("svc", "echo", b"")]),
+        headers={**AUTH, "qt-widget-id": str(id(dialog))},
+    )
+    assert decode_batch_response(resp.data) == [(200, b"dlg")]
+
+
+def test_batch_rejects_truncated_frames(client: FlaskClient) -> None:
+    body = encode_batch_request([("svc", "echo", b"payload")])
+    resp = client.post("/api/_batch", data=body[:-1], headers=AUTH)
+    assert resp.status_code == 400
+
+
+def _sse_events(data: bytes) -> list[tuple[str, str]]:
+    events = []
+    for block in data.decode().strip().split("\n\n"):
+        event, payload = block.split("\n")
+        events.append((event.removeprefix("event: "), payload[len("data:") :].strip()))
+    return events
+
+
+def test_streaming_handler(server: SveltekitServer, client: FlaskClient) -> None:
+    def count(data: bytes) -> Iterator[bytes]:
+        for i in range(int(data)):
+            yield str(i).encode()
+
+    def fail_midway(data: bytes) -> Iterator[bytes]:
+        yield b"first"
+        raise RuntimeError("failed")
+
+    server.add_streaming_proto_handler("svc", "count", count)
+    server.add_streaming_proto_handler("svc", "fail", fail_midway)
+
+    resp = client.post("/api/_stream/svc/count", data=b"3", headers=AUTH)
+    assert resp.mimetype == "text/event-stream"
+    events = _sse_events(resp.data)
+    assert [base64.b64decode(data) for _, data in events[:-1]] == [b"0", b"1", b"2"]
+    assert events[-1] == ("end", "")
+
+    resp = client.post("/api/_stream/svc/fail", data=b"", headers=AUTH)
+    events = _sse_events(resp.data)
+    assert events[0] == ("message", base64.b64encode(b"first").decode())
+    assert events[1][0] == "error"
+    assert json.loads(events[1][1])["message"] == "failed"
+
+    resp = client.post("/api/_stream/svc/echo", data=b"", headers=AUTH)
+    assert resp.status_code == 404
+
+
+def test_streams_stop_when_dialog_handlers_are_removed(
+    server: SveltekitServer, client: FlaskClient
+) -> None:
+    dialog: Any = object()
+    closed = []
+
+    def forever(data: bytes) -> Iterator[bytes]:
+        try:
+            while True:
+                yield b"tick"
+                server.remove_proto_handlers_for_dialog(dialog)
+        finally:
+            closed.append(True)
+
+    server.add_streaming_proto_handler_for_dialog(dialog, "svc", "ticks", forever)
+    resp = client.post(
+        "/api/_stream/svc/ticks",
+        headers={**AUTH, "qt-widget-id": str(id(dialog))},
+    )
+    assert [event for event, _ in _sse_events(resp.data)] == ["message", "end"]
+    assert closed == [True]
+    assert not server.streaming_proto_handlers_for_dialog
+
+
+def test_async_handlers(server: SveltekitServer, client: FlaskClient) -> None:
+    async def slow_echo(data: bytes) -> bytes:
+        await asyncio.sleep(0.2)
+        return data
+
+    async def slow_fail(data: bytes) -> bytes:
+        await asyncio.sleep(0.2)
+        raise RuntimeError("failed")
+
+    server.add_proto_handler("svc", "slow_echo", slow_echo)
+    server.add_proto_handler("svc", "slow_fail", slow_fail)
+
+    resp = client.post("/api/svc/slow_echo", data=b"hello", headers=AUTH)
+    assert resp.status_code == 200
+    assert resp.data == b"hello"
+    resp = client.post("/api/svc/slow_fail", data=b"", headers=AUTH)
+    assert resp.status_code == 500
+    assert json.loads(resp.data) == {"code": "internal", "message": "failed"}
+
+    calls = [("svc", "slow_echo", str(i).encode()) for i in range(5)]
+    calls.append(("svc", "slow_fail", b""))
+    calls.append(("svc", "echo", b"sync"))
+    started_at = time.perf_counter()
+    resp = client.post("/api/_batch", data=encode_batch_request(calls), headers=AUTH)
+    # The async calls are awaited concurrently
+    assert time.perf_counter() - started_at < 0.2 * 3
+    results = decode_batch_response(resp.data)
+    assert results[:5] == [(200, str(i).encode()) for i in range(5)]
+    assert results[5][0] == 500
+    assert results[6] == (200, b"sync")
+
+
+def test_shutdown_cancels_pending_async_calls(
+    server: SveltekitServer, client: FlaskClient
+) -> None:
+    started = threading.Event()
+
+    async def hang(data: bytes) -> bytes:
+        started.set()
+        await asyncio.sleep(60)
+        return data
+
+    async def echo(data: bytes) -> bytes:
+        return data
+
+    server.add_proto_handler("svc", "hang", hang)
+    server.add_proto_handler("svc", "async_echo", echo)
+    responses: list[Any] = []
+    thread = threading.Thread(
+        target=lambda: responses.append(
+            client.post("/api/svc/hang", data=b"", headers=AUTH)
+        )
+    )
+    thread.start()
+    assert started.wait(5)
+    loop = server._event_loop
+    assert loop
+    server.shutdown()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert responses[0].status_code == 503
+    assert server._event_loop is None
+    deadline = time.monotonic() + 5
+    while not loop.is_closed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert loop.is_closed()
+    # Later calls get a new loop
+    resp = client.post("/api/svc/async_echo", data=b"again", headers=AUTH)
+    assert resp.data == b"again"
+    server.shutdown()
+
+
+def test_calls_after_the_loop_closed_are_not_left_unawaited(
+    server: SveltekitServer, client: FlaskClient
+) -> None:
+    async def echo(data: bytes) -> bytes:
+        return data
+
+    server.add_proto_handler("svc", "async_echo", echo)
+    loop = server._get_event_loop()
+    server.shutdown()
+    deadline = time.monotonic() + 5
+    while not loop.is_closed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # As if a request picked up the loop right before it was closed
+    server._event_loop = loop
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        resp = client.post("/api/svc/async_echo", data=b"", headers=AUTH)
+        gc.collect()
+    assert resp.status_code == 503
+    assert not [w for w in caught if "never awaited" in str(w.message)]
+    server._event_loop = None
+
+
+def test_lean_dispatch_matches_flask(consts: AddonConsts) -> None:
+    servers = [
+        SveltekitServer(consts, structlog.stdlib.get_logger(), lean_dispatch=lean)
+        for lean in (False, True)
+    ]
+    dialog: Any = object()
+    headers = {**AUTH, "qt-widget-id": str(id(dialog))}
+    requests: list[tuple[str, bytes, dict[str, str]]] = [
+        ("/api/svc/echo", b"hello", AUTH),
+        ("/api/svc/echo", b"hello", {}),
+        ("/api/svc/fail", b"", AUTH),
+        ("/api/svc/missing", b"", AUTH),
+        ("/api/svc/dialog", b"", headers),
+        ("/api/_batch", encode_batch_request([("svc", "echo", b"x")]), AUTH),
+    ]
+    responses = []
+    for server in servers:
+        server.add_proto_handler("svc", "echo", lambda data: data)
+        server.add_proto_handler("svc", "fail", _fail)
+        server.add_proto_handler_for_dialog(dialog, "svc", "dialog", lambda _: b"d")
+        client = Client(server.wsgi_app)
+        responses.append(
+            [
+                (resp.status_code, resp.mimetype, resp.data)
+                for resp in (
+                    client.post(path, data=data, headers=headers)
+                    for path, data, headers in requests
+                )
+            ]
+        )
+    assert responses[0] == responses[1]
+    assert [status for status, _, _ in responses[1]] == [200, 403, 500, 404, 200, 200]
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import gzip
+import os
+from pathlib import Path
+
+import pytest
+import structlog
+
+from ankiutils.consts import AddonConsts
+from ankiutils.sveltekit import SveltekitServer
+from ankiutils.sveltekit_assets import AssetCache, CachedAsset
+
+SCRIPT = b"console.log('hello world');\n" * 100
+MEDIA = bytes(range(256)) * 8192
+
+
+@pytest.fixture
+def web_root(tmp_path: Path) -> Path:
+    root = tmp_path / "web" / "sveltekit"
+    (root / "_app" / "immutable").mkdir(parents=True)
+    (root / "index.html").write_bytes(b"<html></html>")
+    (root / "_app" / "immutable" / "app.js").write_bytes(SCRIPT)
+    (root / "media.bin").write_bytes(MEDIA)
+    return root
+
+
+@pytest.fixture
+def server(web_root: Path) -> SveltekitServer:
+    consts = AddonConsts(
+        "addon", "addon", web_root.parent.parent, "0.0.1", None, {}, None, None
+    )
+    return SveltekitServer(consts, structlog.stdlib.get_logger())
+
+
+def test_cache_hits_and_misses(web_root: Path) -> None:
+    cache = AssetCache(web_root)
+    asset = cache.get("_app/immutable/app.js")
+    assert isinstance(asset, CachedAsset)
+    assert asset.data == SCRIPT
+    assert asset.mimetype in ("text/javascript", "application/javascript")
+    assert gzip.decompress(asset.variants["gzip"]) == SCRIPT
+    assert cache.get("_app/immutable/app.js") is asset
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get("missing.js") is None
+    assert cache.get("../sveltekit/index.html") is None
+
+
+def test_cache_lru_eviction(web_root: Path) -> None:
+    for i in range(3):
+        (web_root / f"{i}.bin").write_bytes(bytes(100))
+    cache = AssetCache(web_root, max_bytes=250)
+    cache.get("0.bin")
+    cache.get("1.bin")
+    cache.get("0.bin")
+    cache.get("2.bin")
+    assert len(cache) == 2
+    assert cache.size == 200
+    cache.get("0.bin")
+    assert cache.hits == 2
+
+
+def test_cache_reloads_changed_files(web_root: Path) -> None:
+    cache = AssetCache(web_root, check_changes=True)
+    first = cache.get("index.html")
+    assert first is not None
+    path = web_root / "index.html"
+    path.write_bytes(b"<html>changed</html>")
+    os.utime(path, ns=(first.mtime_ns + 10**9, first.mtime_ns + 10**9))
+    second = cache.get("index.html")
+    assert isinstance(second, CachedAsset)
+    assert second.data == b"<html>changed</html>"
+    assert second.etag != first.etag
+    (web_root / "new.html").write_bytes(b"new")
+    assert cache.get("new.html") is not None
+
+
+def test_server_conditional_and_compressed_responses(
+    server: SveltekitServer,
+) -> None:
+    client = server.flask_app.test_client()
+    resp = client.get("/_app/immutable/app.js", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Cache-Control"] == "max-age=31536000"
+    assert gzip.decompress(resp.data) == SCRIPT
+    etag = resp.headers["ETag"]
+
+    resp = client.get(
+        "/_app/immutable/app.js",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+    )
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+    resp = client.get("/_app/immutable/app.js", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.data == SCRIPT
+    assert client.get("/missing.js").status_code == 404
+
+
+def test_large_files_are_not_loaded(web_root: Path) -> None:
+    cache = AssetCache(web_root, stream_threshold=len(MEDIA) - 1)
+    asset = cache.get("media.bin")
+    assert asset is not None
+    assert not isinstance(asset, CachedAsset)
+    assert asset.size == len(MEDIA)
+    assert cache.size == 0
+
+
+def test_server_streams_large_files_with_ranges(server: SveltekitServer) -> None:
+    server.assets.stream_threshold = 1024
+    client = server.flask_app.test_client()
+    resp = client.get("/media.bin")
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.data == MEDIA
+
+    resp = client.get("/media.bin", headers={"Range": "bytes=1000-1999"})
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == f"bytes 1000-1999/{len(MEDIA)}"
+    assert resp.data == MEDIA[1000:2000]
+
+    resp = client.get("/media.bin", headers={"Range": f"bytes={len(MEDIA)}-"})
+    assert resp.status_code == 416
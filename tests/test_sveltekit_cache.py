@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+from flask.testing import FlaskClient
+
+from ankiutils.sveltekit import SveltekitServer
+from ankiutils.sveltekit_cache import ProtoResultCache
+
+from .helpers import AUTH, FakeClock
+
+
+def test_cache_ttl() -> None:
+    clock = FakeClock()
+    cache = ProtoResultCache(clock=clock)
+    key = cache.key(None, "svc", "method", b"payload")
+    cache.put(key, b"result", ttl=10)
+    assert cache.get(key) == b"result"
+    clock.now = 10
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_cache_lru_and_invalidation() -> None:
+    cache = ProtoResultCache(max_bytes=10)
+    keys = [cache.key(None, "svc", str(i), b"") for i in range(3)]
+    cache.put(keys[0], b"aaaa")
+    cache.put(keys[1], b"bbbb")
+    cache.get(keys[0])
+    cache.put(keys[2], b"cccc")
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == b"aaaa"
+    assert cache.size == 8
+
+    dialog_key = cache.key(1, "svc", "0", b"")
+    cache.put(dialog_key, b"d")
+    cache.invalidate_scope(1)
+    assert cache.get(dialog_key) is None
+    cache.invalidate("svc", "0")
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == b"cccc"
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_server_caches_opted_in_handlers(server: SveltekitServer) -> None:
+    client: FlaskClient = server.flask_app.test_client()
+    calls: list[bytes] = []
+
+    def handler(data: bytes) -> bytes:
+        calls.append(data)
+        return data.upper()
+
+    async def async_handler(data: bytes) -> bytes:
+        await asyncio.sleep(0)
+        calls.append(data)
+        return data.lower()
+
+    server.add_proto_handler("svc", "upper", handler, cache=True)
+    server.add_proto_handler("svc", "lower", async_handler, cache=True)
+    server.add_proto_handler("svc", "uncached", handler)
+    for _ in range(3):
+        assert client.post("/api/svc/upper", data=b"a", headers=AUTH).data == b"A"
+        assert client.post("/api/svc/lower", data=b"B", headers=AUTH).data == b"b"
+        client.post("/api/svc/uncached", data=b"c", headers=AUTH)
+    assert calls == [b"a", b"B", b"c", b"c", b"c"]
+
+    server.invalidate_cached_results("svc", "upper")
+    client.post("/api/svc/upper", data=b"a", headers=AUTH)
+    client.post("/api/svc/lower", data=b"B", headers=AUTH)
+    assert calls[-1] == b"a"
+
+
+def test_dialog_cache_entries_are_dropped(server: SveltekitServer) -> None:
+    client: FlaskClient = server.flask_app.test_client()
+    dialog: Any = object()
+    server.add_proto_handler_for_dialog(
+        dialog, "svc", "get", lambda data: b"dialog", cache=True
+    )
+    headers = {**AUTH, "qt-widget-id": str(id(dialog))}
+    assert client.post("/api/svc/get", headers=headers).data == b"dialog"
+    assert len(server.result_cache) == 1
+    server.remove_proto_handlers_for_dialog(dialog)
+    assert len(server.result_cache) == 0
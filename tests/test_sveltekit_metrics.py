@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+import urllib.request
+from collections.abc import Iterator
+
+import pytest
+import structlog
+
+from ankiutils.consts import AddonConsts
+from ankiutils.sveltekit import SveltekitServer, init_server
+from ankiutils.sveltekit_metrics import LatencyHistogram
+
+from .helpers import AUTH
+
+
+@pytest.fixture
+def server(
+    consts: AddonConsts, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[SveltekitServer]:
+    monkeypatch.setenv("ADDON_SERVER_THREADS", "2")
+    server = init_server(consts, structlog.stdlib.get_logger())
+    server.add_proto_handler("svc", "echo", lambda data: data)
+    yield server
+    server.shutdown()
+
+
+def _request(server: SveltekitServer, path: str, data: bytes | None = None) -> bytes:
+    req = urllib.request.Request(
+        f"{server.get_url()}{path}",
+        data=data,
+        headers={**AUTH, "Content-Type": "application/proto"},
+    )
+    with urllib.request.urlopen(req) as resp:
+        return resp.read()
+
+
+def test_histogram_quantiles() -> None:
+    histogram = LatencyHistogram()
+    for ms in (0.5, 0.5, 3, 40, 900):
+        histogram.observe(ms / 1000)
+    assert histogram.count == 5
+    assert histogram.quantile(0.5) == 5
+    assert histogram.quantile(0.99) == 900
+    assert histogram.asdict()["buckets"] == {"1.0": 2, "5.0": 1, "50.0": 1, "1000.0": 1}
+
+
+def test_server_records_metrics(server: SveltekitServer) -> None:
+    for _ in range(3):
+        assert _request(server, "/api/svc/echo", b"x") == b"x"
+    snapshot = json.loads(_request(server, "/api/_metrics"))
+    assert snapshot["threads"] == 2
+    # The metrics request itself is in flight, and previous requests may not
+    # have been marked as finished yet
+    assert 1 <= snapshot["in_flight"] <= 2
+    assert snapshot["requests_total"] == 4
+    assert snapshot["queue_wait"]["count"] == 4
+    assert snapshot["api"]["svc/echo"]["count"] == 3